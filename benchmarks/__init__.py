@@ -0,0 +1,32 @@
+"""asv benchmarks of pyciss, running on a synthetic database.
+
+The database is created once by `pyciss.synthetic.make_database` in
+PYCISS_BENCH_DIR (by default in the temporary folder) and PYCISS_CONFIG is
+set to its config before pyciss is imported, so the benchmarks need neither
+ISIS nor any downloaded data.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+# increase to recreate existing benchmark databases
+DATA_VERSION = 2
+N_IMAGES = 2
+# map-projected full NAC frames are typically of this size
+CUBE_SHAPE = (1000, 2000)
+
+BENCH_DIR = Path(
+    os.environ.get(
+        "PYCISS_BENCH_DIR", Path(tempfile.gettempdir()) / "pyciss_benchmarks"
+    )
+) / f"v{DATA_VERSION}"
+
+
+# before pyciss reads the config
+os.environ["PYCISS_CONFIG"] = str(BENCH_DIR / "pyciss.ini")
+
+from pyciss import synthetic  # noqa: E402
+
+if not (BENCH_DIR / "pyciss.ini").exists():
+    synthetic.make_database(BENCH_DIR, n_images=N_IMAGES, shape=CUBE_SHAPE)
+CUBES = sorted((BENCH_DIR / "db").glob("*/*.cal.dst.map.cub"))
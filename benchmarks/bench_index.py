@@ -0,0 +1,61 @@
+from pyciss import index, meta
+from pyciss.coverage import CoverageIndex
+from pyciss.resonance_catalog import ResonanceCatalog
+from pyciss.io import PathManager
+
+from . import CUBES
+
+
+class IndexSuite:
+    def setup(self):
+        self.summary = index.ring_summary_index()
+
+    def time_ring_summary_index(self):
+        index.ring_summary_index()
+
+    def time_get_resonances_inside_radius(self):
+        self.summary.apply(index.get_resonances_inside_radius, axis=1)
+
+    def time_get_all_resonances(self):
+        meta.get_all_resonances()
+
+    def time_load_resonance_catalog(self):
+        ResonanceCatalog.load()
+
+
+class CoverageSuite:
+    def setup(self):
+        self.coverage = CoverageIndex.load()
+        self.radius = float(self.coverage.rmin[len(self.coverage) // 2]) + 100
+
+    def time_build(self):
+        CoverageIndex.build()
+
+    def time_load(self):
+        CoverageIndex.load()
+
+    def time_covering_in_year(self):
+        self.coverage.covering(
+            self.radius, 50, start="2005", end="2006", max_resolution=1,
+            instrument="ISSNA",
+        )
+
+    def time_covering(self):
+        self.coverage.covering(self.radius, 50, longitude=(350, 10))
+
+    def time_chained_filters(self):
+        clearnacs = index.get_clearnacs_ring_images()
+        index.filter_for_ringspan(clearnacs, 1000)
+
+
+class PathManagerSuite:
+    def setup(self):
+        self.img_ids = [f.parent.name for f in CUBES] * 500
+
+    def time_create(self):
+        for img_id in self.img_ids:
+            PathManager(img_id)
+
+    def time_cubepath(self):
+        for img_id in self.img_ids:
+            PathManager(img_id).cubepath
@@ -0,0 +1,27 @@
+import tempfile
+
+from pyciss import quicklooks
+from pyciss.ringcube import RingCube
+
+from . import CUBES
+
+
+class QuicklookSuite:
+    params = quicklooks.KINDS
+    param_names = ["kind"]
+
+    def setup(self, kind):
+        self.outdir = tempfile.TemporaryDirectory()
+        self.cube = RingCube(str(CUBES[0]))
+        self.renderer = quicklooks.QuicklookRenderer(kind)
+
+    def teardown(self, kind):
+        self.outdir.cleanup()
+
+    def time_render(self, kind):
+        self.renderer.render(self.cube, self.outdir.name)
+
+    def time_render_quicklooks(self, kind):
+        quicklooks.render_quicklooks(
+            CUBES, kind, outdir=self.outdir.name, processes=1, force=True
+        )
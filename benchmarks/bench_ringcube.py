@@ -0,0 +1,43 @@
+import numpy as np
+
+from pyciss import ringcube
+
+from . import CUBES
+
+
+class RingCubeSuite:
+    def setup(self):
+        self.fname = str(CUBES[0])
+        self.cube = ringcube.RingCube(self.fname)
+        self.img = self.cube.img
+
+    def time_open(self):
+        ringcube.RingCube(self.fname)
+
+    def time_img(self):
+        self.cube.img
+
+    def peakmem_img(self):
+        self.cube.img
+
+    def time_to_xarray(self):
+        self.cube.to_xarray()
+
+    def time_mad(self):
+        ringcube.mad(self.img)
+
+    def time_xr_mad(self):
+        ringcube.xr_mad(self.cube.xarray)
+
+    def time_statsdf(self):
+        self.cube.statsdf
+
+    def time_xdataset(self):
+        self.cube.xdataset
+
+    def time_calc_clim(self):
+        # calc_clim replaces inf in place, so work on a copy as imshow would
+        self.cube.calc_clim(np.array(self.img))
+
+    def time_median_profile(self):
+        self.cube.median_profile
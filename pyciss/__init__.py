@@ -5,4 +5,11 @@ import logging
 # this prevents messages sent to sys.stderr if no logging was configured on application-side
 logging.getLogger("pyciss").addHandler(logging.NullHandler())
 
-from .ringcube import RingCube
+
+def __getattr__(name):
+    # importing ringcube reads the ring summary index, only do it when needed
+    if name == "RingCube":
+        from .ringcube import RingCube
+
+        return RingCube
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,232 @@
+"""Zarr archive for processed ring cubes.
+
+`export_cubes` writes the `RingCube.xdataset` of many images into one
+chunked and compressed Zarr store, one group per image id, together with a
+`catalog` group holding the key label fields of all images. The metadata
+of the store is consolidated, so opening it is one small read, and the
+image data is read lazily via dask.
+
+Reading an archive with `RingArchive` does not require pysis or any label
+parsing.
+"""
+import logging
+from pathlib import Path
+
+import pandas as pd
+import xarray as xr
+
+try:
+    import zarr
+except ImportError:
+    _ZARR_INSTALLED = False
+else:
+    _ZARR_INSTALLED = True
+
+logger = logging.getLogger(__name__)
+
+CATALOG_GROUP = "catalog"
+CATALOG_COLUMNS = [
+    "image_id",
+    "imagetime",
+    "minrad",
+    "maxrad",
+    "minlon",
+    "maxlon",
+    "resolution",
+    "meta_pixres",
+    "litstatus",
+    "filename",
+]
+
+
+def _check_zarr():
+    if not _ZARR_INSTALLED:
+        raise ImportError("The pyciss archive requires zarr.")
+
+
+def label_fields(cube):
+    """Collect the key label fields of a RingCube.
+
+    Parameters
+    ----------
+    cube : pyciss.ringcube.RingCube
+        Map-projected ring cube.
+
+    Returns
+    -------
+    dict
+        JSON-serializable label fields. Radii are in Mm, longitudes in degrees
+        and resolutions in m/pixel.
+    """
+    meta_pixres = cube.meta_pixres
+    return {
+        "image_id": cube.image_id,
+        "imagetime": cube.imagetime.isoformat(),
+        "minrad": float(cube.minrad.value),
+        "maxrad": float(cube.maxrad.value),
+        "minlon": float(cube.minlon.value),
+        "maxlon": float(cube.maxlon.value),
+        "resolution": float(cube.resolution_val.value),
+        "meta_pixres": float(getattr(meta_pixres, "value", meta_pixres)),
+        "litstatus": cube.meta_litstatus,
+        "filename": str(cube.filename),
+    }
+
+
+def export_cubes(cubes, store, chunks=256, overwrite=False):
+    """Export many ring cubes into one Zarr store.
+
+    Parameters
+    ----------
+    cubes : iterable of pyciss.ringcube.RingCube, str or pathlib.Path
+        Cubes to export. Strings and paths are opened as RingCube.
+    store : str or pathlib.Path
+        Path of the Zarr store. Created if it does not exist, otherwise the
+        cubes are added to it.
+    chunks : int
+        Chunk size along radius.
+    overwrite : bool
+        Overwrite images that are already in the store. By default they are
+        skipped.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The catalog of the store after the export.
+    """
+    _check_zarr()
+    from .ringcube import RingCube
+
+    store = str(store)
+    catalog = read_catalog(store) if Path(store).exists() else None
+    rows = []
+    for cube in cubes:
+        if not isinstance(cube, RingCube):
+            cube = RingCube(cube)
+        if not overwrite and catalog is not None and cube.image_id in catalog.index:
+            logger.info("%s already in archive, skipping.", cube.image_id)
+            continue
+        fields = label_fields(cube)
+        ds = cube.xdataset.chunk({"azimuth": -1, "radius": chunks})
+        ds.attrs.update(fields)
+        ds.to_zarr(store, group=cube.image_id, mode="w", consolidated=False)
+        logger.info("Exported %s to %s.", cube.image_id, store)
+        rows.append(fields)
+    new = pd.DataFrame(rows, columns=CATALOG_COLUMNS).set_index("image_id")
+    if catalog is not None:
+        new = pd.concat([catalog.drop(new.index, errors="ignore"), new])
+    write_catalog(new.sort_index(), store)
+    return new
+
+
+def write_catalog(catalog, store):
+    """Write the catalog table and consolidate the store metadata.
+
+    Parameters
+    ----------
+    catalog : pandas.DataFrame
+        Label fields, indexed by image_id.
+    store : str or pathlib.Path
+        Path of the Zarr store.
+    """
+    _check_zarr()
+    # times are stored as ISO strings, independent of timezone support
+    imagetime = pd.to_datetime(catalog.imagetime).map(lambda t: t.isoformat())
+    catalog = catalog.assign(imagetime=imagetime)
+    ds = xr.Dataset.from_dataframe(catalog.rename_axis("image_id"))
+    ds.to_zarr(str(store), group=CATALOG_GROUP, mode="w", consolidated=False)
+    zarr.consolidate_metadata(str(store))
+
+
+def read_catalog(store):
+    """Read the catalog table of a Zarr archive.
+
+    Parameters
+    ----------
+    store : str or pathlib.Path
+        Path of the Zarr store.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Label fields, indexed by image_id.
+    """
+    _check_zarr()
+    ds = xr.open_zarr(str(store), group=CATALOG_GROUP, consolidated=True)
+    df = ds.to_dataframe()
+    df["imagetime"] = pd.to_datetime(df.imagetime)
+    return df
+
+
+class RingArchive(object):
+    """Lazy read access to a Zarr archive of ring cubes.
+
+    Parameters
+    ----------
+    store : str or pathlib.Path
+        Path of the Zarr store.
+
+    Attributes
+    ----------
+    catalog : pandas.DataFrame
+        Label fields of all images in the archive, indexed by image_id.
+    """
+
+    def __init__(self, store):
+        _check_zarr()
+        self.store = str(store)
+        self.catalog = read_catalog(self.store)
+
+    @property
+    def image_ids(self):
+        return list(self.catalog.index)
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __contains__(self, image_id):
+        return image_id in self.catalog.index
+
+    def __getitem__(self, image_id):
+        """Open the dataset of one image lazily.
+
+        Returns
+        -------
+        xarray.Dataset
+            Same variables as `RingCube.xdataset`, backed by dask arrays.
+        """
+        if image_id not in self:
+            raise KeyError(f"{image_id} not in archive {self.store}.")
+        return xr.open_zarr(self.store, group=image_id, consolidated=True)
+
+    def query(self, expr):
+        """Filter the catalog with `pandas.DataFrame.query`.
+
+        Returns
+        -------
+        list of str
+            Matching image ids.
+        """
+        return list(self.catalog.query(expr).index)
+
+    def profiles(self, image_ids=None, variable="median_az"):
+        """Collect one radial profile variable for many images.
+
+        Parameters
+        ----------
+        image_ids : list of str, optional
+            Images to collect, all by default.
+        variable : str
+            Profile variable, one of 'median_az', 'absmad', 'relmad', 'amin'
+            or 'amax'.
+
+        Returns
+        -------
+        dict
+            Lazy xarray.DataArray per image_id.
+        """
+        image_ids = self.image_ids if image_ids is None else image_ids
+        return {image_id: self[image_id][variable] for image_id in image_ids}
+
+    def __repr__(self):
+        return f"RingArchive at {self.store} with {len(self)} images."
@@ -0,0 +1,82 @@
+"""Tables used by many pyciss modules, loaded once per process on first use.
+
+'ring_summary'
+    The ring summary index of `index.ring_summary_index`, with an additional
+    `file_id` column holding the image id. None if the index is missing.
+'resonances'
+    All ring resonances of `meta.get_all_resonances`, sorted by radius, from
+    the compiled resonance catalog.
+'resonance_catalog'
+    The compiled `resonance_catalog.ResonanceCatalog`.
+
+`install` replaces a table, e.g. in a worker process that received it from
+its parent via shared memory, see `pyciss.workers`.
+"""
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_tables = {}
+# reentrant, as the resonances table is made from the resonance catalog
+_lock = threading.RLock()
+
+
+def load_ring_summary():
+    "Read the ring summary index and add the `file_id` column."
+    from .index import ring_summary_index
+
+    df = ring_summary_index()
+    if df is None:
+        return None
+    df["file_id"] = df.FILE_SPECIFICATION_NAME.map(lambda x: Path(x).stem.split("_")[0])
+    return df
+
+
+def load_resonances():
+    return get("resonance_catalog").to_dataframe()
+
+
+def load_resonance_catalog():
+    from .resonance_catalog import ResonanceCatalog
+
+    return ResonanceCatalog.load()
+
+
+LOADERS = {
+    "ring_summary": load_ring_summary,
+    "resonances": load_resonances,
+    "resonance_catalog": load_resonance_catalog,
+}
+
+
+def get(name):
+    """Return a table, loading it if this process did not yet.
+
+    Parameters
+    ----------
+    name : {'ring_summary', 'resonances', 'resonance_catalog'}
+
+    Returns
+    -------
+    pd.DataFrame or ResonanceCatalog
+    """
+    try:
+        return _tables[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _tables:
+            logger.debug("Loading catalog table %s", name)
+            _tables[name] = LOADERS[name]()
+    return _tables[name]
+
+
+def install(name, table):
+    "Use `table` as the table `name` in this process."
+    _tables[name] = table
+
+
+def is_loaded(name):
+    return name in _tables
@@ -0,0 +1,315 @@
+"""Spatio-temporal index of the ring coverage of the ISS images.
+
+Finding the images that cover a ring radius at a given time and resolution
+otherwise means filtering the whole cumulative index with
+`index.get_clearnacs_ring_images` and `index.filter_for_ringspan`, copying a
+DataFrame in every step. `CoverageIndex` keeps only what these queries need
+as numpy arrays: image time, ring radius and longitude range, finest radial
+resolution, instrument and filters, sorted by time and stored as a .npz file
+next to the index files. A query binary-searches the time range, or the
+sorted minimum radii if no time range is given, and tests the remaining
+intervals vectorized, which takes milliseconds for the full mission:
+
+>>> cov = CoverageIndex.load()
+>>> cov.covering(150000, 50, start="2008", end="2009", max_resolution=1,
+...              instrument="ISSNA")
+"""
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .index import get_index_dir, read_cumulative_iss_index, ring_summary_index
+
+logger = logging.getLogger(__name__)
+
+FNAME = "coverage_index.npz"
+SOURCES = ["COISS_2999_index.hdf", "COISS_2999_ring_summary.hdf"]
+TIME_COLUMNS = ["isotime", "IMAGE_MID_TIME", "IMAGE_TIME", "START_TIME"]
+# PDS time format with day of year, e.g. 2008-123T12:34:56.789
+PDS_TIME_FORMAT = "%Y-%jT%H:%M:%S.%f"
+CODED_COLUMNS = {
+    "instrument": "INSTRUMENT_ID",
+    "filter1": "FILTER_NAME_1",
+    "filter2": "FILTER_NAME_2",
+}
+
+
+def parse_times(values):
+    """Convert index times to nanoseconds since 1970.
+
+    Parameters
+    ----------
+    values : array-like
+        Datetimes, or strings in ISO or PDS day-of-year format.
+
+    Returns
+    -------
+    numpy.ndarray of int64
+        NaT for unparsable times is the minimum int64.
+    """
+    values = pd.Series(values)
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        strings = values.astype(str).str.rstrip("Z")
+        times = pd.to_datetime(strings, format=PDS_TIME_FORMAT, errors="coerce")
+        missing = times.isna()
+        if missing.any():
+            times[missing] = pd.to_datetime(
+                strings[missing], format="ISO8601", errors="coerce"
+            )
+        values = times
+    return values.to_numpy(dtype="datetime64[ns]").view("int64")
+
+
+def _to_ns(time):
+    return pd.Timestamp(time).value
+
+
+def _file_ids(df):
+    "Image ids from the file names, e.g. data/.../N1467345444_1.LBL -> N1467345444."
+    names = df.FILE_SPECIFICATION_NAME
+    return np.array([name.rpartition("/")[2].partition("_")[0] for name in names])
+
+
+class CoverageIndex(object):
+    """Ring coverage of many images, sorted by time.
+
+    Use `CoverageIndex.load` for the cached index of the configured index
+    folder, or `CoverageIndex.from_dataframe` for any index table.
+
+    Parameters
+    ----------
+    arrays : dict
+        file_id (str), time (int64 ns), rmin, rmax, lonmin, lonmax,
+        resolution (float64, km and degrees), and the codes and names of
+        the instruments and filters, as made by `from_dataframe`.
+    """
+
+    def __init__(self, arrays):
+        for key, value in arrays.items():
+            setattr(self, key, value)
+        # positions sorted by minimum radius, for queries without time range
+        self.by_rmin = np.argsort(self.rmin, kind="stable")
+        self.rmin_sorted = self.rmin[self.by_rmin]
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_dataframe(cls, df, resolution=None):
+        """Create the index from a cumulative index table.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Table like `index.read_cumulative_iss_index`, with
+            FILE_SPECIFICATION_NAME, MINIMUM/MAXIMUM_RING_RADIUS and one of
+            the time columns in `TIME_COLUMNS`. Ring longitudes, radial
+            resolution, instrument and filters are used if present.
+            Rows without ring radii are left out.
+        resolution : pd.Series, optional
+            Finest radial resolution in km by image id, if `df` does not
+            have a FINEST_RADIAL_RESOLUTION column, e.g. from the ring
+            summary index.
+
+        Returns
+        -------
+        CoverageIndex
+        """
+        rmin = df.MINIMUM_RING_RADIUS.to_numpy(dtype="float64")
+        rmax = df.MAXIMUM_RING_RADIUS.to_numpy(dtype="float64")
+        # the index uses huge values instead of NaN in places
+        keep = (rmin > 0) & (rmax > 0) & (rmax < 1e90)
+        df = df[keep]
+        try:
+            time_column = next(col for col in TIME_COLUMNS if col in df)
+        except StopIteration:
+            raise KeyError(f"The index needs one of the columns {TIME_COLUMNS}.")
+        time = parse_times(df[time_column])
+        order = np.argsort(time, kind="stable")
+        df = df.iloc[order]
+
+        def column(name, default=np.nan):
+            if name not in df:
+                return np.full(len(df), default, dtype="float64")
+            return df[name].to_numpy(dtype="float64")
+
+        arrays = dict(
+            file_id=_file_ids(df),
+            time=time[order],
+            rmin=column("MINIMUM_RING_RADIUS"),
+            rmax=column("MAXIMUM_RING_RADIUS"),
+            lonmin=column("MINIMUM_RING_LONGITUDE", 0.0),
+            lonmax=column("MAXIMUM_RING_LONGITUDE", 360.0),
+            resolution=column("FINEST_RADIAL_RESOLUTION"),
+        )
+        if resolution is not None and "FINEST_RADIAL_RESOLUTION" not in df:
+            resolution = resolution.groupby(level=0).min()
+            arrays["resolution"] = resolution.reindex(arrays["file_id"]).to_numpy(
+                dtype="float64"
+            )
+        for key, col in CODED_COLUMNS.items():
+            values = df[col].astype(str).str.strip() if col in df else [""] * len(df)
+            names, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+            arrays[key + "_names"] = names
+            arrays[key + "_code"] = codes.astype("int16")
+        return cls(arrays)
+
+    @classmethod
+    def build(cls):
+        """Create the index from the index files of the configured index folder.
+
+        The finest radial resolution is taken from the ring summary index.
+        """
+        summary = ring_summary_index()
+        resolution = None
+        if summary is not None:
+            resolution = pd.Series(
+                summary.FINEST_RADIAL_RESOLUTION.to_numpy(), index=_file_ids(summary)
+            )
+        return cls.from_dataframe(read_cumulative_iss_index(), resolution)
+
+    @classmethod
+    def load(cls, path=None, rebuild=False):
+        """Load the cached index, building it if missing or older than the index files.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path, optional
+            Cache file, default `coverage_index.npz` in the index folder.
+        rebuild : bool
+            Build the index even if the cache is up to date.
+
+        Returns
+        -------
+        CoverageIndex
+        """
+        indexdir = get_index_dir()
+        path = indexdir / FNAME if path is None else Path(path)
+        sources = [indexdir / fname for fname in SOURCES]
+        newest = max((p.stat().st_mtime for p in sources if p.exists()), default=0)
+        if not rebuild and path.exists() and path.stat().st_mtime >= newest:
+            with np.load(str(path), allow_pickle=False) as f:
+                return cls({key: f[key] for key in f.files})
+        logger.info("Building the coverage index %s.", path)
+        coverage = cls.build()
+        coverage.save(path)
+        return coverage
+
+    def save(self, path):
+        "Write the index to the .npz file `path`."
+        path = Path(path)
+        keys = ["file_id", "time", "rmin", "rmax", "lonmin", "lonmax", "resolution"]
+        for key in CODED_COLUMNS:
+            keys.extend([key + "_names", key + "_code"])
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(str(tmp), **{key: getattr(self, key) for key in keys})
+        os.replace(str(tmp), str(path))
+
+    def _code(self, key, value):
+        names = getattr(self, key + "_names")
+        found = np.flatnonzero(names == value)
+        # -1 matches no row
+        return found[0] if len(found) else -1
+
+    def query_positions(
+        self,
+        rmin=None,
+        rmax=None,
+        longitude=None,
+        start=None,
+        end=None,
+        max_resolution=None,
+        instrument=None,
+        filters=None,
+    ):
+        """Positions of the images matching all given conditions.
+
+        Parameters
+        ----------
+        rmin, rmax : float, optional
+            Radius range in km the images have to cover completely.
+        longitude : float or (float, float), optional
+            Ring longitude or longitude range in degrees the images have to
+            cover. Ranges crossing 360 degrees are supported.
+        start, end : str or datetime, optional
+            Time range of the images, `end` exclusive, e.g. '2008', '2009'.
+        max_resolution : float, optional
+            Maximum finest radial resolution in km/pixel.
+        instrument : {'ISSNA', 'ISSWA'}, optional
+        filters : (str, str), optional
+            Filter names, e.g. ('CL1', 'CL2').
+
+        Returns
+        -------
+        numpy.ndarray of int
+            Positions in the time-sorted arrays, ascending.
+        """
+        if start is not None or end is not None:
+            lo = 0 if start is None else np.searchsorted(self.time, _to_ns(start))
+            hi = (
+                len(self)
+                if end is None
+                else np.searchsorted(self.time, _to_ns(end), side="left")
+            )
+            pos = np.arange(lo, max(lo, hi))
+        elif rmin is not None:
+            n = np.searchsorted(self.rmin_sorted, rmin, side="right")
+            pos = np.sort(self.by_rmin[:n])
+        else:
+            pos = np.arange(len(self))
+
+        mask = np.ones(len(pos), dtype=bool)
+        if rmin is not None:
+            mask &= self.rmin[pos] <= rmin
+        if rmax is not None:
+            mask &= self.rmax[pos] >= rmax
+        if max_resolution is not None:
+            mask &= self.resolution[pos] <= max_resolution
+        if instrument is not None:
+            mask &= self.instrument_code[pos] == self._code("instrument", instrument)
+        if filters is not None:
+            mask &= self.filter1_code[pos] == self._code("filter1", filters[0])
+            mask &= self.filter2_code[pos] == self._code("filter2", filters[1])
+        if longitude is not None:
+            lon0, lon1 = np.broadcast_to(longitude, 2)
+            lonmin = self.lonmin[pos]
+            width = self.lonmax[pos] - lonmin
+            # the range of an image crosses 360 degrees if lonmax < lonmin
+            width = np.where(width < 0, width + 360, width)
+            offset = (lon0 - lonmin) % 360
+            mask &= (width >= 360) | (offset + (lon1 - lon0) % 360 <= width)
+        return pos[mask]
+
+    def query(self, *args, **kwargs):
+        """Images matching all given conditions, see `query_positions`.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per image, sorted by time.
+        """
+        pos = self.query_positions(*args, **kwargs)
+        return pd.DataFrame(
+            dict(
+                file_id=self.file_id[pos].astype(object),
+                time=pd.to_datetime(self.time[pos]),
+                instrument=self.instrument_names[self.instrument_code[pos]],
+                rmin=self.rmin[pos],
+                rmax=self.rmax[pos],
+                lonmin=self.lonmin[pos],
+                lonmax=self.lonmax[pos],
+                resolution=self.resolution[pos],
+            )
+        )
+
+    def covering(self, radius, delta=0.0, **kwargs):
+        """Images covering `radius` ± `delta` km, see `query` for the other conditions.
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        return self.query(radius - delta, radius + delta, **kwargs)
@@ -3,14 +3,9 @@ import signal
 import logging
 import subprocess
 import time
-from ipyparallel import Client
 
 from . import io, opusapi
-
-try:
-    import pipeline
-except ImportError:
-    pass
+from .store import ProductStore
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +15,7 @@ def download_file_id(file_id):
     opus = opusapi.OPUS()
     opus.query_image_id(file_id)
     basepath = opus.download_results()
+    logger.debug("Transfers: %s", opus.downloader.summary())
     print("Downloaded images into {}".format(basepath))
 
 
@@ -49,6 +45,8 @@ def download_and_calibrate_parallel(list_of_ids, n=None):
     n : int
         Number of cores for the parallel processing. Default: n_cores_system//2
     """
+    from ipyparallel import Client
+
     setup_cluster(n_cores=n)
     c = Client()
     lbview = c.load_balanced_view()
@@ -56,7 +54,9 @@ def download_and_calibrate_parallel(list_of_ids, n=None):
     subprocess.Popen(["ipcluster", "stop", "--quiet"])
 
 
-def download_and_calibrate(img_id=None, overwrite=False, recalibrate=False, **kwargs):
+def download_and_calibrate(
+    img_id=None, overwrite=False, recalibrate=False, product_store=None, **kwargs
+):
     """Download and calibrate one or more image ids, in parallel.
 
     Parameters
@@ -66,7 +66,15 @@ def download_and_calibrate(img_id=None, overwrite=False, recalibrate=False, **kw
     overwrite: bool, optional
         If the pm.cubepath exists, this switch controls if it is being overwritten.
         Default: False
+    recalibrate : bool, optional
+        Run ISIS even if the calibrated products are in the product store.
+    product_store : store.ProductStore or False, optional
+        Store to take identical calibrations from and add new ones to. By
+        default the one of the config, see `store.ProductStore`. False to
+        not use a store.
     """
+    if product_store is None:
+        product_store = ProductStore()
     if isinstance(img_id, io.PathManager):
         pm = img_id
     else:
@@ -81,8 +89,15 @@ def download_and_calibrate(img_id=None, overwrite=False, recalibrate=False, **kw
     else:
         logger.info("Found ")
 
-    if not (pm.cubepath.exists() and pm.undestriped.exists()) or overwrite is True:
-        calib = pipeline.Calibrator(img_id, **kwargs)
-        calib.standard_calib()
+    if (
+        not (pm.cubepath.exists() and pm.undestriped.exists())
+        or overwrite is True
+        or recalibrate is True
+    ):
+        # needs ISIS, so only imported when calibrating
+        from .pipeline import Calibrator
+
+        calib = Calibrator(img_id, product_store=product_store or None, **kwargs)
+        calib.standard_calib(from_store=not (overwrite or recalibrate))
     else:
         print("All files exist. Use overwrite=True to redownload and calibrate.")
@@ -3,13 +3,18 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 
-from planetarypy.pdstools import indices
-
+from . import catalogs
 from ._utils import which_epi_janus_resonance
 from .io import config
-from .meta import get_all_resonances
+from .resonance_catalog import radius_range
+from .profiling import profiled
+
 
-resonances = get_all_resonances()
+def __getattr__(name):
+    # the resonance table used to be read at import, see `catalogs`
+    if name == "resonances":
+        return catalogs.get("resonances")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_index_dir():
@@ -23,13 +28,18 @@ def get_index_dir():
 
 
 def download_general_index():
+    from planetarypy.pdstools import indices
+
     indices.download("cassini:iss:index", get_index_dir())
 
 
 def download_ring_summary_index():
+    from planetarypy.pdstools import indices
+
     indices.download("cassini:iss:ring_summary", get_index_dir())
 
 
+@profiled
 def read_cumulative_iss_index():
     "Read in the whole cumulative index and return dataframe."
     indexdir = get_index_dir()
@@ -45,6 +55,7 @@ def read_cumulative_iss_index():
     return df.replace(-999.0, np.nan)
 
 
+@profiled
 def ring_summary_index():
     indexdir = get_index_dir()
 
@@ -59,6 +70,7 @@ def ring_summary_index():
         return df.replace(-999.0, np.nan)
 
 
+@profiled
 def read_ring_images_index():
     """Filter cumulative index for ring images.
 
@@ -74,6 +86,7 @@ def read_ring_images_index():
     return meta[ringfilter]
 
 
+@profiled
 def get_clearnacs_ring_images():
     df = read_ring_images_index()
     df[df == -1e32] = np.nan
@@ -92,6 +105,7 @@ def get_clearnacs_ring_images():
     return clearnacs
 
 
+@profiled
 def filter_for_ringspan(clearnacs, spanlimit):
     "filter for covered ringspan, giver in km."
     delta = clearnacs.MAXIMUM_RING_RADIUS - clearnacs.MINIMUM_RING_RADIUS
@@ -100,20 +114,22 @@ def filter_for_ringspan(clearnacs, spanlimit):
     return ringspan
 
 
+@profiled
 def get_resonances_inside_radius(row):
     minrad = row["MINIMUM_RING_RADIUS"]
     maxrad = row["MAXIMUM_RING_RADIUS"]
-    lower_filter = resonances["radius"] > (minrad)
-    higher_filter = resonances["radius"] < (maxrad)
-    insides = resonances[lower_filter & higher_filter]
-    return insides
+    resonances = catalogs.get("resonances")
+    inside = radius_range(resonances["radius"].to_numpy(), minrad, maxrad)
+    return resonances.iloc[inside]
 
 
+@profiled
 def check_for_resonance(row, as_bool=True):
     insides = get_resonances_inside_radius(row)
     return bool(len(insides)) if as_bool else len(insides)
 
 
+@profiled
 def check_for_janus_resonance(row, as_bool=True):
     insides = get_resonances_inside_radius(row)
     # row.name is the index of the row, which is a time!
@@ -122,5 +138,6 @@ def check_for_janus_resonance(row, as_bool=True):
     return bool(len(insides[moonfilter]))
 
 
+@profiled
 def get_janus_phase(time):
     return which_epi_janus_resonance("janus", time)
@@ -0,0 +1,110 @@
+"""Interactive holoviews displays that stay fast for large cubes.
+
+Instead of sending the full resolution image to the browser,
+`rasterized_image` creates a `holoviews.DynamicMap` that, for every pan or
+zoom, selects the visible part of the image, averages it down to the size
+of the plot and computes the color limits from the visible data. This is
+what datashader's `rasterize` does, but without requiring datashader.
+"""
+import math
+
+import numpy as np
+
+from .thumbnails import block_mean, calc_clim
+
+
+def _step(coord):
+    "Spacing of an evenly spaced coordinate, 0 for a single value."
+    return (coord[-1] - coord[0]) / (coord.size - 1) if coord.size > 1 else 0.0
+
+
+def decimate(
+    xarr, x_range=None, y_range=None, width=800, height=600, pmin=0.1, pmax=99
+):
+    """Select a range of an image and block-average it to a target size.
+
+    Parameters
+    ----------
+    xarr : xarray.DataArray
+        Image with dims ('azimuth', 'radius'), as `RingCube.xarray`.
+    x_range, y_range : tuple, optional
+        Radius and azimuth range to select. Full range if None.
+    width, height : int
+        Maximum number of pixels along radius and azimuth.
+    pmin, pmax : float
+        Percentiles for the color limits, calculated from the selected data
+        at full resolution.
+
+    Returns
+    -------
+    numpy.ndarray
+        Selected data at the reduced resolution, azimuth along axis 0.
+    tuple
+        (left, bottom, right, top) bounds of the data, the outer edges of
+        its pixels.
+    tuple
+        (vmin, vmax) color limits.
+    """
+    sub = xarr
+    if x_range is not None and None not in x_range:
+        sub = sub.sel(radius=slice(*sorted(x_range)))
+    if y_range is not None and None not in y_range:
+        sub = sub.sel(azimuth=slice(*sorted(y_range)))
+    data = np.asarray(sub.values, dtype="float64")
+    radius, azimuth = sub.radius.values, sub.azimuth.values
+    if data.size == 0:
+        return data, (0, 0, 1, 1), (0, 1)
+    factors = (
+        max(1, math.ceil(data.shape[0] / height)),
+        max(1, math.ceil(data.shape[1] / width)),
+    )
+    # whole blocks only, a padded last block would be drawn as wide as the others
+    rows = data.shape[0] // factors[0] * factors[0]
+    cols = data.shape[1] // factors[1] * factors[1]
+    # coordinates are pixel centres
+    dr, daz = _step(xarr.radius.values) / 2, _step(xarr.azimuth.values) / 2
+    bounds = (
+        radius[0] - dr,
+        azimuth[0] - daz,
+        radius[cols - 1] + dr,
+        azimuth[rows - 1] + daz,
+    )
+    clim = calc_clim(data, pmin, pmax)
+    return block_mean(data[:rows, :cols], factors), bounds, clim
+
+
+def rasterized_image(xarr, width=800, height=600, pmin=0.1, pmax=99, **opts):
+    """Create a dynamically decimated holoviews image of a ring cube.
+
+    Parameters
+    ----------
+    xarr : xarray.DataArray
+        Image with dims ('azimuth', 'radius'), as `RingCube.xarray`. For
+        dask-backed arrays, only the visible part is computed.
+    width, height : int
+        Maximum number of pixels along radius and azimuth per update.
+    pmin, pmax : float
+        Percentiles of the visible data used for the color limits.
+    opts
+        Additional holoviews options for the image, e.g. title.
+
+    Returns
+    -------
+    holoviews.DynamicMap
+    """
+    import holoviews as hv
+    # loads the bokeh plotting extension, as for the other RingCube plots
+    import hvplot.xarray  # noqa: F401
+
+    def callback(x_range, y_range):
+        data, bounds, clim = decimate(
+            xarr, x_range, y_range, width, height, pmin, pmax
+        )
+        # hv.Image puts the first row at the top, our first azimuth is at the bottom
+        img = hv.Image(
+            np.flipud(data), bounds=bounds, kdims=["radius", "azimuth"], vdims=["value"]
+        )
+        return img.opts(clim=clim)
+
+    dmap = hv.DynamicMap(callback, streams=[hv.streams.RangeXY()])
+    return dmap.opts(hv.opts.Image(cmap="gray", colorbar=True, **opts))
@@ -0,0 +1,230 @@
+"""Persistent inventory of the image database.
+
+Globbing the database folder recursively for each product type is slow on
+network filesystems with many image folders. `DBInventory` keeps a SQLite
+table of all files in the image folders, built by one `os.scandir` walk.
+Later refreshes only rescan image folders whose modification time changed,
+i.e. folders where files were added, removed or renamed.
+
+NOTE
+----
+A file rewritten in place does not change the modification time of its
+folder, so its size and mtime are only updated by a full refresh.
+"""
+import logging
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from .io import PathManager, get_db_root
+
+logger = logging.getLogger(__name__)
+
+IMG_ID_REGEX = re.compile(r"^[NW]\d{10}$")
+# image id, version, product extension
+FNAME_REGEX = re.compile(r"^([NW]\d{10})_(\d+)(.*)$")
+_EXTENSION_KEYS = {v: k for k, v in PathManager.extensions.items()}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    img_id TEXT PRIMARY KEY,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS products (
+    filename TEXT PRIMARY KEY,
+    img_id TEXT,
+    version TEXT,
+    product TEXT,
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS products_img_id ON products (img_id);
+CREATE INDEX IF NOT EXISTS products_product ON products (product);
+"""
+
+
+def parse_product_name(fname):
+    """Split a database file name into image id, version and product.
+
+    Parameters
+    ----------
+    fname : str
+        File name, e.g. 'N1467345444_1.cal.dst.map.cub'
+
+    Returns
+    -------
+    tuple
+        (img_id, version, product), product being the `PathManager.extensions`
+        key or None for unknown extensions. None if the name does not follow
+        the database naming scheme.
+    """
+    match = FNAME_REGEX.match(fname)
+    if match is None:
+        return None
+    img_id, version, ext = match.groups()
+    return img_id, version, _EXTENSION_KEYS.get(ext)
+
+
+class DBInventory(object):
+    """SQLite inventory of the files in the image database.
+
+    Parameters
+    ----------
+    dbroot : str or pathlib.Path, optional
+        Path to the pyciss image database. By default the one in the config.
+    path : str or pathlib.Path, optional
+        Path to the SQLite file. By default `.inventory.sqlite` in `dbroot`.
+    """
+
+    def __init__(self, dbroot=None, path=None):
+        self.dbroot = get_db_root() if dbroot is None else Path(dbroot)
+        self.path = self.dbroot / ".inventory.sqlite" if path is None else Path(path)
+        self.con = sqlite3.connect(str(self.path))
+        self.con.executescript(SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _scan_folder(self, img_id, folder):
+        rows = []
+        with os.scandir(folder) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                parsed = parse_product_name(entry.name)
+                if parsed is None:
+                    continue
+                stat = entry.stat()
+                rows.append((entry.path, *parsed, stat.st_size, stat.st_mtime))
+        self.con.execute("DELETE FROM products WHERE img_id = ?", (img_id,))
+        self.con.executemany(
+            "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def refresh(self, full=False):
+        """Update the inventory from the filesystem.
+
+        Parameters
+        ----------
+        full : bool
+            Rescan all image folders, not only the ones with changed
+            modification time.
+
+        Returns
+        -------
+        int
+            Number of rescanned image folders.
+        """
+        known = dict(self.con.execute("SELECT img_id, mtime FROM folders"))
+        seen = set()
+        n_scanned = 0
+        with self.con:
+            with os.scandir(self.dbroot) as it:
+                for entry in it:
+                    if not entry.is_dir() or not IMG_ID_REGEX.match(entry.name):
+                        continue
+                    img_id = entry.name
+                    seen.add(img_id)
+                    mtime = entry.stat().st_mtime
+                    if not full and known.get(img_id) == mtime:
+                        continue
+                    self._scan_folder(img_id, entry.path)
+                    self.con.execute(
+                        "INSERT OR REPLACE INTO folders VALUES (?, ?)", (img_id, mtime)
+                    )
+                    n_scanned += 1
+            gone = [(img_id,) for img_id in set(known) - seen]
+            self.con.executemany("DELETE FROM folders WHERE img_id = ?", gone)
+            self.con.executemany("DELETE FROM products WHERE img_id = ?", gone)
+        logger.info(
+            "Rescanned %i folders, removed %i folders.", n_scanned, len(gone)
+        )
+        return n_scanned
+
+    def query(self, sql, params=()):
+        "Run `sql` on the inventory and return a pd.DataFrame."
+        return pd.read_sql_query(sql, self.con, params=params)
+
+    @property
+    def img_ids(self):
+        "list: All image ids with a folder in the database."
+        return [row[0] for row in self.con.execute("SELECT img_id FROM folders")]
+
+    def products(self, img_id=None):
+        """Table of products in the database.
+
+        Parameters
+        ----------
+        img_id : str, optional
+            Only return products of this image id.
+
+        Returns
+        -------
+        pd.DataFrame
+            filename, img_id, version, product, size and mtime of the products.
+        """
+        if img_id is None:
+            return self.query("SELECT * FROM products")
+        return self.query("SELECT * FROM products WHERE img_id = ?", (img_id,))
+
+    def paths(self, product):
+        """Paths of all files of a product type.
+
+        Parameters
+        ----------
+        product : str
+            Key of `PathManager.extensions`, e.g. 'cubepath'.
+
+        Returns
+        -------
+        list of pathlib.Path
+        """
+        rows = self.con.execute(
+            "SELECT filename FROM products WHERE product = ?", (product,)
+        )
+        return [Path(row[0]) for row in rows]
+
+    def missing(self, product="cubepath"):
+        """Image ids that lack a product.
+
+        Parameters
+        ----------
+        product : str
+            Key of `PathManager.extensions`, by default the map-projected cube.
+
+        Returns
+        -------
+        list of str
+        """
+        rows = self.con.execute(
+            "SELECT img_id FROM folders WHERE img_id NOT IN "
+            "(SELECT img_id FROM products WHERE product = ?) ORDER BY img_id",
+            (product,),
+        )
+        return [row[0] for row in rows]
+
+    def stats(self):
+        """Number of files per product type.
+
+        Returns
+        -------
+        pd.DataFrame
+            One column per key of `PathManager.extensions`.
+        """
+        counts = dict(
+            self.con.execute(
+                "SELECT product, COUNT(*) FROM products GROUP BY product"
+            )
+        )
+        return pd.DataFrame(
+            {key: [counts.get(key, 0)] for key in PathManager.extensions}
+        )
@@ -3,21 +3,56 @@ file. It also has a PathManager to support finding the paths to files
 of interest."""
 import configparser
 import logging
+import os
 from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 
-import pandas as pd
+import numpy as np
+
+from .labels import convert, cube_layout, read_label, read_label_bytes
 
 logger = logging.getLogger(__name__)
 
-try:
-    from pysis.isis import getkey
-except ImportError:
-    logging.warning("Cannot import ISIS system.")
+PIXEL_DTYPES = {
+    'UnsignedByte': 'u1',
+    'SignedByte': 'i1',
+    'UnsignedWord': 'u2',
+    'SignedWord': 'i2',
+    'UnsignedInteger': 'u4',
+    'SignedInteger': 'i4',
+    'Real': 'f4',
+    'Double': 'f8',
+}
+BYTE_ORDERS = {'Lsb': '<', 'Msb': '>', 'NoByteOrder': '='}
+# valid pixel values by pixel type, the ISIS special pixels (Null, Lrs, Lis,
+# His, Hrs) are the values outside of this range
+VALID_PIXELS = {
+    'UnsignedByte': (1, 254),
+    'UnsignedWord': (3, 65522),
+    'SignedWord': (-32752, 32767),
+    'UnsignedInteger': (3, 4294967292),
+    'SignedInteger': (-8388614, 2147483647),
+    'Real': (
+        np.frombuffer(bytes.fromhex('faff7fff'), dtype='<f4')[0],
+        np.finfo('f4').max,
+    ),
+    'Double': (
+        np.frombuffer(bytes.fromhex('faffffffffffefff'), dtype='<f8')[0],
+        np.finfo('f8').max,
+    ),
+}
 
 
 def get_configpath():
-    return Path.home() / '.pyciss.ini'
+    """Path of the config file.
+
+    ~/.pyciss.ini, unless the environment variable PYCISS_CONFIG is set.
+    """
+    try:
+        return Path(os.environ['PYCISS_CONFIG'])
+    except KeyError:
+        return Path.home() / '.pyciss.ini'
 
 
 def get_config():
@@ -67,42 +102,67 @@ def set_database_path(dbfolder):
     d['pyciss_db']['path'] = dbfolder
     with configpath.open('w') as f:
         d.write(f)
+    clear_db_root_cache()
     print("Saved database path into {}.".format(configpath))
 
 
 def db_mapped_cubes():
-    return get_db_root().glob("**/*cal.dst.map.cub")
+    from .inventory import DBInventory
+
+    with DBInventory() as inventory:
+        inventory.refresh()
+        return inventory.paths('cubepath')
 
 
 def db_label_paths():
     return get_db_root().glob("*.LBL")
 
 
-def get_db_root():
-    "Read dbroot folder from config and mkdir if required."
+@lru_cache()
+def _get_db_root(configpath):
     d = get_config()
     dbroot = Path(d['pyciss_db']['path'])
     dbroot.mkdir(exist_ok=True)
     return dbroot
 
 
+def get_db_root():
+    """Read dbroot folder from config and mkdir if required.
+
+    The result is cached per config path, so only the first call does I/O.
+    `set_database_path` clears the cache, after editing the config file by
+    hand call `clear_db_root_cache()`.
+    """
+    return _get_db_root(get_configpath())
+
+
+def clear_db_root_cache():
+    "Forget the cached database root, to re-read it from the config file."
+    _get_db_root.cache_clear()
+
+
 def print_db_stats():
     """Print database stats.
 
+    The files are counted with the `inventory.DBInventory` of the database,
+    which is created as `.inventory.sqlite` in the database folder if it
+    does not exist yet, and refreshed otherwise.
+
     Returns
     -------
     pd.DataFrame
         Table with the found data items per type.
     """
+    from .inventory import DBInventory
+
     dbroot = get_db_root()
     print(f"Database location: {dbroot}")
-    n_ids = len(list(dbroot.glob("[N,W]*")))
-    print("Number of WACs and NACs in database: {}".format(n_ids))
-    print("These kind of data are in the database: (returning pd.DataFrame)")
-    d = {}
-    for key, val in PathManager.extensions.items():
-        d[key] = [len(list(dbroot.glob("**/*" + val)))]
-    return pd.DataFrame(d)
+    with DBInventory(dbroot) as inventory:
+        inventory.refresh()
+        n_ids = len(inventory.img_ids)
+        print("Number of WACs and NACs in database: {}".format(n_ids))
+        print("These kind of data are in the database: (returning pd.DataFrame)")
+        return inventory.stats()
 
 
 class PathManager(object):
@@ -112,8 +172,10 @@ class PathManager(object):
     The `.pyciss.yaml` config file determines the path to the database for ISS images.
     With this class you can access the different kind of files conveniently.
 
-    Using the stored extensions dictionary, the attributes of the object listed here are created
-    dynamically at object initialization and when the image_id is being set.
+    Using the stored extensions dictionary, the attributes of the object listed here are
+    computed when accessed. Creating a PathManager does no I/O at all: the database root
+    is read from the (cached) config on first use, and the image version is looked up in
+    the database only when it was not given with the image id and is needed for a path.
 
     NOTE
     ----
@@ -133,6 +195,7 @@ class PathManager(object):
     ----------
     basepath
     img_id
+    version
     calib_img
     calib_label
     raw_image
@@ -143,6 +206,8 @@ class PathManager(object):
     undestriped
     """
 
+    __slots__ = ('input_img_id', '_id', '_dbroot', '_version')
+
     d = {
         'cubepath': '.cal.dst.map.cub',
         'cal_cub': '.cal.cub',
@@ -159,36 +224,62 @@ class PathManager(object):
     extensions = OrderedDict(sorted(d.items(), key=lambda t: t[0]))
 
     def __init__(self, img_id, savedir=None):
-        img_id = img_id.upper()
+        img_id = str(img_id).upper()
         self.input_img_id = img_id
-        if Path(img_id).is_absolute():
+        name = os.path.basename(img_id)
+        if os.path.isabs(img_id):
             # the split is to remove the _1.IMG or _2.IMG from the path
             # for the image id.
-            self._id = Path(img_id).name.split('_')[0]
+            self._id = name.split('_')[0]
         else:
             # I'm using only filename until _ for storage
             # TODO: Could this create a problem?
             self._id = img_id[:11]
-        if savedir is None:
-            self.dbroot = get_db_root()
-        else:
-            self.dbroot = Path(savedir)
+        self._dbroot = None if savedir is None else Path(savedir)
+        # version given with the id, else looked up on first use
+        self._version = name.split('_')[1].split('.')[0] if len(name) > 11 else None
+
+    @property
+    def dbroot(self):
+        if self._dbroot is None:
+            self._dbroot = get_db_root()
+        return self._dbroot
+
+    @dbroot.setter
+    def dbroot(self, value):
+        self._dbroot = Path(value)
+
+    def _version_from_names(self, names):
+        # if the given id was without version, check if a raw file is in database:
+        n = len(self.img_id)
+        for name in sorted(names):
+            # matching {img_id}_?.IMG
+            if len(name) == n + 6 and name.startswith(self.img_id + '_') \
+                    and name.endswith('.IMG'):
+                return name[n + 1]
+        return '0'
+
+    def _listdir(self):
+        try:
+            return os.listdir(str(self.basepath))
+        except OSError:
+            return []
 
-        self.set_version()
-        self.set_attributes()
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = self._version_from_names(self._listdir())
+        return self._version
+
+    @version.setter
+    def version(self, value):
+        self._version = value
 
     def set_version(self):
+        "Look up the version again if it was not given with the image id."
         id_ = Path(self.input_img_id).name
-        if len(id_) > 11:
-            self.version = id_.split('_')[1].split('.')[0]
-        else:
-            # if the given id was without version, check if a raw file is in database:
-            try:
-                rawpath = next(self.basepath.glob(self.img_id + "_?.IMG")).name
-            except StopIteration:
-                self.version = '0'
-            else:
-                self.version = rawpath[12]
+        if len(id_) <= 11:
+            self._version = None
 
     @property
     def basepath(self):
@@ -201,23 +292,25 @@ class PathManager(object):
     @img_id.setter
     def img_id(self, value):
         self._id = value
-        self.set_attributes()
 
     def set_attributes(self):
-        for k, v in self.extensions.items():
-            path = self.basepath / ("{}_{}{}".format(self.img_id,
-                                                     self.version,
-                                                     v))
-            setattr(self, k, path)
+        "Kept for backwards compatibility, product paths are computed on access."
+        pass
+
+    def _product_path(self, ext):
+        return self.basepath / "{}_{}{}".format(self.img_id, self.version, ext)
 
     def __str__(self):
-        self.set_version()
-        self.set_attributes()  # in case there were changes
+        # one directory listing instead of one glob and one `exists()` per product
+        names = self._listdir()
+        if len(Path(self.input_img_id).name) <= 11:
+            self._version = self._version_from_names(names)
+        names = set(names)
         s = ''
         for k, v in self.extensions.items():
             s += "{}: ".format(k)
-            path = getattr(self, k)
-            if path.exists():
+            path = self._product_path(v)
+            if path.name in names:
                 s += "{}\n".format(path)
             else:
                 s += "not found.\n"
@@ -227,6 +320,16 @@ class PathManager(object):
         return self.__str__()
 
 
+def _make_product_property(ext):
+    def getter(self):
+        return self._product_path(ext)
+    return property(getter, doc="pathlib.Path: Path to the `*{}` file.".format(ext))
+
+
+for _key, _ext in PathManager.extensions.items():
+    setattr(PathManager, _key, _make_product_property(_ext))
+
+
 class DBManager():
     def __init__(self):
         self.dbroot = get_db_root()
@@ -234,11 +337,223 @@ class DBManager():
     def print_stats(self):
         print_db_stats()
 
+    @property
+    def inventory(self):
+        "inventory.DBInventory: Inventory of the files in the database."
+        from .inventory import DBInventory
+
+        return DBInventory(self.dbroot)
+
+
+def read_cube_label(fname, blocksize=65536):
+    """Read the label of an ISIS cube without reading its pixel data.
+
+    Parameters
+    ----------
+    fname : str or pathlib.Path
+        Path to ISIS cube file.
+    blocksize : int
+        Number of bytes to read at a time while looking for the label end.
+
+    Returns
+    -------
+    pvl.PVLModule
+        The parsed cube label.
+    """
+    import pvl
+
+    return pvl.loads(read_label_bytes(fname, blocksize).decode())
+
+
+def mask_special_pixels(raw, pixel_type, base=0.0, multiplier=1.0):
+    """Scale raw ISIS pixel values, with the special pixels set to NaN.
+
+    Parameters
+    ----------
+    raw : numpy.ndarray
+        Pixel values as stored in the cube.
+    pixel_type : str
+        Type of the Pixels group of the label, e.g. 'Real'.
+    base, multiplier : float
+        Scaling of the Pixels group.
+
+    Returns
+    -------
+    numpy.ndarray
+        float64 values `raw * multiplier + base`.
+    """
+    # a copy also for float64 input, which may be a read-only memmap
+    data = np.array(raw, dtype='float64')
+    if multiplier != 1 or base != 0:
+        data = data * multiplier + base
+    if pixel_type in VALID_PIXELS:
+        vmin, vmax = VALID_PIXELS[pixel_type]
+        data[(raw < vmin) | (raw > vmax)] = np.nan
+    return data
+
+
+def cube_pixels(fname, layout=None):
+    """Memory map of the raw pixels of an ISIS cube.
+
+    Parameters
+    ----------
+    fname : str or pathlib.Path
+        Path to ISIS cube file.
+    layout : dict, optional
+        `labels.cube_layout` of the cube, read if not given.
+
+    Returns
+    -------
+    numpy.memmap
+        Read-only, (bands, lines, samples) for BandSequential cubes and
+        (bands, tile rows, tile columns, tile lines, tile samples) for
+        Tile cubes.
+    """
+    if layout is None:
+        layout = cube_layout(fname)
+    dtype = np.dtype(PIXEL_DTYPES[layout['Type']]).newbyteorder(
+        BYTE_ORDERS[layout.get('ByteOrder', 'NoByteOrder')]
+    )
+    bands, lines, samples = (layout[k] for k in ('Bands', 'Lines', 'Samples'))
+    if layout['Format'] == 'BandSequential':
+        shape = (bands, lines, samples)
+    elif layout['Format'] == 'Tile':
+        tl, ts = layout['TileLines'], layout['TileSamples']
+        shape = (bands, -(-lines // tl), -(-samples // ts), tl, ts)
+    else:
+        raise ValueError(f"Unknown cube format {layout['Format']} of {fname}.")
+    return np.memmap(str(fname), dtype, 'r', layout['StartByte'] - 1, shape)
+
+
+def untile(tiles, lines, samples):
+    """Image of a band of tiles from `cube_pixels`.
+
+    Parameters
+    ----------
+    tiles : numpy.ndarray
+        (tile rows, tile columns, tile lines, tile samples) pixels.
+    lines, samples : int
+        Size of the image, without the padding of the last tiles.
+    """
+    rows, cols, tl, ts = tiles.shape
+    return tiles.transpose(0, 2, 1, 3).reshape(rows * tl, cols * ts)[:lines, :samples]
+
+
+def read_cube_img(fname, chunks=None, rows=None):
+    """Read the image data of an ISIS cube, with special pixels set to NaN.
+
+    Only the label is parsed, the pixels are read from a memory map of the
+    Core, see `cube_pixels` and `mask_special_pixels`. With `rows`, only the
+    pixels of these lines are read and masked.
+
+    Parameters
+    ----------
+    fname : str or pathlib.Path
+        Path to ISIS cube file.
+    chunks : int or str, optional
+        Number of lines per chunk, or 'auto'. With chunks, a dask array is
+        returned whose chunks are read from the file when computed.
+    rows : slice, optional
+        Lines to read, e.g. slice(100, 200), by default all.
+
+    Returns
+    -------
+    numpy.ndarray or dask.array.Array
+        First band of the cube, float64.
+    """
+    layout = cube_layout(fname)
+    pixels = cube_pixels(fname, layout)[0]
+    lines, samples = layout['Lines'], layout['Samples']
+    rows = slice(None) if rows is None else rows
+    scaling = (
+        layout['Type'],
+        layout.get('Base', 0.0),
+        layout.get('Multiplier', 1.0),
+    )
+    if chunks is None:
+        start, stop, step = rows.indices(lines)
+        if layout['Format'] == 'Tile' and step > 0:
+            # only the rows of tiles covering the lines
+            stop = max(start, stop)
+            tl = layout['TileLines']
+            first = start // tl
+            pixels = untile(pixels[first : -(-stop // tl)], lines, samples)
+            rows = slice(start - first * tl, stop - first * tl, step)
+        elif layout['Format'] == 'Tile':
+            pixels = untile(pixels, lines, samples)
+        return mask_special_pixels(pixels[rows], *scaling)
+    import dask.array as da
+
+    if layout['Format'] == 'Tile':
+        # one dask array per row of tiles, the tiles of a row are contiguous
+        tile_rows = [
+            da.from_array(row, chunks=-1).transpose(1, 0, 2).reshape(
+                row.shape[1], -1
+            )
+            for row in pixels
+        ]
+        img = da.concatenate(tile_rows)[:lines, :samples].rechunk((chunks, -1))
+    else:
+        img = da.from_array(pixels, chunks=(chunks, -1))
+    return img[rows].map_blocks(mask_special_pixels, *scaling, dtype='float64')
+
+
+def expected_file_bytes(label):
+    """Size of the file described by a detached PDS label.
+
+    Parameters
+    ----------
+    label : str or pathlib.Path
+        Path to the .LBL file, e.g. of a raw or calibrated .IMG.
+
+    Returns
+    -------
+    int or None
+        RECORD_BYTES * FILE_RECORDS, None if the label does not have both
+        keywords or can't be read.
+    """
+    try:
+        label = read_label(label)
+    except (OSError, ValueError):
+        return None
+    # keywords in nested objects describe parts of the file
+    values = {
+        key: convert(label.text[start:end])
+        for blocks, key, start, end in label.entries
+        if not blocks and key in ('RECORD_BYTES', 'FILE_RECORDS')
+    }
+    try:
+        return int(values['RECORD_BYTES']) * int(values['FILE_RECORDS'])
+    except (KeyError, ValueError, TypeError):
+        return None
+
 
 def is_lossy(label):
     """Check Label file for the compression type. """
-    val = getkey(from_=label, keyword='INST_CMPRS_TYPE').decode().strip()
+    val = read_label(label).get('INST_CMPRS_TYPE')
     if val == 'LOSSY':
         return True
     else:
         return False
+
+
+def compression_types(labels, max_workers=16):
+    """Compression types of many images.
+
+    Parameters
+    ----------
+    labels : iterable of str or pathlib.Path
+        PDS label files of the images.
+    max_workers : int
+        Number of I/O threads.
+
+    Returns
+    -------
+    pd.Series
+        INST_CMPRS_TYPE by label path, e.g. 'LOSSLESS', 'LOSSY' or 'NOTCOMP'.
+    """
+    from .labels import read_keywords
+
+    return read_keywords(labels, ['INST_CMPRS_TYPE'], max_workers=max_workers)[
+        'INST_CMPRS_TYPE'
+    ]
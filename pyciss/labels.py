@@ -0,0 +1,428 @@
+"""Read and patch PDS and ISIS labels in-process.
+
+Reading or changing a single keyword with the ISIS programs `getkey` and
+`editlab` costs a process launch per file. `read_label` reads only the
+label bytes of a detached PDS label (.LBL), a PDS/VICAR file with attached
+label or an ISIS cube, and `Label` parses its PVL statements, keeping the
+position of every value so `patch_label` can change values without
+touching the rest of the file. ISIS cube labels are patched in place within
+the space reserved before the cube data.
+
+`read_keywords` and `patch_labels` run this for many files on a thread pool,
+e.g. to classify the compression of a whole archive:
+
+>>> read_keywords(label_paths, ['INST_CMPRS_TYPE'])
+"""
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+END_REGEX = re.compile(rb"^[ \t]*END[ \t]*\r?$", re.MULTILINE | re.IGNORECASE)
+STATEMENT_REGEX = re.compile(r"[ \t]*([\^A-Za-z_][\w:^]*)[ \t]*(=?)[ \t]*")
+BLOCK_KEYS = {"OBJECT", "GROUP"}
+BLOCK_END_KEYS = {"END_OBJECT", "END_GROUP"}
+CLOSING = {"(": ")", "{": "}"}
+PIXEL_BYTES = {
+    "UnsignedByte": 1,
+    "SignedByte": 1,
+    "UnsignedWord": 2,
+    "SignedWord": 2,
+    "UnsignedInteger": 4,
+    "SignedInteger": 4,
+    "Real": 4,
+    "Double": 8,
+}
+# keywords of the Core object of ISIS cubes that describe the pixel data
+CORE_KEYS = {
+    "StartByte", "Format", "TileSamples", "TileLines", "Samples", "Lines",
+    "Bands", "Type", "ByteOrder", "Base", "Multiplier",
+}
+
+
+def read_label_bytes(fname, blocksize=65536, max_bytes=1 << 22):
+    """Read a file up to the end of its label.
+
+    Parameters
+    ----------
+    fname : str or pathlib.Path
+        PDS label, PDS/VICAR image or ISIS cube.
+    blocksize : int
+        Number of bytes read at a time while looking for the END statement.
+    max_bytes : int
+        Give up after this many bytes.
+
+    Returns
+    -------
+    bytes
+        The label including its END line. The whole file if it has no END
+        statement, e.g. a truncated label.
+    """
+    text = b""
+    with open(str(fname), "rb") as f:
+        while len(text) < max_bytes:
+            block = f.read(blocksize)
+            # look again at the last bytes, the END line may cross blocks
+            start = max(0, len(text) - 8)
+            text += block
+            match = END_REGEX.search(text, start)
+            if match is not None:
+                return text[: match.end()]
+            if not block:
+                break
+    return text
+
+
+def _value_end(text, pos):
+    "End of the value starting at `pos`."
+    if text.startswith('"', pos):
+        return text.index('"', pos + 1) + 1
+    if text[pos : pos + 1] in CLOSING:
+        depth = 0
+        quoted = False
+        for i in range(pos, len(text)):
+            c = text[i]
+            if c == '"':
+                quoted = not quoted
+            elif quoted:
+                continue
+            elif c in "({":
+                depth += 1
+            elif c in ")}":
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+        raise ValueError(f"Unclosed value at {pos}.")
+    end = text.find("\n", pos)
+    end = len(text) if end < 0 else end
+    comment = text.find("/*", pos, end)
+    if comment >= 0:
+        end = comment
+    while end > pos and text[end - 1] in " \t\r":
+        end -= 1
+    return end
+
+
+def convert(value):
+    """Python value of a PVL value string.
+
+    Quoted strings lose their quotes, numbers become int or float, units
+    like '<km>' are dropped and sequences become tuples. Anything else stays
+    a string.
+    """
+    value = value.strip()
+    if value.startswith('"') and value.endswith('"'):
+        return " ".join(value[1:-1].split())
+    if value[:1] in CLOSING:
+        items = re.findall(r'"[^"]*"|[^,\s(){}][^,(){}]*', value[1:-1])
+        return tuple(convert(item) for item in items)
+    value = re.sub(r"\s*<[^>]*>$", "", value)
+    for type_ in (int, float):
+        try:
+            return type_(value)
+        except ValueError:
+            pass
+    return value.strip("'")
+
+
+class Label(object):
+    """Parsed PVL label, keeping the text positions of the values.
+
+    Parameters
+    ----------
+    text : str
+        Label text, e.g. from `read_label_bytes`.
+
+    Attributes
+    ----------
+    entries : list of tuple
+        (blocks, keyword, start, end) of every statement with a value,
+        `blocks` being the names of the enclosing OBJECTs and GROUPs and
+        text[start:end] the value.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.entries = []
+        blocks = []
+        pos = 0
+        n = len(text)
+        while pos < n:
+            while pos < n and text[pos] in " \t\r\n":
+                pos += 1
+            if text.startswith("/*", pos):
+                pos = text.find("*/", pos) + 2 if "*/" in text[pos:] else n
+                continue
+            match = STATEMENT_REGEX.match(text, pos)
+            if match is None or not match.group(1):
+                newline = text.find("\n", pos)
+                pos = n if newline < 0 else newline + 1
+                continue
+            key, equal = match.group(1), match.group(2)
+            upper = key.upper()
+            if upper == "END":
+                break
+            if not equal:
+                if upper in BLOCK_END_KEYS and blocks:
+                    blocks.pop()
+                pos = match.end()
+                continue
+            start = match.end()
+            end = _value_end(text, start)
+            if upper in BLOCK_KEYS:
+                blocks.append(text[start:end].strip('"'))
+            elif upper in BLOCK_END_KEYS:
+                if blocks:
+                    blocks.pop()
+            else:
+                self.entries.append((tuple(blocks), key, start, end))
+            pos = end
+
+    def _find(self, keyword, group=None):
+        keyword = keyword.upper()
+        group = None if group is None else group.upper()
+        for entry in self.entries:
+            blocks, key = entry[:2]
+            if key.upper() != keyword:
+                continue
+            if group is None or group in (b.upper() for b in blocks):
+                return entry
+        raise KeyError(keyword if group is None else f"{group}/{keyword}")
+
+    def raw(self, keyword, group=None):
+        """Value string of the first `keyword`, case-insensitive.
+
+        Parameters
+        ----------
+        keyword : str
+            E.g. 'INST_CMPRS_TYPE' or 'TargetName'.
+        group : str, optional
+            Only look in OBJECTs or GROUPs of this name, e.g. 'Instrument'.
+        """
+        _, _, start, end = self._find(keyword, group)
+        return self.text[start:end]
+
+    def get(self, keyword, group=None, default=None):
+        "Converted value of `keyword`, see `raw` and `convert`, or `default`."
+        try:
+            return convert(self.raw(keyword, group))
+        except KeyError:
+            return default
+
+    def __getitem__(self, keyword):
+        return convert(self.raw(keyword))
+
+    def __contains__(self, keyword):
+        try:
+            self._find(keyword)
+        except KeyError:
+            return False
+        return True
+
+    def replace(self, changes, group=None):
+        """Label text with changed values.
+
+        Parameters
+        ----------
+        changes : dict
+            New value by keyword. Strings are written as they are, so quote
+            them if the label needs quotes.
+        group : str, optional
+            Only change keywords in OBJECTs or GROUPs of this name.
+
+        Returns
+        -------
+        str
+        """
+        spans = [
+            self._find(key, group)[2:] + (str(value),) for key, value in changes.items()
+        ]
+        spans.sort(reverse=True)
+        text = self.text
+        for start, end, value in spans:
+            text = text[:start] + value + text[end:]
+        return text
+
+    def to_dict(self):
+        "Values by keyword, prefixed with their OBJECT or GROUP like 'Instrument/TargetName'."
+        return {
+            "/".join(blocks[-1:] + (key,)): convert(self.text[start:end])
+            for blocks, key, start, end in self.entries
+        }
+
+
+def read_label(fname):
+    """Read and parse the label of a file.
+
+    Parameters
+    ----------
+    fname : str or pathlib.Path
+        PDS label, PDS/VICAR image or ISIS cube.
+
+    Returns
+    -------
+    Label
+    """
+    return Label(read_label_bytes(fname).decode("latin-1"))
+
+
+def has_end(text):
+    "If label bytes from `read_label_bytes` end with an END statement."
+    return END_REGEX.search(text) is not None
+
+
+def cube_layout(label):
+    """Data layout of an ISIS cube from its label.
+
+    Parameters
+    ----------
+    label : Label, str or pathlib.Path
+        Parsed label or path of the cube.
+
+    Returns
+    -------
+    dict
+        StartByte, Format, Samples, Lines, Bands, Type, ByteOrder, Base,
+        Multiplier, TileSamples and TileLines of the Core, as far as in the
+        label, and `blobs`, the (StartByte, Bytes) of the other objects like
+        History, OriginalLabel and tables.
+    """
+    if not isinstance(label, Label):
+        label = read_label(label)
+    layout = {}
+    blobs = []
+    starts = {}
+    for blocks, key, start, end in label.entries:
+        if "Core" in blocks:
+            if key in CORE_KEYS:
+                layout.setdefault(key, convert(label.text[start:end]))
+        elif key == "StartByte":
+            starts[blocks] = int(convert(label.text[start:end]))
+        elif key == "Bytes" and blocks in starts:
+            blobs.append((starts.pop(blocks), int(convert(label.text[start:end]))))
+    layout["blobs"] = blobs
+    return layout
+
+
+def _label_space(label):
+    "Bytes reserved for the label before the data of the file, None if unknown."
+    starts = [
+        int(convert(label.text[start:end])) - 1
+        for blocks, key, start, end in label.entries
+        if key.upper() == "STARTBYTE"
+    ]
+    if starts:
+        return min(starts)
+    if "LABEL_RECORDS" in label and "RECORD_BYTES" in label:
+        return label["LABEL_RECORDS"] * label["RECORD_BYTES"]
+    return None
+
+
+def patch_label(fname, changes, group=None):
+    """Change label values of a file.
+
+    Detached labels are rewritten. Labels in front of data, as in ISIS cubes
+    and attached PDS labels, are overwritten in place and padded to their
+    original space, which must be large enough for the new label.
+
+    Parameters
+    ----------
+    fname : str or pathlib.Path
+        PDS label, PDS image or ISIS cube.
+    changes : dict
+        New value by keyword, see `Label.replace`.
+    group : str, optional
+        Only change keywords in OBJECTs or GROUPs of this name, e.g. 'Instrument'.
+
+    Raises
+    ------
+    ValueError
+        If the new label does not fit into the space before the data.
+    """
+    fname = Path(fname)
+    old = read_label_bytes(fname)
+    label = Label(old.decode("latin-1"))
+    new = label.replace(changes, group).encode("latin-1")
+    if new == old:
+        return
+    space = _label_space(label)
+    with fname.open("r+b") as f:
+        f.seek(len(old))
+        if space is None:
+            rest = f.read()
+            if rest.strip():
+                # data after the label, without knowing where it starts
+                space = len(old)
+            else:
+                f.seek(0)
+                f.write(new + rest)
+                f.truncate()
+                return
+        if len(new) > space:
+            raise ValueError(
+                f"The new label of {fname} does not fit into {space} bytes."
+            )
+        f.seek(len(old))
+        padding = f.read(1) or b" "
+        f.seek(0)
+        f.write(new.ljust(len(old), padding))
+
+
+def _map(func, items, max_workers):
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(func, items))
+
+
+def read_keywords(fnames, keywords, group=None, max_workers=16):
+    """Read keywords from the labels of many files.
+
+    Parameters
+    ----------
+    fnames : iterable of str or pathlib.Path
+        Files to read the labels of.
+    keywords : list of str
+        Keywords to read.
+    group : str, optional
+        Only look in OBJECTs or GROUPs of this name.
+    max_workers : int
+        Number of I/O threads.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per file, indexed by path, one column per keyword. Missing
+        keywords and unreadable files give None.
+    """
+    fnames = [str(f) for f in fnames]
+
+    def read(fname):
+        try:
+            label = read_label(fname)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read the label of %s: %s", fname, e)
+            return [None] * len(keywords)
+        return [label.get(key, group) for key in keywords]
+
+    rows = _map(read, fnames, max_workers)
+    return pd.DataFrame(rows, index=pd.Index(fnames, name="path"), columns=keywords)
+
+
+def patch_labels(fnames, changes, group=None, max_workers=16):
+    """Change label values of many files, see `patch_label`.
+
+    Returns
+    -------
+    dict
+        Error message by path, for the files that could not be patched.
+    """
+    def patch(fname):
+        try:
+            patch_label(fname, changes, group)
+        except (OSError, ValueError, KeyError) as e:
+            return str(fname), repr(e)
+
+    return dict(r for r in _map(patch, list(fnames), max_workers) if r is not None)
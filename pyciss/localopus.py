@@ -0,0 +1,329 @@
+"""Offline OPUS queries, answered from the local index files.
+
+`LocalOPUS` has the query methods of `opusapi.OPUS` (`query_image_id`,
+`get_between_times`, `get_between_resolutions`), but runs them against
+`LocalIndex`, a columnar copy of the cumulative index with the radial
+resolutions of the ring summary index. The results are `OPUSObsID` objects
+with the PDS URLs of the raw and calibrated products constructed from the
+volume and file names in the index, so `download_results`,
+`download_previews` and download planning work without any request to the
+OPUS API:
+
+>>> opus = LocalOPUS()
+>>> opus.get_between_times('2008-01-01', '2008-02-01', target='S RINGS')
+>>> opus.download_results()
+"""
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .coverage import TIME_COLUMNS, _file_ids, parse_times
+from .index import get_index_dir, read_cumulative_iss_index, ring_summary_index
+from .opusapi import OPUS, OPUSObsID, dic
+
+logger = logging.getLogger(__name__)
+
+FNAME = "local_opus.npz"
+SOURCES = ["COISS_2999_index.hdf", "COISS_2999_ring_summary.hdf"]
+PDS_URL = "https://pds-rings.seti.org"
+
+
+def normalize_target(target):
+    "Target name for comparisons, upper case with spaces: 'S+RINGS' -> 'S RINGS'."
+    return " ".join(str(target).upper().replace("+", " ").replace("_", " ").split())
+
+
+def volume_group(volume_id):
+    "Volume series folder of a volume, e.g. COISS_2001 -> COISS_2xxx."
+    return volume_id[:-3] + "xxx"
+
+
+def product_urls(volume_id, file_spec):
+    """PDS URLs of the raw and calibrated products of an image.
+
+    Parameters
+    ----------
+    volume_id : str
+        PDS volume, e.g. 'COISS_2001'.
+    file_spec : str
+        FILE_SPECIFICATION_NAME of the label in the volume, e.g.
+        'data/1454725799_1455008789/N1454725799_1.LBL'.
+
+    Returns
+    -------
+    dict
+        Lists of the image and label URL by product, keyed like the OPUS
+        files response ('coiss-raw', 'coiss-calib').
+    """
+    path = f"{volume_group(volume_id)}/{volume_id}/{file_spec[:-4]}"
+    raw = f"{PDS_URL}/volumes/{path}"
+    calib = f"{PDS_URL}/calibrated/{path}_CALIB"
+    return {
+        dic["raw_data"]: [raw + ".IMG", raw + ".LBL"],
+        dic["calibrated_data"]: [calib + ".IMG", calib + ".LBL"],
+    }
+
+
+class LocalIndex(object):
+    """Columns of the cumulative index needed for OPUS-like queries, sorted by time.
+
+    Use `LocalIndex.load` for the cached index of the configured index folder,
+    or `LocalIndex.from_dataframe` for any index table.
+
+    Parameters
+    ----------
+    arrays : dict
+        file_id, volume_id, file_spec (str), time (int64 ns), resolution
+        (float64, km/pixel), target_code (int16) and target_names (str),
+        as made by `from_dataframe`.
+    """
+
+    def __init__(self, arrays):
+        for key, value in arrays.items():
+            setattr(self, key, value)
+        self._by_id = {img_id: i for i, img_id in enumerate(self.file_id)}
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_dataframe(cls, df, resolution=None):
+        """Create the index from a cumulative index table.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Table like `index.read_cumulative_iss_index`, with VOLUME_ID,
+            FILE_SPECIFICATION_NAME, TARGET_NAME and one of the time columns
+            in `TIME_COLUMNS`.
+        resolution : pd.Series, optional
+            Finest radial resolution in km by image id, e.g. from the ring
+            summary index.
+
+        Returns
+        -------
+        LocalIndex
+        """
+        try:
+            time_column = next(col for col in TIME_COLUMNS if col in df)
+        except StopIteration:
+            raise KeyError(f"The index needs one of the columns {TIME_COLUMNS}.")
+        time = parse_times(df[time_column])
+        order = np.argsort(time, kind="stable")
+        df = df.iloc[order]
+        file_id = _file_ids(df)
+        targets = [normalize_target(t) for t in df.TARGET_NAME]
+        target_names, target_code = np.unique(np.array(targets), return_inverse=True)
+        if resolution is None:
+            res = np.full(len(df), np.nan)
+        else:
+            resolution = resolution.groupby(level=0).min()
+            res = resolution.reindex(file_id).to_numpy(dtype="float64")
+        return cls(
+            dict(
+                file_id=file_id,
+                volume_id=df.VOLUME_ID.to_numpy().astype(str),
+                file_spec=df.FILE_SPECIFICATION_NAME.to_numpy().astype(str),
+                time=time[order],
+                resolution=res,
+                target_names=target_names,
+                target_code=target_code.astype("int16"),
+            )
+        )
+
+    @classmethod
+    def build(cls):
+        "Create the index from the index files of the configured index folder."
+        summary = ring_summary_index()
+        resolution = None
+        if summary is not None:
+            resolution = pd.Series(
+                summary.FINEST_RADIAL_RESOLUTION.to_numpy(), index=_file_ids(summary)
+            )
+        return cls.from_dataframe(read_cumulative_iss_index(), resolution)
+
+    @classmethod
+    def load(cls, path=None, rebuild=False):
+        """Load the cached index, building it if missing or older than the index files.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path, optional
+            Cache file, default `local_opus.npz` in the index folder.
+        rebuild : bool
+            Build the index even if the cache is up to date.
+
+        Returns
+        -------
+        LocalIndex
+        """
+        indexdir = get_index_dir()
+        path = indexdir / FNAME if path is None else Path(path)
+        sources = [indexdir / fname for fname in SOURCES]
+        newest = max((p.stat().st_mtime for p in sources if p.exists()), default=0)
+        if not rebuild and path.exists() and path.stat().st_mtime >= newest:
+            with np.load(str(path), allow_pickle=False) as f:
+                return cls({key: f[key] for key in f.files})
+        logger.info("Building the local OPUS index %s.", path)
+        local = cls.build()
+        local.save(path)
+        return local
+
+    def save(self, path):
+        "Write the index to the .npz file `path`."
+        path = Path(path)
+        keys = [
+            "file_id",
+            "volume_id",
+            "file_spec",
+            "time",
+            "resolution",
+            "target_names",
+            "target_code",
+        ]
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(str(tmp), **{key: getattr(self, key) for key in keys})
+        os.replace(str(tmp), str(path))
+
+    def between_times(self, t1, t2):
+        "Positions of the images with t1 <= time <= t2."
+        lo = np.searchsorted(self.time, pd.Timestamp(t1).value, side="left")
+        hi = np.searchsorted(self.time, pd.Timestamp(t2).value, side="right")
+        return np.arange(lo, max(lo, hi))
+
+    def with_target(self, pos, target):
+        "Subset of the positions `pos` of images of `target`, e.g. 'S+RINGS'."
+        code = np.flatnonzero(self.target_names == normalize_target(target))
+        if not len(code):
+            return pos[:0]
+        return pos[self.target_code[pos] == code[0]]
+
+    def between_resolutions(self, res1=None, res2=None):
+        "Positions of the images with res1 <= finest radial resolution <= res2 (km)."
+        mask = ~np.isnan(self.resolution)
+        if res1 is not None:
+            mask &= self.resolution >= res1
+        if res2 is not None:
+            mask &= self.resolution <= res2
+        return np.flatnonzero(mask)
+
+    def find(self, img_id):
+        """Position of an image, or None.
+
+        Parameters
+        ----------
+        img_id : str
+            Image id like N1454725799, a version suffix like _1 is ignored.
+        """
+        return self._by_id.get(str(img_id).upper()[:11])
+
+    def obsid(self, pos):
+        "OPUSObsID with the PDS URLs of the image at position `pos`."
+        urls = product_urls(self.volume_id[pos], self.file_spec[pos])
+        return OPUSObsID((f"co-iss-{self.file_id[pos]}", urls))
+
+    def to_dataframe(self, pos):
+        "Table of the images at positions `pos`."
+        return pd.DataFrame(
+            dict(
+                file_id=self.file_id[pos].astype(object),
+                time=pd.to_datetime(self.time[pos]),
+                target=self.target_names[self.target_code[pos]].astype(object),
+                resolution=self.resolution[pos],
+                volume_id=self.volume_id[pos].astype(object),
+                file_spec=self.file_spec[pos].astype(object),
+            )
+        )
+
+
+def _optional_float(value):
+    # OPUS queries use '' for an open limit
+    return None if value in ("", None) else float(value)
+
+
+class LocalOPUS(OPUS):
+    """`OPUS` whose queries are answered from the local index files.
+
+    Parameters
+    ----------
+    silent : bool
+        Do not print query results and downloaded files.
+    downloader : transfers.Downloader, optional
+        Downloader for `download_results` and `download_previews`.
+    index : LocalIndex, optional
+        Index to query, by default `LocalIndex.load()`.
+
+    Attributes
+    ----------
+    obsids : list of OPUSObsID
+        Results of the last query.
+    positions : numpy.ndarray
+        Positions of the results in the index, see `results`.
+    """
+
+    def __init__(self, silent=False, downloader=None, index=None):
+        super().__init__(silent=silent, downloader=downloader)
+        self.index = LocalIndex.load() if index is None else index
+        self.positions = np.array([], dtype=int)
+        self.obsids = []
+
+    def _set_results(self, pos):
+        self.positions = pos
+        self.obsids = [self.index.obsid(i) for i in pos]
+        if not self.silent:
+            if self.obsids:
+                print("Found {} obsids.".format(len(self.obsids)))
+            else:
+                print("No data found.")
+
+    @property
+    def results(self):
+        "pd.DataFrame: Index rows of the results of the last query."
+        return self.index.to_dataframe(self.positions)
+
+    def query_image_id(self, image_id):
+        """Find an image by its id, e.g. 'N1695760475_1'.
+
+        Returns
+        -------
+        list of OPUSObsID
+        """
+        pos = self.index.find(image_id)
+        self._set_results(np.array([] if pos is None else [pos], dtype=int))
+        return self.obsids
+
+    def get_between_times(self, t1, t2, target=None):
+        """Find the images taken between times t1 and t2.
+
+        Parameters
+        ----------
+        t1, t2 : datetime.datetime, strings
+            Start and end time for the query, both inclusive.
+        target : str
+            Target name like 'S+RINGS' or 'Titan'.
+        """
+        pos = self.index.between_times(t1, t2)
+        if target is not None:
+            pos = self.index.with_target(pos, target)
+        self._set_results(pos)
+
+    def get_between_resolutions(self, res1="", res2="0.5", target="S RINGS"):
+        """Find the ring images with finest radial resolution between res1 and res2.
+
+        Parameters
+        ----------
+        res1, res2 : str or float
+            Resolution range in km/pixel, '' for an open limit.
+        target : str, optional
+            Target name, by default the rings like the query of
+            `OPUS.get_radial_res_query`. None for all targets.
+        """
+        pos = self.index.between_resolutions(
+            _optional_float(res1), _optional_float(res2)
+        )
+        if target is not None:
+            pos = self.index.with_target(pos, target)
+        self._set_results(pos)
@@ -0,0 +1,288 @@
+"""Timing and resource records of the ISIS pipeline stages.
+
+`StageRecorder.stage` wraps the call of one ISIS program for one image and
+records its wall time, the CPU time and peak resident memory of the ISIS
+process and the size of the files it produced. `Calibrator` records all its
+stages into its `recorder`; share one recorder between many Calibrators to
+collect a whole reprocessing run and export it with `write_json`,
+`write_csv` or `write_prometheus`.
+
+NOTE
+----
+The operating system only reports the peak memory of the largest child
+process that has finished so far (`getrusage(RUSAGE_CHILDREN)`), and the
+CPU time of all children, also of those started by other threads. So
+`Stage.run` calls the ISIS program from a forked helper process, whose own
+children are only that program, and reads their usage in the helper. As
+for any program started from Python, the peak is at least the RSS of the
+process it was started from, a copy of this one. Code in the with-block
+that does not go through `Stage.run` is not accounted, and stages without
+`Stage.run` record NaN.
+"""
+import datetime as dt
+import json
+import logging
+import math
+import os
+import pickle
+import socket
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    _RESOURCE_AVAILABLE = False
+else:
+    _RESOURCE_AVAILABLE = True
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    "img_id",
+    "stage",
+    "product",
+    "status",
+    "start",
+    "wall",
+    "cpu",
+    "max_rss",
+    "output_size",
+]
+
+
+def _children_usage():
+    "CPU seconds and peak RSS in bytes of all finished child processes."
+    if not _RESOURCE_AVAILABLE:
+        return float("nan"), float("nan")
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    factor = 1 if sys.platform == "darwin" else 1024
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * factor
+
+
+def _call_forked(func, args, kwargs):
+    """Call `func` in a forked helper process.
+
+    Returns
+    -------
+    tuple
+        (ok, result or exception, CPU seconds, peak RSS in bytes), the usage
+        being the one of the child processes of the helper.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read_fd)
+            try:
+                result = (True, func(*args, **kwargs))
+            except BaseException as e:
+                result = (False, e)
+            usage = _children_usage()
+            try:
+                data = pickle.dumps(result + usage)
+            except Exception:
+                # result or exception that cannot be pickled
+                data = pickle.dumps((False, RuntimeError(repr(result[1]))) + usage)
+            with os.fdopen(write_fd, "wb") as f:
+                f.write(data)
+            code = 0
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as f:
+        data = f.read()
+    _, status = os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError(
+            f"The helper process running {func!r} died with status {status}."
+        )
+    return pickle.loads(data)
+
+
+def _total_size(paths):
+    size = 0
+    for path in paths:
+        try:
+            size += os.stat(str(path)).st_size
+        except FileNotFoundError:
+            continue
+    return size
+
+
+class Stage(object):
+    """Running stage, as given by `StageRecorder.stage`.
+
+    Attributes
+    ----------
+    cpu : float
+        CPU seconds of the programs called with `run`, NaN without calls.
+    max_rss : float
+        Peak resident memory in bytes of the largest of these programs.
+    """
+
+    def __init__(self):
+        self.cpu = float("nan")
+        self.max_rss = float("nan")
+
+    def run(self, func, *args, **kwargs):
+        """Call `func`, e.g. an ISIS program of pysis, and account its processes.
+
+        Without `os.fork` or the `resource` module, `func` is called
+        directly and nothing is accounted.
+
+        Returns
+        -------
+        object
+            The return value of `func`, whose exceptions are raised here.
+        """
+        if not (_RESOURCE_AVAILABLE and hasattr(os, "fork")):
+            return func(*args, **kwargs)
+        ok, value, cpu, max_rss = _call_forked(func, args, kwargs)
+        if math.isnan(self.cpu):
+            self.cpu, self.max_rss = 0.0, 0
+        self.cpu += cpu
+        self.max_rss = max(self.max_rss, max_rss)
+        if not ok:
+            raise value
+        return value
+
+
+class StageRecorder(object):
+    """Collect timing and resource records of pipeline stages.
+
+    Attributes
+    ----------
+    records : list of dict
+        One record per stage run, with the keys of `COLUMNS`.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.started = dt.datetime.now(dt.timezone.utc)
+
+    @contextmanager
+    def stage(self, img_id, stage, *outputs):
+        """Record the stage run in the with-block.
+
+        Call the ISIS program with the `run` method of the `Stage` given by
+        the with-statement to record its CPU time and memory:
+
+        >>> with recorder.stage(img_id, "cisscal", to) as stage:
+        ...     stage.run(cisscal, from_=from_, to=to)
+
+        Parameters
+        ----------
+        img_id : str
+            Image id the stage works on.
+        stage : str
+            Name of the stage, usually the ISIS program.
+        outputs : str or pathlib.Path
+            Files produced by the stage. Their total size is recorded and the
+            name of the first one as `product`, to tell apart several runs of
+            the same program for one image.
+        """
+        start = dt.datetime.now(dt.timezone.utc)
+        t0 = time.perf_counter()
+        status = "failed"
+        running = Stage()
+        try:
+            yield running
+            status = "ok"
+        finally:
+            wall = time.perf_counter() - t0
+            record = dict(
+                img_id=str(img_id),
+                stage=stage,
+                product=Path(outputs[0]).name if outputs else None,
+                status=status,
+                start=start.isoformat(),
+                wall=wall,
+                cpu=running.cpu,
+                max_rss=running.max_rss,
+                output_size=_total_size(outputs),
+            )
+            self.records.append(record)
+            logger.info("%s %s for %s in %.1f s.", stage, status, img_id, wall)
+
+    def to_dataframe(self):
+        "pd.DataFrame: One row per recorded stage run."
+        return pd.DataFrame(self.records, columns=COLUMNS)
+
+    def summary(self):
+        """Statistics per stage.
+
+        Returns
+        -------
+        pd.DataFrame
+            Number of runs and failures, total and mean wall and CPU time,
+            the peak RSS and the total output size per stage.
+        """
+        df = self.to_dataframe()
+        df["failed"] = df.status != "ok"
+        return df.groupby("stage").agg(
+            runs=("wall", "size"),
+            failed=("failed", "sum"),
+            wall_total=("wall", "sum"),
+            wall_mean=("wall", "mean"),
+            cpu_total=("cpu", "sum"),
+            max_rss=("max_rss", "max"),
+            output_size=("output_size", "sum"),
+        )
+
+    def write_json(self, path):
+        "Write run information and all records to `path` as JSON."
+        report = dict(
+            host=socket.gethostname(),
+            started=self.started.isoformat(),
+            n_images=len({record["img_id"] for record in self.records}),
+            stages=self.records,
+        )
+        with open(str(path), "w") as f:
+            json.dump(report, f, indent=2)
+
+    def write_csv(self, path):
+        "Write all records to `path` as CSV."
+        self.to_dataframe().to_csv(str(path), index=False)
+
+    def write_prometheus(self, path, prefix="pyciss_stage"):
+        """Write the per-stage totals and peaks in the Prometheus text format.
+
+        The file is meant for the textfile collector of the node exporter and
+        is replaced atomically.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Output file, should end with '.prom'.
+        prefix : str
+            Prefix of the metric names.
+        """
+        summary = self.summary()
+        metrics = [
+            ("runs_total", "counter", "Stage runs.", "runs"),
+            ("failures_total", "counter", "Failed stage runs.", "failed"),
+            ("wall_seconds_total", "counter", "Wall time.", "wall_total"),
+            ("cpu_seconds_total", "counter", "CPU time of ISIS.", "cpu_total"),
+            ("output_bytes_total", "counter", "Output file size.", "output_size"),
+            ("max_rss_bytes", "gauge", "Peak RSS of ISIS.", "max_rss"),
+        ]
+        lines = []
+        for name, kind, help_text, column in metrics:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for stage, value in summary[column].dropna().items():
+                lines.append(f'{prefix}_{name}{{stage="{stage}"}} {float(value):g}')
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        os.replace(str(tmp), str(path))
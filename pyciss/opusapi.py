@@ -4,13 +4,14 @@ for OPUS data, metadata, and preview images.
 """
 from pathlib import Path
 from urllib.parse import urlencode, urlparse
-from urllib.request import unquote, urlretrieve
+from urllib.request import unquote
 
 import pandas as pd
 import requests
-from IPython.display import HTML, display
 
 from . import io
+from .planner import plan_downloads
+from .transfers import Downloader
 
 base_url = "https://tools.pds-rings.seti.org/opus/api"
 metadata_url = base_url + "/metadata"
@@ -152,11 +153,18 @@ class OPUS(object):
 
     """Manage OPUS API requests.
 
-
+    Parameters
+    ----------
+    silent : bool
+        Do not print query results and downloaded files.
+    downloader : transfers.Downloader, optional
+        Downloader for `download_results` and `download_previews`, e.g. with
+        a different rate limit. Its `summary` collects the transfer telemetry.
     """
 
-    def __init__(self, silent=False):
+    def __init__(self, silent=False, downloader=None):
         self.silent = silent
+        self.downloader = Downloader() if downloader is None else downloader
 
     def query_image_id(self, image_id):
         """Query OPUS via the image_id.
@@ -293,6 +301,8 @@ class OPUS(object):
         size : {'small', 'med', 'thumb', 'full'}
             Determines the size of the preview image to be shown.
         """
+        from IPython.display import HTML, display
+
         d = dict(small=256, med=512, thumb=100, full=1024)
         try:
             width = d[size]
@@ -310,33 +320,46 @@ class OPUS(object):
         )
         display(HTML(imagesList))
 
-    def download_results(self, savedir=None, raw=True, calib=False, index=None):
+    def download_results(
+        self, savedir=None, raw=True, calib=False, index=None, overwrite=False
+    ):
         """Download the previously found and stored Opus obsids.
 
+        Files already in the database are only downloaded again if they are
+        incomplete, see `planner.plan_downloads`.
+
         Parameters
         ==========
         savedir: str or pathlib.Path, optional
             If the database root folder as defined by the config.ini should not be used,
             provide a different savedir here. It will be handed to PathManager.
+        overwrite : bool
+            Download also the files that are already complete.
         """
         obsids = self.obsids if index is None else [self.obsids[index]]
-        for obsid in obsids:
-            pm = io.PathManager(obsid.img_id, savedir=savedir)
-            pm.basepath.mkdir(exist_ok=True)
-            to_download = []
-            if raw is True:
-                to_download.extend(obsid.raw_urls)
-            if calib is True:
-                to_download.extend(obsid.calib_urls)
-            for url in to_download:
-                basename = Path(url).name
-                print("Downloading", basename)
-                store_path = str(pm.basepath / basename)
-                try:
-                    urlretrieve(url, store_path)
-                except Exception as e:
-                    urlretrieve(url.replace("https", "http"), store_path)
-            return str(pm.basepath)
+        plan = plan_downloads(obsids, raw=raw, calib=calib, savedir=savedir)
+        jobs = plan.all_jobs if overwrite else plan.jobs
+        if not self.silent and len(jobs) < len(plan.manifest):
+            print(
+                "Skipping {} files already in the database.".format(
+                    len(plan.manifest) - len(jobs)
+                )
+            )
+        for folder in {path.parent for _, path in jobs}:
+            folder.mkdir(exist_ok=True)
+        self._download(jobs)
+        if obsids:
+            return str(io.PathManager(obsids[-1].img_id, savedir=savedir).basepath)
+
+    def _download(self, jobs):
+        if not self.silent:
+            for _, path in jobs:
+                print("Downloading", path.name)
+        records = self.downloader.download(jobs)
+        failed = records[records.status != 200]
+        for url, error in zip(failed.url, failed.error):
+            print("Failed to download {}: {}".format(url, error))
+        return records
 
     def download_previews(self, savedir=None):
         """Download preview files for the previously found and stored Opus obsids.
@@ -347,9 +370,10 @@ class OPUS(object):
             If the database root folder as defined by the config.ini should not be used,
             provide a different savedir here. It will be handed to PathManager.
         """
+        jobs = []
         for obsid in self.obsids:
             pm = io.PathManager(obsid.img_id, savedir=savedir)
             pm.basepath.mkdir(exist_ok=True)
             basename = Path(obsid.medium_img_url).name
-            print("Downloading", basename)
-            urlretrieve(obsid.medium_img_url, str(pm.basepath / basename))
+            jobs.append((obsid.medium_img_url, pm.basepath / basename))
+        self._download(jobs)
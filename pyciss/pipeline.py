@@ -1,11 +1,14 @@
 """ Note that the calibration starts from the LBL files, not the IMG !!! """
 from __future__ import division, print_function
 
+import functools
 import logging
 import os
 from pathlib import Path
 
-from . import io
+from . import io, spice, store
+from .labels import patch_label, read_label
+from .metrics import StageRecorder
 
 try:
     from pysis import IsisPool
@@ -14,8 +17,6 @@ try:
         ciss2isis,
         cisscal,
         dstripe,
-        editlab,
-        getkey,
         isis2std,
         ringscam2map,
         spiceinit,
@@ -63,25 +64,91 @@ class Calibrator(object):
         They look good, but one must be aware of this for interpretation.
         I usually take a median on all original resolutions
         of my dataset and set it to that value.
+    recorder : metrics.StageRecorder, optional
+        Recorder for the timing and resources of the ISIS stages. Pass the same
+        recorder to many Calibrators to collect a report of a whole run.
+    kernel_cache : spice.KernelCache, optional
+        Cache of the SPICE kernels resolved by spiceinit. Images in a cached
+        time range get their kernels from it instead of the kernel search,
+        see `spice.calibrate_grouped`.
+    product_store : store.ProductStore, optional
+        Store of calibrated products. Calibrations and remappings with the
+        same inputs as a stored one take its products instead of running ISIS,
+        new ones are added to it.
 
     """
 
     map_path = ISISDATA / "base/templates/maps/ringcylindrical.map"
 
     def __init__(
-        self, img_name, is_ring_data=True, do_map_project=True, final_resolution=500
+        self,
+        img_name,
+        is_ring_data=True,
+        do_map_project=True,
+        final_resolution=500,
+        recorder=None,
+        kernel_cache=None,
+        product_store=None,
     ):
         self.img_name = self.parse_img_name(img_name)
         self.is_ring_data = is_ring_data
         self.do_map_project = do_map_project
         self.final_resolution = final_resolution
+        self.recorder = StageRecorder() if recorder is None else recorder
+        self.kernel_cache = kernel_cache
+        self.product_store = product_store
+        self._inputs = None
+
+    def stage(self, name, *outputs):
+        "Context manager recording stage `name` of this image, see `recorder`."
+        return self.recorder.stage(self.pm.img_id, name, *outputs)
+
+    @property
+    def products(self):
+        "dict: Paths of the products of `standard_calib` by `store.product_name`."
+        paths = [self.pm.cal_cub, self.pm.dst_cub]
+        if self.do_map_project:
+            for cube in (self.pm.cubepath, self.pm.undestriped):
+                paths += [cube, cube.with_suffix(".tif")]
+        return {store.product_name(path): path for path in paths}
+
+    def calibration_inputs(self):
+        "dict: Inputs of the calibration for the `product_store`, see `store`."
+        if self._inputs is None:
+            self._inputs = store.calibration_inputs(
+                self.pm,
+                self.is_ring_data,
+                self.do_map_project,
+                self.final_resolution,
+                self.map_path,
+            )
+        return self._inputs
+
+    def _to_store(self, inputs, products):
+        if not all(path.exists() for path in products.values()):
+            logger.warning("Not storing incomplete products of %s.", self.pm.img_id)
+            return
+        self.product_store.put(store.key_of(inputs), products, inputs)
+
+    def standard_calib(self, from_store=True):
+        """Calibrate, destripe and map-project the raw image.
 
-    def standard_calib(self):
+        Parameters
+        ----------
+        from_store : bool
+            Take the products from the `product_store` if they are in it.
+        """
         pm = self.pm  # save typing
+        if from_store and self.product_store is not None:
+            key = store.key_of(self.calibration_inputs())
+            if self.product_store.fetch(key, self.products):
+                return
+        store.detach(self.products.values())
         # import PDS into ISIS
         try:
             # use temp file here for fillgap to go to
-            ciss2isis(from_=pm.raw_label, to="temp.cub")
+            with self.stage("ciss2isis", "temp.cub") as stage:
+                stage.run(ciss2isis, from_=pm.raw_label, to="temp.cub")
         except ProcessError as e:
             print("At Calibrator.standard_calib()'s ciss2isis:")
             print("ERR:", e.stderr)
@@ -91,7 +158,8 @@ class Calibrator(object):
             logger.info("Import to ISIS done.")
 
         # fill Hrs pixels from bad importer
-        fillgap(from_="temp.cub", to=pm.raw_cub, interp="akima")
+        with self.stage("fillgap", pm.raw_cub) as stage:
+            stage.run(fillgap, from_="temp.cub", to=pm.raw_cub, interp="akima")
         # check if label fits with data
         self.check_label()
 
@@ -99,12 +167,14 @@ class Calibrator(object):
         self.spiceinit()
 
         # calibration, use I/F as units
-        cisscal(from_=pm.raw_cub, to=pm.cal_cub, units="I/F")
+        with self.stage("cisscal", pm.cal_cub) as stage:
+            stage.run(cisscal, from_=pm.raw_cub, to=pm.cal_cub, units="I/F")
         logger.info("cisscal done.")
         end = pm.cal_cub  # keep track of last produced path
 
         # destriping
-        dstripe(from_=pm.cal_cub, to=pm.dst_cub, mode="horizontal")
+        with self.stage("dstripe", pm.dst_cub) as stage:
+            stage.run(dstripe, from_=pm.cal_cub, to=pm.dst_cub, mode="horizontal")
         logger.info("Destriping done.")
 
         if self.do_map_project:
@@ -118,17 +188,21 @@ class Calibrator(object):
             logger.warning(
                 "Map projection was skipped.\n" "Set map_project to True if wanted."
             )
+        if self.product_store is not None:
+            self._to_store(self.calibration_inputs(), self.products)
 
     def map_project(self, start, end):
         try:
-            ringscam2map(
-                from_=start,
-                to=end,
-                defaultrange="Camera",
-                map=self.map_path,
-                pixres="mpp",
-                resolution=self.final_resolution,
-            )
+            with self.stage("ringscam2map", end) as stage:
+                stage.run(
+                    ringscam2map,
+                    from_=start,
+                    to=end,
+                    defaultrange="Camera",
+                    map=self.map_path,
+                    pixres="mpp",
+                    resolution=self.final_resolution,
+                )
         except ProcessError as e:
             print("STDOUT:", e.stdout)
             print("STDERR:", e.stderr)
@@ -136,7 +210,8 @@ class Calibrator(object):
     def create_preview(self, end):
         # create tif quickview
         tifname = end.with_suffix(".tif")
-        isis2std(from_=end, to=tifname, format="tiff")
+        with self.stage("isis2std", tifname) as stage:
+            stage.run(isis2std, from_=end, to=tifname, format="tiff")
         logger.info("Created tif product: %s", tifname)
 
     def spiceinit(self):
@@ -145,9 +220,19 @@ class Calibrator(object):
         Note how Python name-spacing can distinguish between the method
         and the function with the same name. `spiceinit` from the outer
         namespace is the one imported from pysis.
+        With a `kernel_cache`, the kernels are taken from it if possible.
         """
         shape = "ringplane" if self.is_ring_data else None
-        spiceinit(from_=self.pm.raw_cub, cksmithed="yes", spksmithed="yes", shape=shape)
+        with self.stage("spiceinit", self.pm.raw_cub) as stage:
+            # the cache is used here, only spiceinit runs in the helper
+            spice.spiceinit_cached(
+                self.pm.raw_cub,
+                self.kernel_cache,
+                functools.partial(stage.run, spiceinit),
+                cksmithed="yes",
+                spksmithed="yes",
+                shape=shape,
+            )
         logger.info("spiceinit done.")
 
     def check_label(self):
@@ -163,18 +248,10 @@ class Calibrator(object):
         """
         if not self.is_ring_data:
             return
-        targetname = getkey(
-            from_=self.pm.raw_cub, grp="instrument", keyword="targetname"
-        )
-
-        if targetname.lower() != "saturn":
-            editlab(
-                from_=self.pm.raw_cub,
-                options="modkey",
-                keyword="TargetName",
-                value="Saturn",
-                grpname="Instrument",
-            )
+        targetname = read_label(self.pm.raw_cub).get("TargetName", group="Instrument")
+
+        if str(targetname).lower() != "saturn":
+            patch_label(self.pm.raw_cub, {"TargetName": "Saturn"}, group="Instrument")
 
     def parse_img_name(self, img_name):
         # Check if img_name is maybe a PathManager object with a `raw_label` attribute:
@@ -199,17 +276,33 @@ class Calibrator(object):
             output = self.pm.cubepath
         elif not Path(output).is_absolute():
             output = input_.with_name(output)
-        logger.info("Mapping %s to %s to resolution %i", input_, output, resolution)
-        ringscam2map(
-            from_=input_,
-            to=output,
-            map=self.map_path,
-            pixres="mpp",
-            defaultrange="Camera",
-            resolution=resolution,
-        )
         tifname = output.with_suffix(".tif")
-        isis2std(from_=output, to=tifname, format="tiff")
+        products = {"map.cub": output, "map.tif": tifname}
+        if self.product_store is not None:
+            inputs = store.remapping_inputs(
+                self.calibration_inputs(),
+                store.product_name(input_),
+                resolution,
+                self.map_path,
+            )
+            if self.product_store.fetch(store.key_of(inputs), products):
+                return
+        store.detach(products.values())
+        logger.info("Mapping %s to %s to resolution %i", input_, output, resolution)
+        with self.stage("ringscam2map", output) as stage:
+            stage.run(
+                ringscam2map,
+                from_=input_,
+                to=output,
+                map=self.map_path,
+                pixres="mpp",
+                defaultrange="Camera",
+                resolution=resolution,
+            )
+        with self.stage("isis2std", tifname) as stage:
+            stage.run(isis2std, from_=output, to=tifname, format="tiff")
+        if self.product_store is not None:
+            self._to_store(inputs, products)
 
 
 def calibrate_many(images):
@@ -0,0 +1,272 @@
+"""Plan downloads: find what is missing, size it and order it before fetching.
+
+`plan_downloads` takes image ids, `OPUSObsID` objects or an `OPUS` query
+and lists the raw and calibrated products of all images. Every file already
+in the database is checked: an image is complete if its size matches its
+label (RECORD_BYTES * FILE_RECORDS), a label if it is not empty. Images
+without a local label cannot be checked and are fetched again. The
+resulting `DownloadPlan` is a deduplicated manifest, ordered by the
+priority of the images and with labels first, of only the missing and
+incomplete files, with an estimate of the bytes and time to fetch them. Run
+it with `DownloadPlan.run`, or hand `DownloadPlan.jobs` to a
+`transfers.Downloader`; running a campaign again transfers nothing that is
+already there.
+
+Image ids are looked up in the local index, see `localopus.LocalIndex`, so
+planning does not need the OPUS API.
+"""
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from .io import PathManager, expected_file_bytes
+
+logger = logging.getLogger(__name__)
+
+# typical sizes of the products in bytes, for files without a local label
+TYPICAL_BYTES = {
+    ("raw", "image"): 2_125_000,
+    ("raw", "label"): 14_000,
+    ("calib", "image"): 4_200_000,
+    ("calib", "label"): 20_000,
+}
+# bytes/s assumed for the time estimate if no measured throughput is given
+DEFAULT_THROUGHPUT = 2e6
+FETCH = ("missing", "incomplete", "unverified")
+MANIFEST_COLUMNS = [
+    "priority",
+    "img_id",
+    "product",
+    "kind",
+    "url",
+    "path",
+    "status",
+    "size",
+    "expected_bytes",
+]
+
+
+def _urls(obsid, raw, calib):
+    products = []
+    if raw:
+        products.append(("raw", obsid.raw_urls))
+    if calib and obsid.calib is not None:
+        products.append(("calib", obsid.calib_urls))
+    for product, urls in products:
+        for url in urls:
+            kind = "label" if url.upper().endswith(".LBL") else "image"
+            yield product, kind, url
+
+
+def _obsids(items, index):
+    "OPUSObsID objects for image ids, OPUSObsID objects or an OPUS query."
+    items = getattr(items, "obsids", items)
+    obsids = []
+    for item in items:
+        if hasattr(item, "raw_urls"):
+            obsids.append(item)
+            continue
+        if index is None:
+            from .localopus import LocalIndex
+
+            index = LocalIndex.load()
+        pos = index.find(str(item))
+        if pos is None:
+            logger.warning("%s is not in the local index, skipping it.", item)
+            continue
+        obsids.append(index.obsid(pos))
+    return obsids
+
+
+def check_file(path, kind, label=None):
+    """Check a downloaded file.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        File to check.
+    kind : {'image', 'label'}
+    label : pathlib.Path, optional
+        Label of an image, to get its expected size.
+
+    Returns
+    -------
+    status : {'missing', 'incomplete', 'unverified', 'complete', 'present'}
+        'unverified' are images that exist without a local label, which
+        may be truncated and are fetched again. 'present' are images whose
+        label does not give their size.
+    size : int
+        Size of the file, 0 if missing.
+    expected : int or None
+        Expected size of an image from its label.
+    """
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        size = None
+    expected = None
+    has_label = label is not None and label.exists()
+    if kind == "image" and has_label:
+        expected = expected_file_bytes(label)
+    if size is None:
+        return "missing", 0, expected
+    if size == 0:
+        return "incomplete", size, expected
+    if kind == "label":
+        return "complete", size, expected
+    if not has_label:
+        return "unverified", size, expected
+    if expected is None:
+        return "present", size, expected
+    return ("complete" if size == expected else "incomplete"), size, expected
+
+
+class DownloadPlan(object):
+    """Manifest of the files of a download campaign.
+
+    Parameters
+    ----------
+    manifest : pd.DataFrame
+        One row per file, ordered by priority, with the columns in
+        `MANIFEST_COLUMNS`. `status` is 'missing', 'incomplete' or
+        'unverified' for files to fetch, 'complete' or 'present' for files
+        to keep.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    @property
+    def to_fetch(self):
+        "pd.DataFrame: Rows of the files to download."
+        return self.manifest[self.manifest.status.isin(FETCH)]
+
+    @property
+    def jobs(self):
+        "list of (url, pathlib.Path): Downloads for `transfers.Downloader.download`."
+        df = self.to_fetch
+        return [(url, Path(path)) for url, path in zip(df.url, df.path)]
+
+    @property
+    def all_jobs(self):
+        "list of (url, pathlib.Path): Downloads of all files, also the present ones."
+        df = self.manifest
+        return [(url, Path(path)) for url, path in zip(df.url, df.path)]
+
+    @property
+    def estimated_bytes(self):
+        "int: Expected bytes to fetch, typical sizes for files without label."
+        df = self.to_fetch
+        typical = [TYPICAL_BYTES[key] for key in zip(df["product"], df["kind"])]
+        return int(df.expected_bytes.fillna(pd.Series(typical, index=df.index)).sum())
+
+    def estimated_seconds(self, throughput=None):
+        """Expected download time.
+
+        Parameters
+        ----------
+        throughput : float, optional
+            Bytes/s, e.g. the `throughput` of `transfers.Downloader.summary`.
+            Default `DEFAULT_THROUGHPUT`.
+        """
+        throughput = DEFAULT_THROUGHPUT if not throughput else throughput
+        return self.estimated_bytes / throughput
+
+    def summary(self, throughput=None):
+        """Numbers of the plan.
+
+        Returns
+        -------
+        dict
+            Number of images, files per status, files and bytes to fetch and
+            the estimated seconds.
+        """
+        return dict(
+            images=self.manifest.img_id.nunique(),
+            status=self.manifest.status.value_counts().to_dict(),
+            files=len(self.to_fetch),
+            bytes=self.estimated_bytes,
+            seconds=self.estimated_seconds(throughput),
+        )
+
+    def write(self, path):
+        "Write the manifest as CSV."
+        self.manifest.to_csv(str(path), index=False)
+
+    @classmethod
+    def read(cls, path):
+        "Read a manifest written by `write`."
+        return cls(pd.read_csv(str(path)))
+
+    def run(self, downloader=None, overwrite=False):
+        """Download the missing and incomplete files.
+
+        Parameters
+        ----------
+        downloader : transfers.Downloader, optional
+            Downloader to use, by default a new one.
+        overwrite : bool
+            Download all files of the manifest again.
+
+        Returns
+        -------
+        pd.DataFrame
+            Records of the transfers, see `transfers.Downloader.download`.
+        """
+        from .transfers import Downloader
+
+        downloader = Downloader() if downloader is None else downloader
+        jobs = self.all_jobs if overwrite else self.jobs
+        for folder in {path.parent for _, path in jobs}:
+            folder.mkdir(parents=True, exist_ok=True)
+        return downloader.download(jobs)
+
+
+def plan_downloads(items, raw=True, calib=False, savedir=None, index=None):
+    """Plan the downloads for many images.
+
+    Parameters
+    ----------
+    items : iterable or OPUS
+        Image ids like 'N1454725799' or 'N1454725799_1', `OPUSObsID` objects,
+        or an `OPUS`/`LocalOPUS` object with query results. Earlier items
+        are fetched first.
+    raw : bool
+        Plan the raw .IMG and .LBL files.
+    calib : bool
+        Plan the calibrated _CALIB.IMG and _CALIB.LBL files.
+    savedir : str or pathlib.Path, optional
+        Database folder, default the one of the config. Handed to PathManager.
+    index : localopus.LocalIndex, optional
+        Index to look up image ids, by default `LocalIndex.load()` if needed.
+
+    Returns
+    -------
+    DownloadPlan
+    """
+    rows = []
+    seen = set()
+    for priority, obsid in enumerate(_obsids(items, index)):
+        basepath = PathManager(obsid.img_id, savedir=savedir).basepath
+        files = [
+            (product, kind, url, basepath / Path(url).name)
+            for product, kind, url in _urls(obsid, raw, calib)
+        ]
+        labels = {product: path for product, kind, _, path in files if kind == "label"}
+        # labels first, they are small and tell the expected size of the images
+        files.sort(key=lambda f: (f[0] != "raw", f[1] != "label"))
+        for product, kind, url, path in files:
+            if path in seen:
+                continue
+            seen.add(path)
+            status, size, expected = check_file(path, kind, labels.get(product))
+            rows.append(
+                (priority, obsid.img_id, product, kind, url, str(path))
+                + (status, size, expected)
+            )
+    manifest = pd.DataFrame(rows, columns=MANIFEST_COLUMNS)
+    manifest["expected_bytes"] = manifest.expected_bytes.astype("float64")
+    plan = DownloadPlan(manifest)
+    logger.info("Download plan: %s", plan.summary())
+    return plan
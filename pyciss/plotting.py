@@ -4,16 +4,21 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
 from astropy import units as u
-from ipywidgets import fixed, interact
 
+from . import catalogs
 from ._utils import which_epi_janus_resonance
-from .meta import get_all_resonances
 from .ringcube import RingCube
 
 
 logger = logging.getLogger(__name__)
 
-resonance_table = get_all_resonances()
+
+def __getattr__(name):
+    # the resonance table used to be read at import, see `catalogs`
+    if name == "resonance_table":
+        return catalogs.get("resonances")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 interpolators = [
     "none",
@@ -67,6 +72,8 @@ def myimshow(img, vmin, vmax, i, cmap="gray"):
 
 
 def myinteract(img):
+    from ipywidgets import fixed, interact
+
     min_ = round(np.nanmin(img), 4)
     max_ = round(np.nanmax(img), 4)
     p30, p70 = np.percentile(img[~np.isnan(img)], (30, 70))
@@ -103,9 +110,10 @@ def add_ticks_to_x(ax, newticks, newnames):
 
 def get_res_radius_from_res_name(res_name, cube):
     moon, resonance = res_name.split()
-    moon = which_epi_janus_resonance(moon, cube.imagetime)
-    row = resonance_table.query("moon==@moon and reson==@resonance")
-    return row.squeeze()["radius"] * u.km
+    if moon.lower() in ["janus", "epimetheus"]:
+        moon = which_epi_janus_resonance(moon, cube.imagetime)
+    radius = catalogs.get("resonance_catalog").get_radius(moon, resonance)
+    return radius * u.km
 
 
 def soliton_plot(
@@ -0,0 +1,206 @@
+"""Opt-in call statistics for RingCube and index operations.
+
+The main public functions and properties of `pyciss.ringcube` and
+`pyciss.index` are decorated with `profiled`. While profiling is disabled,
+the decorator only costs one flag check per call. While enabled, it counts
+calls, wall time and, with memory tracing, the peak memory allocated during
+each call, aggregated per function:
+
+>>> from pyciss import profiling
+>>> with profiling.profile() as stats:
+...     cube = RingCube('N1467345444')
+...     cube.imshow()
+>>> stats.report()
+
+Setting the environment variable PYCISS_PROFILE enables profiling for the
+whole process and prints the report to stderr at exit. PYCISS_PROFILE=time
+skips the memory tracing, which slows down allocations considerably.
+"""
+import atexit
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+_enabled = False
+_trace_memory = False
+# if tracemalloc was started by `enable`, and has to be stopped by `disable`
+_started_tracing = False
+# stack of the calls being profiled, per thread
+_local = threading.local()
+
+
+class CallStats(object):
+    """Aggregated calls, time and allocated bytes per function.
+
+    Attributes
+    ----------
+    data : dict
+        Maps the qualified function name to [calls, seconds, bytes].
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, nbytes):
+        with self.lock:
+            entry = self.data.setdefault(name, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += nbytes
+
+    def reset(self):
+        with self.lock:
+            self.data.clear()
+
+    def report(self):
+        """Table of the collected statistics.
+
+        Returns
+        -------
+        pd.DataFrame
+            calls, total and mean time in seconds and total and mean bytes
+            allocated per function, sorted by total time. Nested calls are
+            included in the numbers of their callers.
+        """
+        with self.lock:
+            df = pd.DataFrame.from_dict(
+                self.data, orient="index", columns=["calls", "total", "bytes"]
+            )
+        df.index.name = "function"
+        df["mean"] = df.total / df.calls
+        df["mean_bytes"] = df.bytes / df.calls
+        df = df[["calls", "total", "mean", "bytes", "mean_bytes"]]
+        return df.sort_values("total", ascending=False)
+
+
+stats = CallStats()
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(trace_memory=True):
+    """Start collecting statistics into `stats`.
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Also record the bytes allocated by the calls, using `tracemalloc`.
+    """
+    global _enabled, _trace_memory, _started_tracing
+    if trace_memory and not hasattr(tracemalloc, "reset_peak"):
+        logger.warning("Memory tracing requires Python 3.9 or later.")
+        trace_memory = False
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+    _enabled = True
+
+
+def disable():
+    "Stop collecting statistics, the collected ones are kept."
+    global _enabled, _started_tracing
+    _enabled = False
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+
+
+@contextmanager
+def profile(trace_memory=True, reset=True):
+    """Collect statistics within a with-block.
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Also record the bytes allocated by the calls.
+    reset : bool
+        Clear previously collected statistics first.
+
+    Yields
+    ------
+    CallStats
+        The module-level `stats`, call its `report` method afterwards.
+    """
+    was_enabled, was_tracing = _enabled, _trace_memory
+    if reset:
+        stats.reset()
+    enable(trace_memory)
+    try:
+        yield stats
+    finally:
+        disable()
+        if was_enabled:
+            enable(was_tracing)
+
+
+def _call_with_memory(func, args, kwargs):
+    # tracemalloc has only one peak counter, which every call resets; each
+    # frame carries the peak of its children up so the callers stay correct
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    current, peak = tracemalloc.get_traced_memory()
+    if stack:
+        stack[-1][1] = max(stack[-1][1], peak)
+    tracemalloc.reset_peak()
+    frame = [current, 0]
+    stack.append(frame)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stack.pop()
+        frame_peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1][1] = max(stack[-1][1], frame_peak)
+        _local.nbytes = frame_peak - frame[0]
+
+
+def profiled(func):
+    """Decorator recording the calls of `func` while profiling is enabled.
+
+    For properties, decorate the getter below the `property` decorator.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        t0 = time.perf_counter()
+        nbytes = 0
+        if _trace_memory and tracemalloc.is_tracing():
+            try:
+                return _call_with_memory(func, args, kwargs)
+            finally:
+                nbytes = _local.nbytes
+                stats.add(name, time.perf_counter() - t0, nbytes)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.add(name, time.perf_counter() - t0, nbytes)
+
+    return wrapper
+
+
+def _print_report():
+    if stats.data:
+        report = stats.report().to_string()
+        print("pyciss profile:", report, sep="\n", file=sys.stderr)
+
+
+if os.environ.get("PYCISS_PROFILE", "0") not in ("", "0"):
+    enable(trace_memory=os.environ["PYCISS_PROFILE"] != "time")
+    atexit.register(_print_report)
@@ -0,0 +1,232 @@
+"""Multi-resolution pyramids for map-projected ring cubes.
+
+`build_pyramid` stores 2x-downsampled, NaN-aware averaged levels of a cube
+in a sidecar `.pyramid.npz` file next to it. Level 0 is the cube itself,
+level k has 2**k times fewer pixels along each axis. `Pyramid.read` picks
+the coarsest level that still has the requested number of pixels across a
+radius range, so overviews and zooms only read and clip as much data as
+is displayed.
+"""
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .io import read_cube_img, read_cube_label
+from .resample import label_grid_key
+from .thumbnails import block_mean
+
+logger = logging.getLogger(__name__)
+
+
+def pyramid_path(cubepath):
+    "Sidecar path of the pyramid, e.g. N1234567890_1.cal.dst.map.pyramid.npz"
+    return Path(cubepath).with_suffix(".pyramid.npz")
+
+
+def build_pyramid(cubepath, min_size=64, overwrite=False):
+    """Build the pyramid sidecar file of a cube.
+
+    Parameters
+    ----------
+    cubepath : str or pathlib.Path
+        Path to a map-projected cube.
+    min_size : int
+        Stop when the longer side of a level is smaller than this.
+    overwrite : bool
+        Rebuild an up-to-date pyramid.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the pyramid file.
+    """
+    cubepath = Path(cubepath)
+    path = pyramid_path(cubepath)
+    if not overwrite and path.exists() and not Pyramid(cubepath).is_stale:
+        return path
+    minrad, maxrad, _, minlon, maxlon, _ = label_grid_key(read_cube_label(cubepath))
+    data = read_cube_img(cubepath)
+    levels = {}
+    level = data
+    k = 0
+    while max(level.shape) >= 2 * min_size:
+        k += 1
+        level = block_mean(level, (2, 2)).astype("float32")
+        levels[f"level{k}"] = level
+    np.savez(
+        str(path),
+        shape=np.array(data.shape),
+        extent=np.array([minlon, maxlon, minrad, maxrad]),
+        cube_mtime=np.array(cubepath.stat().st_mtime),
+        **levels,
+    )
+    logger.info("Created pyramid with %i levels: %s", k, path)
+    return path
+
+
+def radius_rows(extent, n, rmin=None, rmax=None, factor=1, n_rows=None):
+    """Rows of image data inside a radius range.
+
+    Parameters
+    ----------
+    extent : list
+        [minlon, maxlon, minrad, maxrad] of the full-resolution image, the
+        radii being the outer edges of its first and last row, as for imshow.
+    n : int
+        Number of rows of the image data.
+    rmin, rmax : float, optional
+        Radius range in Mm.
+    factor : int
+        Number of full-resolution rows averaged into one row of the data,
+        e.g. 2**k for pyramid level k. The last row may average fewer rows.
+    n_rows : int, optional
+        Number of rows of the full-resolution image, by default `n * factor`.
+
+    Returns
+    -------
+    slice
+        The rows with their centre in the range.
+    list
+        Extent of these rows.
+    """
+    minlon, maxlon, minrad, maxrad = extent
+    n_rows = n * factor if n_rows is None else n_rows
+    pixres = (maxrad - minrad) / n_rows
+    lower = minrad + np.arange(n) * factor * pixres
+    upper = np.minimum(lower + factor * pixres, maxrad)
+    radii = (lower + upper) / 2
+    rows = np.ones(radii.size, dtype=bool)
+    if rmin is not None:
+        rows &= radii >= rmin
+    if rmax is not None:
+        rows &= radii <= rmax
+    rows = np.flatnonzero(rows)
+    if rows.size == 0:
+        raise ValueError("Radius range is outside of the cube.")
+    first, last = int(rows[0]), int(rows[-1])
+    return slice(first, last + 1), [minlon, maxlon, lower[first], upper[last]]
+
+
+def crop_radius(data, extent, rmin=None, rmax=None, factor=1, n_rows=None):
+    """Select the rows of image data inside a radius range.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Image data, radius along axis 0.
+    extent, rmin, rmax, factor, n_rows
+        See `radius_rows`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Selected rows of `data`, those with their centre in the range.
+    list
+        Extent of the selected rows.
+    """
+    rows, extent = radius_rows(extent, data.shape[0], rmin, rmax, factor, n_rows)
+    return data[rows], extent
+
+
+class Pyramid(object):
+    """Read access to the pyramid of a cube.
+
+    Parameters
+    ----------
+    cubepath : str or pathlib.Path
+        Path to the map-projected cube, not the pyramid file.
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of the full-resolution image, (radius, azimuth).
+    extent : list
+        [minlon, maxlon, minrad, maxrad] in degrees and Mm, as `RingCube.extent`.
+    n_levels : int
+        Number of levels, including level 0, the cube itself.
+    cube_mtime : float
+        Modification time of the cube the pyramid was built from.
+    """
+
+    def __init__(self, cubepath):
+        self.cubepath = Path(cubepath)
+        self.path = pyramid_path(cubepath)
+        # np.load of an npz file only reads the arrays when accessed
+        with np.load(str(self.path)) as npz:
+            self.shape = tuple(int(n) for n in npz["shape"])
+            self.extent = [float(v) for v in npz["extent"]]
+            self.cube_mtime = float(npz["cube_mtime"])
+            self.n_levels = 1 + sum(name.startswith("level") for name in npz.files)
+
+    @property
+    def is_stale(self):
+        "bool: True if the cube was changed after the pyramid was built."
+        return os.stat(str(self.cubepath)).st_mtime > self.cube_mtime
+
+    def level_shape(self, k):
+        shape = self.shape
+        for _ in range(k):
+            shape = tuple(-(-n // 2) for n in shape)
+        return shape
+
+    def choose_level(self, rmin=None, rmax=None, npix=None):
+        """Find the coarsest level with at least `npix` pixels in a radius range.
+
+        Parameters
+        ----------
+        rmin, rmax : float, optional
+            Radius range in Mm, by default the full cube.
+        npix : int, optional
+            Required number of pixels along radius. Level 0 if not given.
+
+        Returns
+        -------
+        int
+        """
+        if npix is None:
+            return 0
+        minrad, maxrad = self.extent[2:]
+        rmin = minrad if rmin is None else max(rmin, minrad)
+        rmax = maxrad if rmax is None else min(rmax, maxrad)
+        fraction = (rmax - rmin) / (maxrad - minrad)
+        level = 0
+        for k in range(1, self.n_levels):
+            if self.level_shape(k)[0] * fraction < npix:
+                break
+            level = k
+        return level
+
+    def read_level(self, k, rows=None):
+        "Image data of level `k`, only the `rows` slice of it if given."
+        if k == 0:
+            # only the rows are read from the cube
+            return read_cube_img(self.cubepath, rows=rows)
+        # opened per read, so no file handle is kept open
+        with np.load(str(self.path)) as npz:
+            data = npz[f"level{k}"]
+        return data if rows is None else data[rows]
+
+    def read(self, rmin=None, rmax=None, npix=None):
+        """Read the image data of a radius range at a sufficient resolution.
+
+        Parameters
+        ----------
+        rmin, rmax : float, optional
+            Radius range in Mm, by default the full cube.
+        npix : int, optional
+            Required number of pixels along radius, full resolution if not
+            given.
+
+        Returns
+        -------
+        numpy.ndarray
+            Image data, radius along axis 0.
+        list
+            [minlon, maxlon, minrad, maxrad] of the returned data.
+        """
+        k = self.choose_level(rmin, rmax, npix)
+        n = self.level_shape(k)[0]
+        rows, extent = radius_rows(self.extent, n, rmin, rmax, 2**k, self.shape[0])
+        return self.read_level(k, rows), extent
@@ -0,0 +1,339 @@
+"""Batch rendering of PNG quicklooks for many ring cubes.
+
+`RingCube.imshow(save=True)` and `plotting.resonance_plot` create a new
+figure and resonance axis for every image. For quicklooks of a whole
+database, `render_quicklooks` distributes the images over a process pool
+instead. Each worker creates one `QuicklookRenderer`, whose figure and axes
+are reused for all its images: only the image data, limits and resonance
+ticks are updated. The renderer draws with the Agg canvas directly, without
+pyplot, so it works headless and does not depend on the matplotlib backend.
+
+Images with a PNG that is newer than the cube are skipped, so an
+interrupted run can simply be restarted.
+"""
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from . import workers
+from .io import PathManager
+from .scheduler import MemoryScheduler, estimate_memory
+
+logger = logging.getLogger(__name__)
+
+KINDS = ["imshow", "resonance"]
+
+
+def resolve_cubepath(img):
+    """Find the cube to render for an image id or cube path.
+
+    Same choice as `RingCube`: the destriped map cube if it exists, the
+    undestriped one otherwise.
+    """
+    if os.path.isabs(str(img)):
+        return Path(img)
+    pm = PathManager(img)
+    return pm.cubepath if pm.cubepath.exists() else pm.undestriped
+
+
+def quicklook_path(cubepath, outdir=None):
+    """Path of the imshow quicklook, named like `RingCube.plotfname`.
+
+    Parameters
+    ----------
+    cubepath : str or pathlib.Path
+        Path to the cube.
+    outdir : str or pathlib.Path, optional
+        Folder for the PNG, by default the folder of the cube.
+    """
+    cubepath = Path(cubepath)
+    outdir = cubepath.parent if outdir is None else Path(outdir)
+    return outdir / (cubepath.name.split(".")[0] + ".png")
+
+
+def is_up_to_date(cubepath, kind="imshow", outdir=None):
+    """Check if a quicklook newer than the cube exists.
+
+    Parameters
+    ----------
+    cubepath : str or pathlib.Path
+        Path to the cube.
+    kind : {'imshow', 'resonance'}
+        Kind of quicklook.
+    outdir : str or pathlib.Path, optional
+        Folder of the PNGs, by default the folder of the cube.
+
+    Returns
+    -------
+    bool
+    """
+    cubepath = Path(cubepath)
+    try:
+        cube_mtime = cubepath.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    if kind == "imshow":
+        candidates = [quicklook_path(cubepath, outdir)]
+    else:
+        # name depends on the resonance, {img_id}_{resonance}.png
+        outdir = cubepath.parent if outdir is None else Path(outdir)
+        prefix = cubepath.name.split("_")[0] + "_"
+        try:
+            names = os.listdir(str(outdir))
+        except FileNotFoundError:
+            return False
+        candidates = [
+            outdir / name
+            for name in names
+            if name.startswith(prefix) and name.endswith(".png")
+            # but not the imshow quicklook {img_id}_{version}.png
+            and not name[len(prefix):].split(".")[0].isdigit()
+        ]
+    for candidate in candidates:
+        try:
+            if candidate.stat().st_mtime >= cube_mtime:
+                return True
+        except FileNotFoundError:
+            continue
+    return False
+
+
+class QuicklookRenderer(object):
+    """Render quicklooks of ring cubes into one reused figure.
+
+    Parameters
+    ----------
+    kind : {'imshow', 'resonance'}
+        'imshow' creates the image display of `RingCube.imshow`,
+        'resonance' the image and profile display of `plotting.resonance_plot`.
+    show_resonances : {'some', 'all'} or list
+        Resonances to show on the resonance axis of the 'imshow' kind.
+    dpi : int
+        Resolution of the PNGs.
+    """
+
+    def __init__(self, kind="imshow", show_resonances="some", dpi=None):
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {KINDS}.")
+        self.kind = kind
+        self.show_resonances = show_resonances
+        self.dpi = dpi if dpi is not None else (150 if kind == "imshow" else 200)
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        if kind == "imshow":
+            self.ax = self.fig.add_subplot(1, 1, 1)
+            self.profile_ax = None
+        else:
+            self.ax, self.profile_ax = self.fig.subplots(nrows=2)
+        self.ax.set_xlabel("Longitude [deg]")
+        self.ax.set_ylabel("Radius [Mm]")
+        self.ax.ticklabel_format(useOffset=False)
+        self.resonance_axis = self.ax.twinx()
+        self.resonance_axis.ticklabel_format(useOffset=False)
+        self.im = None
+        if self.profile_ax is not None:
+            line_kwargs = dict(alpha=0.5, color="cyan", linestyle="dotted", lw=3)
+            self.res_hline = self.ax.axhline(0, xmin=0.75, xmax=1.0, **line_kwargs)
+            self.res_vline = self.profile_ax.axvline(0, **line_kwargs)
+            (self.profile_line,) = self.profile_ax.plot([], [], color="white", lw=1)
+            self.profile_ax.set_facecolor("black")
+            self.profile_ax.set_title("Longitude-median profile over radius")
+            self.profile_ax.set_xlabel("Radius [Mm]")
+            self.profile_ax.set_ylabel("I/F")
+
+    def _update_image(self, data, extent, vmin, vmax):
+        if self.im is None:
+            self.im = self.ax.imshow(
+                data,
+                extent=extent,
+                cmap="gray",
+                vmin=vmin,
+                vmax=vmax,
+                interpolation="none",
+                origin="lower",
+                aspect="auto",
+            )
+        else:
+            self.im.set_data(data)
+            self.im.set_extent(extent)
+            self.im.set_clim(vmin, vmax)
+        self.ax.set_xlim(*extent[:2])
+
+    def _update_resonance_axis(self, ticks, rmin, rmax):
+        self.ax.set_ylim(rmin, rmax)
+        self.resonance_axis.set_ylim(rmin, rmax)
+        # the resonance table is in km, the plots in Mm
+        self.resonance_axis.set_yticks(ticks.radius / 1000)
+        self.resonance_axis.set_yticklabels(ticks.name)
+
+    def render(self, cube, outdir=None):
+        """Render and save the quicklook of one cube.
+
+        Parameters
+        ----------
+        cube : pyciss.ringcube.RingCube
+            Cube to render.
+        outdir : str or pathlib.Path, optional
+            Folder for the PNG, by default the folder of the cube.
+
+        Returns
+        -------
+        pathlib.Path
+            Path of the created PNG.
+        """
+        data = cube.img
+        extent = cube.extent
+        vmin, vmax = cube.calc_clim(data)
+        self._update_image(data, extent, vmin, vmax)
+        self.ax.set_title(cube.plot_title, fontsize=12)
+        if self.kind == "imshow":
+            ticks = cube.resonance_ticks(self.show_resonances)
+            self._update_resonance_axis(ticks, *extent[2:])
+            savepath = quicklook_path(cube.filename, outdir)
+        else:
+            savepath = self._render_resonance(cube, data, extent, outdir)
+        self.fig.savefig(str(savepath), dpi=self.dpi)
+        logger.info("Created %s", savepath)
+        return savepath
+
+    def _render_resonance(self, cube, data, extent, outdir):
+        inside = cube.inside_resonances
+        row_filter = inside.moon == cube.janus_swap_phase
+        if row_filter.any():
+            res_radius, res_name = inside.loc[row_filter, ["radius", "reson"]].iloc[0]
+            res_radius = res_radius / 1000
+            rmin = res_radius - 0.02
+            rmax = rmin + 0.2
+        else:
+            res_radius = np.nan
+            res_name = "no_janus_res"
+            rmin, rmax = extent[2:]
+        self.res_hline.set_ydata([res_radius, res_radius])
+        self.res_vline.set_xdata([res_radius, res_radius])
+        self._update_resonance_axis(cube.resonance_ticks(["janus"]), rmin, rmax)
+
+        ifs = np.nan_to_num(cube.median_profile)
+        ifs[ifs < 0] = 0
+        self.profile_line.set_data(np.linspace(*extent[2:], data.shape[0]), ifs)
+        iflow, ifhigh = np.percentile(ifs, (0.5, 99.5))
+        self.profile_ax.set_ylim(iflow / 1.1, ifhigh * 1.1)
+        self.profile_ax.set_xlim(rmin, rmax)
+
+        outdir = Path(cube.filename).parent if outdir is None else Path(outdir)
+        return outdir / f"{cube.pm.img_id}_{res_name.replace(':', '_')}.png"
+
+
+# one renderer per worker process, created by the pool initializer
+_renderer = None
+
+
+def _init_worker(kind, renderer_kwargs):
+    global _renderer
+    _renderer = QuicklookRenderer(kind, **renderer_kwargs)
+
+
+def _render_one(args):
+    from .ringcube import RingCube
+
+    img, outdir, force = args
+    try:
+        cubepath = resolve_cubepath(img)
+        if not force and is_up_to_date(cubepath, _renderer.kind, outdir):
+            return str(img), "skipped", None
+        savepath = _renderer.render(RingCube(str(cubepath)), outdir)
+    except Exception as e:
+        logger.exception("Rendering %s failed.", img)
+        return str(img), "failed", repr(e)
+    return str(img), "rendered", str(savepath)
+
+
+def render_quicklooks(
+    imgs,
+    kind="imshow",
+    outdir=None,
+    processes=None,
+    force=False,
+    chunksize=4,
+    budget=None,
+    **renderer_kwargs,
+):
+    """Render quicklooks for many cubes in parallel.
+
+    Parameters
+    ----------
+    imgs : iterable of str or pathlib.Path
+        Image ids or absolute paths to cubes.
+    kind : {'imshow', 'resonance'}
+        Kind of quicklook, see `QuicklookRenderer`.
+    outdir : str or pathlib.Path, optional
+        Folder for the PNGs, by default the folder of each cube.
+    processes : int, optional
+        Maximum number of worker processes, by default the number of CPUs.
+        With 1, the images are rendered in this process.
+    force : bool
+        Render also images with an up-to-date quicklook.
+    chunksize : int
+        Number of images handed to a worker at once, with `budget=False`.
+    budget : int, str or False, optional
+        Memory budget for the cubes rendered at once, see
+        `scheduler.MemoryScheduler`, by default `scheduler.default_budget()`.
+        False to run `processes` renderers regardless of the cube sizes.
+    renderer_kwargs
+        Passed on to `QuicklookRenderer`.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per image, with `status` 'rendered', 'skipped' or 'failed' and
+        `result`, the PNG path or the error.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}.")
+    if outdir is not None:
+        Path(outdir).mkdir(parents=True, exist_ok=True)
+    imgs = list(imgs)
+    results = [None] * len(imgs)
+    # up-to-date cubes are skipped here, so only the others are sized
+    todo, cubepaths = [], []
+    for i, img in enumerate(imgs):
+        try:
+            cubepath = resolve_cubepath(img)
+        except Exception:
+            # the worker reports the error
+            cubepath = None
+        if not (force or cubepath is None) and is_up_to_date(cubepath, kind, outdir):
+            results[i] = (str(img), "skipped", None)
+        else:
+            todo.append(i)
+            cubepaths.append(cubepath)
+    # checked above, the workers render without checking again
+    jobs = [(imgs[i], outdir, True) for i in todo]
+    if not jobs:
+        rendered = []
+    elif processes == 1:
+        _init_worker(kind, renderer_kwargs)
+        rendered = [_render_one(job) for job in jobs]
+    else:
+        # the workers get the catalog tables of this process via shared memory
+        with workers.pool(
+            processes, initializer=_init_worker, initargs=(kind, renderer_kwargs)
+        ) as pool:
+            if budget is False:
+                rendered = list(pool.imap(_render_one, jobs, chunksize))
+            else:
+                # unresolved cubes get the default estimate of a missing file
+                memory = [
+                    estimate_memory(path or job[0]) for job, path in zip(jobs, cubepaths)
+                ]
+                scheduler = MemoryScheduler(budget, processes)
+                rendered = scheduler.map(_render_one, jobs, memory, pool=pool)
+    for i, result in zip(todo, rendered):
+        results[i] = result
+    df = pd.DataFrame(results, columns=["img", "status", "result"])
+    logger.info("Quicklooks: %s", df.status.value_counts().to_dict())
+    return df
@@ -0,0 +1,334 @@
+"""Resampling of RingCubes onto a common radius/longitude grid.
+
+Every `RingCube.to_xarray` call creates its own radius and azimuth
+coordinates from the mapping label, so cubes taken at different resolutions
+do not line up. The `GridResampler` defined here puts many cubes onto one
+user-defined grid with sparse linear interpolation matrices. These matrices
+only depend on the mapping label extent and the image shape, so cubes that
+share a mapping label (typical for a time series of one ring region) reuse
+the already computed weights.
+"""
+import importlib.util
+import logging
+import warnings
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+from astropy import units as u
+from scipy import sparse
+
+from .io import read_cube_img, read_cube_label
+
+# dask is only imported by the functions using it, it is slow to import
+_DASK_INSTALLED = importlib.util.find_spec("dask") is not None
+
+logger = logging.getLogger(__name__)
+
+
+def interpolation_weights(src, dst):
+    """Create sparse linear interpolation weights from `src` to `dst`.
+
+    Parameters
+    ----------
+    src : array_like
+        Monotonically increasing coordinates of the original samples.
+    dst : array_like
+        Coordinates to interpolate to.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Matrix of shape (len(dst), len(src)) with at most 2 entries per row.
+        Rows of `dst` coordinates outside of `src` are empty.
+    numpy.ndarray
+        Boolean mask, True for `dst` coordinates covered by `src`.
+    """
+    src = np.asarray(src, dtype="float64")
+    dst = np.asarray(dst, dtype="float64")
+    if src.size < 2:
+        raise ValueError("Need at least 2 source samples to interpolate.")
+    inside = (dst >= src[0]) & (dst <= src[-1])
+    rows = np.flatnonzero(inside)
+    pos = np.interp(dst[inside], src, np.arange(src.size))
+    lower = np.minimum(np.floor(pos).astype("int64"), src.size - 2)
+    frac = pos - lower
+    weights = sparse.csr_matrix(
+        (
+            np.concatenate([1 - frac, frac]),
+            (np.concatenate([rows, rows]), np.concatenate([lower, lower + 1])),
+        ),
+        shape=(dst.size, src.size),
+    )
+    # targets on a source sample get a zero weight for its neighbour, which
+    # would turn a NaN neighbour into NaN
+    weights.eliminate_zeros()
+    return weights, inside
+
+
+def cube_grid_key(cube, shape):
+    """Hashable description of a cube's sampling grid.
+
+    Parameters
+    ----------
+    cube : pyciss.ringcube.RingCube
+        Map-projected ring cube.
+    shape : tuple
+        Shape of the cube's image data (radius, azimuth).
+
+    Returns
+    -------
+    tuple
+        (minrad, maxrad, n_radius, minlon, maxlon, n_azimuth), radii in Mm,
+        longitudes in degrees.
+    """
+    return (
+        cube.minrad.to(u.Mm).value,
+        cube.maxrad.to(u.Mm).value,
+        shape[0],
+        cube.minlon.to(u.degree).value,
+        cube.maxlon.to(u.degree).value,
+        shape[1],
+    )
+
+
+def label_grid_key(label):
+    """Hashable description of the sampling grid of a cube label.
+
+    Same as `cube_grid_key`, but only requires the label of a cube, as
+    returned by `pyciss.io.read_cube_label`.
+    """
+    cube = label["IsisCube"]
+    dims = cube["Core"]["Dimensions"]
+    mapping = cube["Mapping"]
+
+    def value(key):
+        # strip units if the label value has some
+        return float(getattr(mapping[key], "value", mapping[key]))
+
+    return (
+        value("MinimumRingRadius") / 1e6,
+        value("MaximumRingRadius") / 1e6,
+        dims["Lines"],
+        value("MinimumRingLongitude"),
+        value("MaximumRingLongitude"),
+        dims["Samples"],
+    )
+
+
+class GridResampler(object):
+    """Resample RingCubes onto one shared radius (and longitude) grid.
+
+    Parameters
+    ----------
+    radius : array_like or astropy.units.Quantity
+        Target radius grid. Plain numbers are taken to be in Mm, like the
+        `radius` coordinate of `RingCube.xarray`.
+    azimuth : array_like or astropy.units.Quantity, optional
+        Target longitude grid. Plain numbers are taken to be in degrees.
+        If not given, the longitude sampling of each cube is kept.
+
+    Attributes
+    ----------
+    weights_cache : dict
+        Computed interpolation matrices, keyed by `cube_grid_key`.
+    """
+
+    def __init__(self, radius, azimuth=None):
+        self.radius = u.Quantity(radius, u.Mm).value
+        if azimuth is not None:
+            azimuth = u.Quantity(azimuth, u.degree).value
+        self.azimuth = azimuth
+        self.weights_cache = {}
+
+    def weights(self, key):
+        """Get the interpolation matrices for a cube grid.
+
+        Parameters
+        ----------
+        key : tuple
+            Grid description as returned by `cube_grid_key`.
+
+        Returns
+        -------
+        tuple
+            (radius_weights, radius_mask, azimuth_weights, azimuth_mask), the
+            azimuth items being None if no azimuth grid was given.
+        """
+        try:
+            return self.weights_cache[key]
+        except KeyError:
+            pass
+        minrad, maxrad, n_rad, minlon, maxlon, n_az = key
+        logger.debug("Computing interpolation weights for grid %s", key)
+        rad_w, rad_mask = interpolation_weights(
+            np.linspace(minrad, maxrad, n_rad), self.radius
+        )
+        az_w = az_mask = None
+        if self.azimuth is not None:
+            az_w, az_mask = interpolation_weights(
+                np.linspace(minlon, maxlon, n_az), self.azimuth
+            )
+        self.weights_cache[key] = (rad_w, rad_mask, az_w, az_mask)
+        return self.weights_cache[key]
+
+    def resample_array(self, data, key):
+        """Resample image data of a cube with the grid `key`.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            2D image data, radius along axis 0, as `RingCube.img`.
+        key : tuple
+            Grid description as returned by `cube_grid_key`.
+
+        Returns
+        -------
+        numpy.ndarray
+            Resampled data of shape (n_radius, n_azimuth), NaN where the
+            target grid is not covered by the cube.
+        """
+        rad_w, rad_mask, az_w, az_mask = self.weights(key)
+        out = np.asarray(rad_w @ data)
+        if az_w is not None:
+            out = np.asarray(az_w @ out.T).T
+            out[:, ~az_mask] = np.nan
+        out[~rad_mask] = np.nan
+        return out
+
+    def resample(self, cube, subtracted=False):
+        """Resample one RingCube onto the grid.
+
+        Parameters
+        ----------
+        cube : pyciss.ringcube.RingCube
+            Map-projected ring cube.
+        subtracted : bool
+            Resample the median-subtracted image instead of the image.
+
+        Returns
+        -------
+        numpy.ndarray
+            Resampled image data, radius along axis 0.
+        """
+        data = cube.density_wave_median_subtracted if subtracted else cube.img
+        return self.resample_array(data, cube_grid_key(cube, data.shape))
+
+    def stack(self, cubes, subtracted=False):
+        """Stack many RingCubes on the common grid.
+
+        Parameters
+        ----------
+        cubes : iterable of pyciss.ringcube.RingCube
+            Map-projected ring cubes.
+        subtracted : bool
+            Stack the median-subtracted images instead of the images.
+
+        Returns
+        -------
+        xarray.DataArray
+            Array with dims ('image', 'azimuth', 'radius'), same orientation as
+            `RingCube.xarray`. Use `.values` to get the plain NumPy array.
+        """
+        cubes = list(cubes)
+        arrays = [self.resample(cube, subtracted=subtracted).T for cube in cubes]
+        shapes = {arr.shape for arr in arrays}
+        if len(shapes) > 1:
+            raise ValueError(
+                "Cubes have different longitude sampling, provide an `azimuth` grid."
+            )
+        coords = {
+            "image": [cube.image_id for cube in cubes],
+            "time": ("image", [cube.imagetime for cube in cubes]),
+            "radius": self.radius,
+        }
+        if self.azimuth is not None:
+            coords["azimuth"] = self.azimuth
+        return xr.DataArray(
+            np.stack(arrays), coords=coords, dims=("image", "azimuth", "radius")
+        )
+
+    def _resample_file(self, fname, key):
+        return self.resample_array(read_cube_img(fname), key)
+
+    def lazy_stack(self, fnames):
+        """Stack many cube files on the common grid, evaluated lazily.
+
+        Only the labels are read here. Each file is read and resampled on its
+        own when the result is computed, so a whole sequence can be mosaicked
+        without holding all cubes in memory.
+
+        Parameters
+        ----------
+        fnames : iterable of str or pathlib.Path
+            Paths to map-projected ring cubes.
+
+        Returns
+        -------
+        xarray.DataArray
+            Dask-backed array with dims ('image', 'azimuth', 'radius'), e.g.
+            use `.median('image')` for a median mosaic.
+        """
+        if not _DASK_INSTALLED:
+            raise ImportError("`lazy_stack` requires dask.")
+        import dask
+        import dask.array as da
+
+        if self.azimuth is None:
+            raise ValueError("`lazy_stack` requires an `azimuth` grid.")
+        fnames = list(fnames)
+        shape = (self.radius.size, self.azimuth.size)
+        arrays = []
+        for fname in fnames:
+            key = label_grid_key(read_cube_label(fname))
+            # compute weights here, so workers share them instead of each
+            # computing their own
+            self.weights(key)
+            delayed = dask.delayed(self._resample_file)(fname, key)
+            arrays.append(da.from_delayed(delayed, shape, dtype="float64").T)
+        return xr.DataArray(
+            da.stack(arrays),
+            coords={
+                "image": [Path(fname).stem.split(".")[0] for fname in fnames],
+                "azimuth": self.azimuth,
+                "radius": self.radius,
+            },
+            dims=("image", "azimuth", "radius"),
+        )
+
+    def profile_stack(self, cubes):
+        """Stack azimuthal median profiles of many RingCubes on the radius grid.
+
+        Only the radius axis is resampled, so this works without an
+        `azimuth` grid and for cubes of any longitude coverage.
+
+        Parameters
+        ----------
+        cubes : iterable of pyciss.ringcube.RingCube
+            Map-projected ring cubes.
+
+        Returns
+        -------
+        xarray.DataArray
+            Array with dims ('image', 'radius').
+        """
+        cubes = list(cubes)
+        profiles = []
+        for cube in cubes:
+            data = cube.img
+            rad_w, rad_mask, _, _ = self.weights(cube_grid_key(cube, data.shape))
+            resampled = np.asarray(rad_w @ data)
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", r"All-NaN slice encountered")
+                profile = np.nanmedian(resampled, axis=1)
+            profile[~rad_mask] = np.nan
+            profiles.append(profile)
+        return xr.DataArray(
+            np.stack(profiles),
+            coords={
+                "image": [cube.image_id for cube in cubes],
+                "time": ("image", [cube.imagetime for cube in cubes]),
+                "radius": self.radius,
+            },
+            dims=("image", "radius"),
+        )
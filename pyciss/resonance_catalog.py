@@ -0,0 +1,225 @@
+"""Compiled catalog of the ring resonances.
+
+`meta.get_all_resonances` parses the resonance CSV and the fixed-width
+Janus/Epimetheus table with pandas on every call. `ResonanceCatalog` holds
+the same resonances as typed numpy arrays sorted by radius, with the moons
+and resonance ratios stored as integer codes. It is built once and cached
+as a .npz file in the user's cache folder, which is rebuilt when the data
+files of the package change.
+
+Lookups are O(log n) for radius ranges, by binary search in the sorted
+radii, and O(1) for (moon, resonance) pairs, e.g. ('janus1', '2:1'), by a
+dictionary built when loading.
+"""
+import logging
+import os
+from importlib.resources import files
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DATA_FILES = ["data/ring_resonances.csv", "data/ring_janus_epimetheus_resonances.txt"]
+# increase when the layout of the cache file changes
+CACHE_VERSION = 1
+FLOAT_COLUMNS = ["radius", "a_moon", "n", "kappa"]
+
+
+def get_cache_path():
+    "Path of the cached catalog, in $XDG_CACHE_HOME/pyciss or ~/.cache/pyciss."
+    root = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    return root / "pyciss" / "resonances.npz"
+
+
+def source_stamp():
+    "Sizes and modification times of the data files the catalog is built from."
+    stamp = [CACHE_VERSION]
+    for fname in DATA_FILES:
+        st = (files("pyciss") / fname).stat()
+        stamp.extend([st.st_size, st.st_mtime_ns])
+    return np.array(stamp, dtype="int64")
+
+
+def radius_range(radius, rmin, rmax):
+    """Slice of the resonances with rmin < radius < rmax.
+
+    Parameters
+    ----------
+    radius : numpy.ndarray
+        Radii sorted ascending.
+    rmin, rmax : float
+        Radius range in km, both exclusive.
+
+    Returns
+    -------
+    slice
+    """
+    start = np.searchsorted(radius, rmin, side="right")
+    stop = np.searchsorted(radius, rmax, side="left")
+    return slice(start, max(start, stop))
+
+
+class ResonanceCatalog(object):
+    """Array-backed catalog of the ring resonances, sorted by radius.
+
+    Use `ResonanceCatalog.load` to get the cached catalog.
+
+    Parameters
+    ----------
+    arrays : dict
+        radius, a_moon, n, kappa (float64), moon_code, reson_code (int16),
+        order (int8), name, moons and resons (str), as made by `compile`.
+
+    Attributes
+    ----------
+    radius : numpy.ndarray
+        Resonance radii in km, sorted ascending.
+    moons, resons : numpy.ndarray
+        Moon names, lower case with '1'/'2' for the Janus/Epimetheus swap
+        scenarios, and resonance ratios like '2:1'; indexed by the codes.
+    """
+
+    def __init__(self, arrays):
+        for key, value in arrays.items():
+            setattr(self, key, value)
+        moons = self.moons[self.moon_code]
+        resons = self.resons[self.reson_code]
+        self._by_key = {key: i for i, key in enumerate(zip(moons, resons))}
+
+    def __len__(self):
+        return len(self.radius)
+
+    @classmethod
+    def compile(cls, df):
+        """Compile a resonance table like the one of `meta.get_all_resonances`.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            With the columns name, radius and moon, optionally a_moon, n and kappa.
+
+        Returns
+        -------
+        ResonanceCatalog
+        """
+        df = df.sort_values("radius", kind="stable")
+        name = df.name.to_numpy().astype(str)
+        moon = df.moon.to_numpy().astype(str)
+        reson = np.array([s.split()[1] for s in name])
+        moons, moon_code = np.unique(moon, return_inverse=True)
+        resons, reson_code = np.unique(reson, return_inverse=True)
+        a, b = np.array([r.split(":") for r in resons], dtype="int64").T
+        arrays = dict(
+            name=name,
+            moons=moons,
+            resons=resons,
+            moon_code=moon_code.astype("int16"),
+            reson_code=reson_code.astype("int16"),
+            order=(a - b)[reson_code].astype("int8"),
+        )
+        for col in FLOAT_COLUMNS:
+            values = df[col] if col in df else np.nan
+            arrays[col] = np.ascontiguousarray(
+                np.broadcast_to(values, len(df)), dtype="float64"
+            )
+        return cls(arrays)
+
+    @classmethod
+    def build(cls):
+        "Compile the catalog from the data files of the package."
+        from .meta import get_all_resonances
+
+        return cls.compile(get_all_resonances())
+
+    @classmethod
+    def load(cls, path=None):
+        """Load the cached catalog, building and caching it if necessary.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path, optional
+            Cache file, default `get_cache_path()`.
+
+        Returns
+        -------
+        ResonanceCatalog
+        """
+        path = get_cache_path() if path is None else Path(path)
+        stamp = source_stamp()
+        try:
+            with np.load(str(path), allow_pickle=False) as f:
+                if np.array_equal(f["stamp"], stamp):
+                    return cls({key: f[key] for key in f.files if key != "stamp"})
+        except (OSError, KeyError, ValueError):
+            pass
+        catalog = cls.build()
+        try:
+            catalog.save(path, stamp)
+        except OSError as e:
+            logger.debug("Could not cache the resonance catalog: %s", e)
+        return catalog
+
+    def save(self, path, stamp=None):
+        "Write the catalog to the .npz file `path`."
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = dict(
+            stamp=source_stamp() if stamp is None else stamp,
+            name=self.name,
+            moons=self.moons,
+            resons=self.resons,
+            moon_code=self.moon_code,
+            reson_code=self.reson_code,
+            order=self.order,
+        )
+        arrays.update({col: getattr(self, col) for col in FLOAT_COLUMNS})
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(str(tmp), **arrays)
+        os.replace(str(tmp), str(path))
+
+    def find(self, moon, reson):
+        """Position of a resonance.
+
+        Parameters
+        ----------
+        moon : str
+            Moon name, case-insensitive, e.g. 'prometheus' or 'janus1'.
+        reson : str
+            Resonance ratio, e.g. '2:1'.
+
+        Returns
+        -------
+        int
+
+        Raises
+        ------
+        KeyError
+            If the catalog does not have this resonance.
+        """
+        return self._by_key[(moon.lower(), reson)]
+
+    def get_radius(self, moon, reson):
+        "Radius in km of a resonance, see `find`."
+        return float(self.radius[self.find(moon, reson)])
+
+    def between(self, rmin, rmax):
+        "Slice of the resonances with rmin < radius < rmax, see `radius_range`."
+        return radius_range(self.radius, rmin, rmax)
+
+    def to_dataframe(self):
+        """The catalog as table, sorted by radius.
+
+        Returns
+        -------
+        pd.DataFrame
+            With the columns of `meta.get_all_resonances` and `order`.
+        """
+        df = pd.DataFrame({"name": self.name.astype(object)})
+        for col in FLOAT_COLUMNS:
+            df[col] = getattr(self, col)
+        df["reson"] = self.resons[self.reson_code].astype(object)
+        df["moon"] = self.moons[self.moon_code].astype(object)
+        df["order"] = self.order
+        return df
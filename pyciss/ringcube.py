@@ -1,46 +1,80 @@
-"""RingCube class definition"""
+"""RingCube class definition
+
+The plotting libraries (matplotlib.pyplot, seaborn, holoviews, hvplot,
+scikit-image) take seconds to import, so they are only imported when a
+plotting method is used, and headless workers never pay for them.
+"""
+import importlib.util
 import logging
 import warnings
+from functools import lru_cache
 from pathlib import Path
 
-import holoviews as hv
-import hvplot.pandas
-import hvplot.xarray
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import xarray as xr
 from astropy import units as u
-from astropy.visualization import quantity_support
-from matplotlib.ticker import FormatStrFormatter
-from skimage import exposure
 
 from pysis import CubeFile
 
+from . import catalogs
 from ._utils import which_epi_janus_resonance
-from .index import ring_summary_index
-from .io import PathManager
-from .meta import get_all_resonances
+from .interactive import rasterized_image
+from .io import (
+    PathManager,
+    cube_pixels,
+    mask_special_pixels,
+    read_cube_img,
+    read_cube_label,
+    untile,
+)
 from .opusapi import MetaData
+from .profiling import profiled
+from .pyramid import Pyramid, build_pyramid, crop_radius, pyramid_path
+from .resample import label_grid_key
+from .resonance_catalog import radius_range
 
-try:
-    # prettier plots with seaborn
-    import seaborn as sns
+# prettier plots with seaborn, its style is applied by `_pyplot`
+_SEABORN_INSTALLED = importlib.util.find_spec("seaborn") is not None
 
-    _SEABORN_INSTALLED = True
-except ImportError:
-    _SEABORN_INSTALLED = False
-else:
-    sns.set_style("white", {"xtick.bottom": True, "ytick.left": True})
+# dask is only imported by the functions using it, it is slow to import
+_DASK_INSTALLED = importlib.util.find_spec("dask") is not None
 
 logger = logging.getLogger(__name__)
 
-resonances = get_all_resonances()
-meta_df = ring_summary_index()
-# add file_id column
-meta_df["file_id"] = meta_df.FILE_SPECIFICATION_NAME.map(
-    lambda x: Path(x).stem.split("_")[0]
-)
+# images with more pixels are rasterized in the interactive plots by default
+RASTERIZE_PIXELS = 1_000_000
+
+
+def __getattr__(name):
+    # the tables used to be read at import, see `catalogs` for the loading now
+    if name == "meta_df":
+        return catalogs.get("ring_summary")
+    if name == "resonances":
+        return catalogs.get("resonances")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@lru_cache(maxsize=None)
+def _pyplot():
+    "Import matplotlib.pyplot on first use, setting the seaborn style."
+    import matplotlib.pyplot as plt
+
+    if _SEABORN_INSTALLED:
+        import seaborn as sns
+
+        sns.set_style("white", {"xtick.bottom": True, "ytick.left": True})
+    return plt
+
+
+@lru_cache(maxsize=None)
+def _holoviews():
+    "Import holoviews and register the hvplot accessors on first use."
+    import holoviews as hv
+    import hvplot.pandas  # noqa: F401
+    import hvplot.xarray  # noqa: F401
+
+    return hv
 
 
 def calc_4_3(width):
@@ -56,6 +90,7 @@ def calc_4_3(width):
     return (width, 3 * width / 4)
 
 
+@profiled
 def mad(arr, relative=True):
     """ Median Absolute Deviation: a "Robust" version of standard deviation.
         Indices variabililty of the sample.
@@ -71,6 +106,20 @@ def mad(arr, relative=True):
             return mad
 
 
+@profiled
+def xr_mad(xarr, relative=True, dim="azimuth"):
+    """Median Absolute Deviation of an xarray.DataArray along `dim`.
+
+    Same as `mad`, but stays lazy for dask-backed arrays.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        med = xarr.median(dim)
+        mad = abs(xarr - med).median(dim)
+    return mad / med if relative else mad
+
+
+@profiled
 def calc_offset(cube):
     """Calculate an offset.
 
@@ -88,6 +137,7 @@ def calc_offset(cube):
 
 
 class RingCube(CubeFile):
+    @profiled
     def __init__(
         self,
         fname,
@@ -95,6 +145,8 @@ class RingCube(CubeFile):
         destriped=True,
         pixres=None,
         litstatus=None,
+        chunks=None,
+        rasterize=None,
         **kwargs,
     ):
         p = Path(fname)
@@ -107,20 +159,48 @@ class RingCube(CubeFile):
                 fname = str(self.pm.undestriped)
         # if fname is absolute path, open exactly that one:
         super().__init__(str(fname), **kwargs)
+        meta_df = catalogs.get("ring_summary")
         try:
             q = f"file_id == '{self.pm.img_id}'"
             self.meta = meta_df.query(q)
             if self.meta.size == 0:
                 logging.warn("Image ID not found in meta-data index.")
-        except KeyError:
+        except (KeyError, AttributeError):
+            # AttributeError: no ring summary index
             self.meta = None
         self._meta_pixres = pixres
         self._meta_litstatus = litstatus
         self.resonance_axis = None
         self.pmin, self.pmax = plot_limits
         self._plotted_data = None
+        self.chunks = chunks
+        self.rasterize = rasterize
         self._xarray = self.to_xarray()
 
+    def _parse_label(self, stream):
+        # only the label, pvl.load would read the whole file
+        return read_cube_label(self.filename)
+
+    def _parse_data(self, stream):
+        # the pixels are read on first use of `data`
+        return None
+
+    @property
+    def data(self):
+        "numpy.ndarray: Raw pixels (bands, lines, samples), as of `CubeFile`."
+        if self._data is None:
+            pixels = cube_pixels(self.filename)
+            if self.format == "Tile":
+                pixels = np.stack(
+                    [untile(band, self.lines, self.samples) for band in pixels]
+                )
+            self._data = pixels
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
     @property
     def xarray(self):
         return self._xarray
@@ -140,6 +220,7 @@ class RingCube(CubeFile):
         self._plotted_data = value
 
     @property
+    @profiled
     def meta_pixres(self):
         if self._meta_pixres is None:
             meta = self.meta
@@ -156,9 +237,10 @@ class RingCube(CubeFile):
         self._meta_pixres = value
 
     @property
+    @profiled
     def meta_litstatus(self):
         if self._meta_litstatus is None:
-            if self.meta is not None:
+            if self.meta is not None and self.meta.size != 0:
                 emang = self.meta.filter(regex="RING_EMISSION_ANGLE").mean(axis=1)
                 self._meta_litstatus = "LIT" if emang.iat[0] < 90.0 else "UNLIT"
             else:
@@ -204,9 +286,13 @@ class RingCube(CubeFile):
         return self.mapping_label["MaximumRingLongitude"] * u.degree
 
     @property
+    @profiled
     def img(self):
-        "apply_numpy_special is inherited from CubeFile."
-        return self.apply_numpy_specials()[0]
+        "numpy.ndarray: First band, with the ISIS special pixels set to NaN."
+        pixels = self.label["IsisCube"]["Core"]["Pixels"]
+        return mask_special_pixels(
+            self.data[0], pixels["Type"], self.base, self.multiplier
+        )
 
     @property
     def extent(self):
@@ -224,6 +310,7 @@ class RingCube(CubeFile):
     def plotfname(self):
         return self.filename.split(".")[0] + ".png"
 
+    @profiled
     def calc_clim(self, data):
         from numpy import inf
 
@@ -233,14 +320,51 @@ class RingCube(CubeFile):
         return np.percentile(data[~np.isnan(data)], (self.pmin, self.pmax))
 
     @property
+    def pyramid(self):
+        "pyramid.Pyramid: Pyramid of this cube, None if missing or outdated."
+        if not pyramid_path(self.filename).exists():
+            return None
+        pyramid = Pyramid(self.filename)
+        return None if pyramid.is_stale else pyramid
+
+    def build_pyramid(self, **kwargs):
+        "Create the pyramid sidecar file, see `pyramid.build_pyramid`."
+        return build_pyramid(self.filename, **kwargs)
+
+    @profiled
+    def overview(self, rmin=None, rmax=None, npix=1000):
+        """Image data of a radius range at reduced resolution.
+
+        Uses the coarsest pyramid level with at least `npix` pixels along
+        radius between `rmin` and `rmax`, or the full resolution image if
+        there is no pyramid yet.
+
+        Returns
+        -------
+        numpy.ndarray
+            Image data, radius along axis 0.
+        list
+            Extent of the data, as `extent`.
+        """
+        pyramid = self.pyramid
+        if pyramid is not None:
+            return pyramid.read(rmin, rmax, npix)
+        return crop_radius(self.img, self.extent, rmin, rmax)
+
+    @property
+    @profiled
     def plot_limits(self):
         return self.calc_clim(self.plotted_data)
 
+    @profiled
     def to_xarray(self, subtracted=False):
-        radii = np.linspace(self.minrad, self.maxrad, self.img.shape[0])
-        azimuths = np.linspace(self.minlon, self.maxlon, self.img.shape[1])
+        radii = np.linspace(self.minrad, self.maxrad, self.lines)
+        azimuths = np.linspace(self.minlon, self.maxlon, self.samples)
         if subtracted:
             imgdata = self.density_wave_median_subtracted.T
+        elif self.chunks is not None:
+            # read chunk by chunk when computed
+            imgdata = read_cube_img(self.filename, chunks=self.chunks).T
         else:
             imgdata = self.img.T
         data = xr.DataArray(
@@ -248,6 +372,8 @@ class RingCube(CubeFile):
             coords={"azimuth": azimuths, "radius": radii},
             dims=("azimuth", "radius"),
         )
+        if self.chunks is not None:
+            data = data.chunk({"azimuth": -1, "radius": self.chunks})
         if not subtracted:
             return data
             vmin, vmax = self.plot_limits
@@ -256,6 +382,7 @@ class RingCube(CubeFile):
         else:
             return data
 
+    @profiled
     def imshow(
         self,
         data=None,
@@ -269,28 +396,38 @@ class RingCube(CubeFile):
         rmin=None,
         rmax=None,
         savepath=".",
+        npix=None,
         **kwargs,
     ):
         """Powerful default display.
 
         show_resonances can be True, a list, 'all', or 'some'
+        With `npix`, the data is read from the pyramid level with at least
+        `npix` pixels along radius between rmin and rmax, see `overview`.
         """
+        extent_val = self.extent
         if data is None:
-            data = self.img
+            if npix is not None:
+                data, extent_val = self.overview(rmin, rmax, npix)
+            else:
+                data = self.img
         if self.resonance_axis is not None:
             logger.debug("removing resonance_axis")
             self.resonance_axis.remove()
         if equalized:
+            from skimage import exposure
+
             data = np.nan_to_num(data)
             data[data < 0] = 0
             data = exposure.equalize_hist(data)
         self.plotted_data = data
 
-        extent_val = self.extent if set_extent else None
+        extent_val = extent_val if set_extent else None
         min_, max_ = self.plot_limits
         self.min_ = min_
         self.max_ = max_
         if ax is None:
+            plt = _pyplot()
             if not _SEABORN_INSTALLED:
                 fig, ax = plt.subplots(figsize=calc_4_3(8))
             else:
@@ -298,6 +435,8 @@ class RingCube(CubeFile):
         else:
             fig = ax.get_figure()
 
+        from astropy.visualization import quantity_support
+
         with quantity_support():
             im = ax.imshow(
                 data,
@@ -334,11 +473,12 @@ class RingCube(CubeFile):
         self.im = im
         return im
 
+    @profiled
     def imshow_swapped(
         self, ax=None, data=None, subtracted=False, rmin=None, rmax=None
     ):
         if ax is None:
-            fig, ax = plt.subplots()
+            fig, ax = _pyplot().subplots()
 
         if data is None and subtracted is True:
             self.use_original = False
@@ -371,7 +511,10 @@ class RingCube(CubeFile):
 
         self.ax = ax
 
+    @profiled
     def plot_mad(self, ax=None, relative=True):
+        from matplotlib.ticker import FormatStrFormatter
+
         data = self.plotted_data
 
         stats = mad(np.flip(data, axis=0), relative=relative)
@@ -400,16 +543,32 @@ class RingCube(CubeFile):
         return title
 
     @property
+    @profiled
     def inside_resonances(self):
-        lower_filter = resonances["radius"] > (self.minrad_km)
-        higher_filter = resonances["radius"] < (self.maxrad_km)
-        return resonances[lower_filter & higher_filter]
+        resonances = catalogs.get("resonances")
+        inside = radius_range(
+            resonances["radius"].to_numpy(), self.minrad_km, self.maxrad_km
+        )
+        return resonances.iloc[inside]
 
     @property
     def janus_swap_phase(self):
         return which_epi_janus_resonance("janus", self.imagetime)
 
-    def set_resonance_axis(self, ax, show_resonances, rmin=None, rmax=None):
+    @profiled
+    def resonance_ticks(self, show_resonances="some"):
+        """Select the resonances inside the image to be shown as ticks.
+
+        Parameters
+        ----------
+        show_resonances : {'some', 'all'} or list
+            List of moon names or 'some' for the most relevant moons.
+
+        Returns
+        -------
+        pd.DataFrame
+            Rows of the resonance table, with `radius` in km and `name`.
+        """
         if show_resonances == "some":
             show_resonances = ["janus", "prometheus", "epimetheus", "atlas"]
         elif show_resonances == "all":
@@ -431,7 +590,10 @@ class RingCube(CubeFile):
         except TypeError:
             # if show_resonances not a list, do nothing, == 'all'
             moonfilter = True
-        newticks = self.inside_resonances[moonfilter]
+        return self.inside_resonances[moonfilter]
+
+    def set_resonance_axis(self, ax, show_resonances, rmin=None, rmax=None):
+        newticks = self.resonance_ticks(show_resonances)
         ax2 = ax.twinx()
         ax2.set_ybound(self.minrad.value, self.maxrad.value)
         ax2.ticklabel_format(useOffset=False)
@@ -443,14 +605,17 @@ class RingCube(CubeFile):
         self.resonance_axis = ax2
 
     @property
+    @profiled
     def mean_profile(self):
         return np.nanmean(self.img, axis=1)
 
     @property
+    @profiled
     def median_profile(self):
         return np.nanmedian(self.img, axis=1)
 
     @property
+    @profiled
     def density_wave_subtracted(self):
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", r"All-NaN slice encountered")
@@ -458,6 +623,7 @@ class RingCube(CubeFile):
         return subtracted
 
     @property
+    @profiled
     def density_wave_median_subtracted(self):
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", r"All-NaN slice encountered")
@@ -471,10 +637,12 @@ class RingCube(CubeFile):
             self.imshow(data=self.density_wave_subtracted, **kwargs)
 
     @property
+    @profiled
     def imgmin(self):
         return np.nanmin(self.img)
 
     @property
+    @profiled
     def imgmax(self):
         return np.nanmax(self.img)
 
@@ -498,51 +666,93 @@ class RingCube(CubeFile):
         return self.label["IsisCube"]["Instrument"]["ImageTime"]
 
     @property
+    @profiled
     def statsdf(self):
-        df = pd.DataFrame(self.xarray.median(axis=0).values, index=self.xarray.radius)
-        df.columns = ["median_az"]
-        df["mad"] = mad(self.img, relative=False)
-        df["amin"] = df.median_az - df["mad"]
-        df["amax"] = df.median_az + df["mad"]
-        return df
+        median_az = self.median_az
+        absmad = xr_mad(self.xarray, relative=False)
+        ds = xr.Dataset(
+            {
+                "median_az": median_az,
+                "mad": absmad,
+                "amin": median_az - absmad,
+                "amax": median_az + absmad,
+            }
+        )
+        return ds.compute().to_dataframe()
 
     @property
+    @profiled
     def relmad(self):
         return mad(self.img, relative=True)
 
     @property
+    @profiled
     def absmad(self):
         return mad(self.img, relative=False)
 
     @property
+    @profiled
     def median_az(self):
-        return self.xarray.median(axis=0)
+        return self.xarray.median("azimuth")
 
     @property
+    @profiled
     def xdataset(self):
+        """xr.Dataset: Image, subtracted image and profiles.
+
+        Lazy if the cube was opened with `chunks`.
+        """
+        median_az = self.median_az
+        absmad = xr_mad(self.xarray, relative=False)
         ds = xr.Dataset({"img": self.xarray,
-                         "sub": self.to_xarray(subtracted=True),
-                         "absmad": ("radius", self.absmad),
-                         "relmad": ("radius", self.relmad),
-                         "median_az": ("radius", self.median_az),
-                         "amin": ("radius", self.median_az - self.absmad),
-                         "amax": ("radius", self.median_az + self.absmad)})
+                         "sub": self.xarray - median_az,
+                         "absmad": absmad,
+                         "relmad": absmad / median_az,
+                         "median_az": median_az,
+                         "amin": median_az - absmad,
+                         "amax": median_az + absmad})
         return ds
 
     @property
+    def use_rasterize(self):
+        """bool: If the interactive plots decimate the image on zoom.
+
+        Set by the `rasterize` argument, by default True for images larger
+        than `RASTERIZE_PIXELS`.
+        """
+        if self.rasterize is None:
+            return self.xarray.size > RASTERIZE_PIXELS
+        return self.rasterize
+
+    def _rasterized_plot(self, xarr):
+        hvimg = rasterized_image(
+            xarr, pmin=self.pmin, pmax=self.pmax, title=self.plot_title
+        )
+        return hvimg.redim.label(azimuth="Ring Azimuth", radius='Radius')
+
+    @property
+    @profiled
     def imgplot(self):
+        _holoviews()
         xarr = self.xarray
-        hvimg = xarr.hvplot(cmap="gray", title=self.plot_title, clim=tuple(self.plot_limits))
-        hvimg = hvimg.redim.label(azimuth="Ring Azimuth", radius='Radius')
+        if self.use_rasterize:
+            hvimg = self._rasterized_plot(xarr)
+        else:
+            hvimg = xarr.hvplot(cmap="gray", title=self.plot_title, clim=tuple(self.plot_limits))
+            hvimg = hvimg.redim.label(azimuth="Ring Azimuth", radius='Radius')
         return hvimg.redim.unit(azimuth='deg', radius='Mm')
 
     @property
     def imgplotsubbed(self):
+        _holoviews()
         xarr = self.to_xarray(subtracted=True)
+        if self.use_rasterize:
+            return self._rasterized_plot(xarr)
         return xarr.hvplot(cmap="gray", title=self.plot_title)
 
     @property
     def profile_plot(self):
+        _holoviews()
         df = self.statsdf
         profile = df.hvplot.area("radius", "amin", "amax") * df.median_az.hvplot(
             color="r", title="Median +/- MAD"
@@ -551,8 +761,63 @@ class RingCube(CubeFile):
 
     @property
     def img_and_profile_plot(self):
-        return hv.Layout(self.imgplot + self.profile_plot).cols(1)
+        return _holoviews().Layout(self.imgplot + self.profile_plot).cols(1)
 
     @property
     def imgsubbed_and_profile_plot(self):
-        return hv.Layout(self.imgplotsubbed + self.profile_plot).cols(1)
+        return _holoviews().Layout(self.imgplotsubbed + self.profile_plot).cols(1)
+
+
+@profiled
+def lazy_xarray(fname, chunks="auto"):
+    """Open a ring cube as dask-backed xarray.DataArray.
+
+    Only the label is read here, the pixel data is read chunk by chunk
+    when the array is computed, see `io.read_cube_img`.
+
+    Parameters
+    ----------
+    fname : str or pathlib.Path
+        Path to map-projected ring cube.
+    chunks : int or str
+        Chunk size along radius.
+
+    Returns
+    -------
+    xr.DataArray
+        Array with the same dims and coords as `RingCube.xarray`.
+    """
+    if not _DASK_INSTALLED:
+        raise ImportError("`lazy_xarray` requires dask.")
+    label = read_cube_label(fname)
+    minrad, maxrad, n_rad, minlon, maxlon, n_az = label_grid_key(label)
+    img = read_cube_img(fname, chunks=chunks)
+    return xr.DataArray(
+        img.T,
+        coords={
+            "azimuth": np.linspace(minlon, maxlon, n_az),
+            "radius": np.linspace(minrad, maxrad, n_rad),
+        },
+        dims=("azimuth", "radius"),
+        name=Path(fname).stem.split(".")[0],
+    )
+
+
+@profiled
+def lazy_median_profiles(fnames, chunks="auto"):
+    """Azimuthal median profiles of many cubes, evaluated lazily.
+
+    Parameters
+    ----------
+    fnames : iterable of str or pathlib.Path
+        Paths to map-projected ring cubes.
+    chunks : int or str
+        Chunk size along radius.
+
+    Returns
+    -------
+    list of xr.DataArray
+        One lazy median profile per cube. Compute them together with
+        `dask.compute(*profiles)` to read and reduce the files in parallel.
+    """
+    return [lazy_xarray(fname, chunks=chunks).median("azimuth") for fname in fnames]
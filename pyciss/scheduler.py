@@ -0,0 +1,359 @@
+"""Run jobs in parallel within a memory budget.
+
+Cube sizes vary by orders of magnitude with the map resolution and the
+footprint of an image, so a fixed number of workers either wastes the
+machine on small cubes or runs out of memory on large ones.
+`MemoryScheduler` starts a job only when its estimated memory fits into
+what the running jobs leave of the budget, largest jobs first, and never
+runs more jobs than worker processes. A job larger than the whole budget
+runs alone. A worker process that dies, e.g. killed by the OOM killer,
+makes `map` raise instead of waiting for its job forever.
+
+The estimates come from the labels, without reading any pixel data:
+
+* `estimate_memory` for jobs reading a cube, like `RingCube` analyses,
+  from lines x samples x bands x pixel size of the ISIS or PDS label,
+* `map_projection_memory` for `ringscam2map`, from the size of the map
+  cube expected for the ring footprint of the image in the
+  `coverage.CoverageIndex` and the map resolution.
+
+The budget is `[pyciss_scheduler] memory_budget` of the config file, e.g.
+`48G`, by default 80 % of the memory available when the scheduler starts.
+"""
+import bisect
+import logging
+import multiprocessing
+import os
+import queue
+import re
+
+import numpy as np
+
+from .io import PathManager, get_config
+from .labels import PIXEL_BYTES, cube_layout, read_label
+
+logger = logging.getLogger(__name__)
+
+# memory of a worker process with numpy, pandas and matplotlib loaded
+PROCESS_OVERHEAD = 300 * 2**20
+# working set of an analysis as multiple of the pixel data, for the float64
+# copy of the data, the masked copies and the intermediate arrays
+CUBE_FACTOR = 4.0
+# memory of ringscam2map as multiple of the output cube
+MAP_FACTOR = 2.0
+# pixel data of a full 1024x1024 ISS image as 32-bit float
+DEFAULT_CUBE_BYTES = 1024 * 1024 * 4
+BUDGET_FRACTION = 0.8
+# seconds between the checks for dead workers while waiting for jobs
+POLL_INTERVAL = 1.0
+UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_bytes(value):
+    """Number of bytes of a size like 512M, 8G or 1.5T.
+
+    Parameters
+    ----------
+    value : int, float or str
+        Numbers are bytes.
+
+    Returns
+    -------
+    int
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)i?B?\s*", str(value), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Cannot read the size {value!r}.")
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+def available_memory():
+    "Bytes of memory available for new processes, from /proc/meminfo if possible."
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def default_budget():
+    """Memory budget of the config, else `BUDGET_FRACTION` of the available memory.
+
+    Returns
+    -------
+    int
+        Bytes.
+    """
+    try:
+        return parse_bytes(get_config()["pyciss_scheduler"]["memory_budget"])
+    except (KeyError, IOError):
+        return int(BUDGET_FRACTION * available_memory())
+
+
+def cube_bytes(path):
+    """Size of the pixel data of an ISIS cube or PDS image from its label.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        ISIS cube, PDS image with attached label or detached PDS label.
+
+    Returns
+    -------
+    int
+    """
+    label = read_label(path)
+    layout = cube_layout(label)
+    if "Samples" in layout:
+        samples, lines, bands = (int(layout[k]) for k in ("Samples", "Lines", "Bands"))
+        return samples * lines * bands * PIXEL_BYTES[layout["Type"]]
+    lines = label.get("LINES", group="IMAGE")
+    samples = label.get("LINE_SAMPLES", group="IMAGE")
+    if lines is None or samples is None:
+        raise KeyError(f"No image dimensions in the label of {path}.")
+    bands = label.get("BANDS", group="IMAGE", default=1)
+    bits = label.get("SAMPLE_BITS", group="IMAGE", default=8)
+    return lines * samples * bands * bits // 8
+
+
+def estimate_memory(path, factor=CUBE_FACTOR, overhead=PROCESS_OVERHEAD):
+    """Memory of a job working on a cube.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Cube or image the job reads, see `cube_bytes`.
+    factor : float
+        Working set as multiple of the pixel data.
+    overhead : int
+        Memory of the worker process itself.
+
+    Returns
+    -------
+    int
+        Bytes. Unreadable labels count as a full ISS image.
+    """
+    try:
+        nbytes = cube_bytes(path)
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning("Cannot size %s, assuming a full image: %s", path, e)
+        nbytes = DEFAULT_CUBE_BYTES
+    return int(overhead + factor * nbytes)
+
+
+def projected_cube_bytes(rmin, rmax, lonmin, lonmax, resolution, pixel_bytes=4):
+    """Size of a RingCylindrical map cube.
+
+    Parameters
+    ----------
+    rmin, rmax : float or numpy.ndarray
+        Ring radius range in km.
+    lonmin, lonmax : float or numpy.ndarray
+        Ring longitude range in degrees, wrapping at 360.
+    resolution : float
+        Map resolution in meters/pixel.
+
+    Returns
+    -------
+    numpy.ndarray or float
+        Bytes.
+    """
+    width = np.mod(np.asarray(lonmax) - np.asarray(lonmin), 360.0)
+    width = np.where(width == 0, 360.0, width)
+    lines = (np.asarray(rmax) - np.asarray(rmin)) * 1000 / resolution
+    samples = np.deg2rad(width) * np.asarray(rmax) * 1000 / resolution
+    return np.ceil(lines) * np.ceil(samples) * pixel_bytes
+
+
+def map_projection_memory(
+    img_ids, resolution, coverage=None, factor=MAP_FACTOR, overhead=PROCESS_OVERHEAD
+):
+    """Memory of `ringscam2map` jobs from the expected size of their map cubes.
+
+    Parameters
+    ----------
+    img_ids : list of str
+        Image ids.
+    resolution : float
+        Map resolution in meters/pixel, the `final_resolution` of the
+        `pipeline.Calibrator`.
+    coverage : coverage.CoverageIndex, optional
+        Index with the ring footprints, by default `CoverageIndex.load()`.
+    factor : float
+        Memory as multiple of the map cube.
+    overhead : int
+        Memory of the process itself.
+
+    Returns
+    -------
+    numpy.ndarray
+        Bytes per image. Images without footprint get the estimate of their
+        raw image, see `estimate_memory`.
+    """
+    img_ids = [PathManager(img_id).img_id for img_id in img_ids]
+    if coverage is None:
+        try:
+            from .coverage import CoverageIndex
+
+            coverage = CoverageIndex.load()
+        except Exception as e:
+            logger.warning("No coverage index for the memory estimates: %s", e)
+    nbytes = np.full(len(img_ids), np.nan)
+    if coverage is not None and len(coverage):
+        order = np.argsort(coverage.file_id, kind="stable")
+        ids = coverage.file_id[order]
+        pos = np.clip(np.searchsorted(ids, img_ids), 0, len(ids) - 1)
+        found = ids[pos] == np.asarray(img_ids)
+        rows = order[pos[found]]
+        nbytes[found] = projected_cube_bytes(
+            coverage.rmin[rows],
+            coverage.rmax[rows],
+            coverage.lonmin[rows],
+            coverage.lonmax[rows],
+            resolution,
+        )
+    memory = overhead + factor * nbytes
+    for i in np.flatnonzero(~np.isfinite(memory)):
+        memory[i] = estimate_memory(PathManager(img_ids[i]).raw_label, factor, overhead)
+    return memory.astype("int64")
+
+
+def _dead_workers(pool, workers):
+    """Number of worker processes of a pool that died.
+
+    A pool replaces dead workers, but the job a worker ran is lost and never
+    reports back.
+
+    Parameters
+    ----------
+    pool : multiprocessing.pool.Pool
+    workers : dict
+        Worker processes by pid seen so far, updated here.
+    """
+    # Pool has no public API for its workers
+    for p in getattr(pool, "_pool", ()):
+        workers.setdefault(p.pid, p)
+    return sum(p.exitcode not in (None, 0) for p in workers.values())
+
+
+class MemoryScheduler(object):
+    """Run jobs on a process pool as long as their memory fits into a budget.
+
+    Parameters
+    ----------
+    budget : int or str, optional
+        Memory budget in bytes, or a size like '8G'. By default
+        `default_budget()`.
+    processes : int, optional
+        Maximum number of concurrent jobs, by default the number of CPUs.
+
+    Attributes
+    ----------
+    peak : int
+        Largest estimated memory of concurrent jobs of the last `map`.
+    """
+
+    def __init__(self, budget=None, processes=None):
+        self.budget = default_budget() if budget is None else parse_bytes(budget)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.peak = 0
+
+    def __repr__(self):
+        return "MemoryScheduler(budget={:.2f} GB, processes={})".format(
+            self.budget / 2**30, self.processes
+        )
+
+    def map(self, func, items, memory, pool=None):
+        """Apply a function to items, admitting jobs by their memory.
+
+        Parameters
+        ----------
+        func : callable
+            Picklable function of one item.
+        items : iterable
+            Items to process.
+        memory : iterable of int or callable
+            Estimated bytes per item, or a function of an item returning them.
+        pool : multiprocessing.pool.Pool, optional
+            Pool to run on, e.g. from `workers.pool`. It needs at least
+            `processes` workers. By default a new one.
+
+        Returns
+        -------
+        list
+            Results in the order of `items`. The first exception of a job is
+            raised after the running jobs finished.
+
+        Raises
+        ------
+        RuntimeError
+            If a worker process died while running a job.
+        """
+        items = list(items)
+        memory = [memory(item) for item in items] if callable(memory) else list(memory)
+        if len(memory) != len(items):
+            raise ValueError("Need one memory estimate per item.")
+        if pool is None:
+            with multiprocessing.Pool(min(self.processes, len(items)) or 1) as p:
+                return self.map(func, items, memory, p)
+        # jobs larger than the budget run alone
+        need = [min(int(m), self.budget) for m in memory]
+        # sorted by need, the largest job that fits is found by bisection,
+        # of equal needs the first item
+        pending = sorted((need[i], -i) for i in range(len(items)))
+        running = {}
+        results = [None] * len(items)
+        error = None
+        used = 0
+        self.peak = 0
+        # indices of the finished jobs, put by the pool's result thread
+        finished = queue.Queue()
+        workers = {p.pid: p for p in getattr(pool, "_pool", ()) if p.exitcode is None}
+        dead = 0
+        while pending or running:
+            while error is None and pending and len(running) < self.processes:
+                # without running jobs, any job fits as need <= budget
+                pos = bisect.bisect_right(pending, (self.budget - used, 0))
+                if pos == 0:
+                    break
+                i = -pending.pop(pos - 1)[1]
+                running[i] = pool.apply_async(
+                    func,
+                    (items[i],),
+                    callback=lambda _, i=i: finished.put(i),
+                    error_callback=lambda _, i=i: finished.put(i),
+                )
+                used += need[i]
+                self.peak = max(self.peak, used)
+            # the jobs of dead workers never finish
+            if len(running) <= dead:
+                break
+            try:
+                i = finished.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                dead = _dead_workers(pool, workers)
+                if dead and error is None:
+                    error = RuntimeError(
+                        f"{dead} worker process(es) died, e.g. killed by the "
+                        "OOM killer, and their jobs were lost."
+                    )
+                continue
+            used -= need[i]
+            try:
+                results[i] = running.pop(i).get()
+            except Exception as e:
+                error = e if error is None else error
+        if error is not None:
+            raise error
+        logger.debug("Peak estimated memory %.2f GB.", self.peak / 2**30)
+        return results
+
+
+def map_within_budget(func, items, memory, budget=None, processes=None, pool=None):
+    "Shortcut for `MemoryScheduler(budget, processes).map(func, items, memory, pool)`."
+    return MemoryScheduler(budget, processes).map(func, items, memory, pool)
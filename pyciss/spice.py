@@ -0,0 +1,379 @@
+"""Amortize the SPICE kernel lookup of `spiceinit` over many images.
+
+For every image, `spiceinit` searches the kernel databases of ISISDATA for
+the CK and SPK kernels covering the image time before it loads them. Images
+of an observation sequence are taken close in time and mostly resolve to
+the same kernel set, so the search can be done once per set:
+
+* `KernelCache` remembers which kernels `spiceinit` chose, as the time
+  range of the images that resolved to the same kernels. The ranges are
+  kept per camera, whose instrument kernels differ, and per set of further
+  spiceinit parameters. It is a SQLite file in the database folder, shared
+  by processes and runs.
+* `spiceinit_cached` hands the cached kernels of an image time directly to
+  `spiceinit` (ck=, spk=, ...), and only lets `spiceinit` search for
+  images outside of the known ranges, caching what it found.
+* `calibrate_grouped` groups images into time windows and calibrates each
+  group in one task of a long-lived worker process, so the images of a
+  sequence run one after the other against the same cached kernels. The
+  groups are admitted within a memory budget by the expected size of their
+  largest map cube, see `scheduler.map_projection_memory`.
+
+ISIS applications run as separate processes, so the kernels themselves are
+loaded for each image; what is saved is the kernel database search.
+"""
+import json
+import logging
+import multiprocessing
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from .coverage import parse_times
+from .io import PathManager, get_db_root
+from .labels import Label, read_label
+from .scheduler import MemoryScheduler, map_projection_memory
+
+logger = logging.getLogger(__name__)
+
+# label keyword of the Kernels group -> spiceinit parameter, file extensions
+KERNEL_PARAMETERS = {
+    "LeapSecond": ("lsk", (".tls",)),
+    "TargetAttitudeShape": ("pck", (".tpc", ".bpc")),
+    "InstrumentPointing": ("ck", (".bc",)),
+    "Frame": ("fk", (".tf",)),
+    "Instrument": ("ik", (".ti",)),
+    "InstrumentAddendum": ("iak", (".ti",)),
+    "SpacecraftClock": ("sclk", (".tsc",)),
+    "InstrumentPosition": ("spk", (".bsp",)),
+}
+# images further apart than this are not assumed to share kernels, seconds
+MAX_GAP = 6 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ranges (
+    instrument TEXT,
+    options TEXT,
+    start REAL,
+    stop REAL,
+    kernels TEXT
+);
+CREATE INDEX IF NOT EXISTS ranges_start ON ranges (instrument, options, start);
+"""
+
+
+def _seconds(time):
+    "Seconds since 1970 of a time string, datetime or Timestamp."
+    if isinstance(time, str):
+        time = pd.Timestamp(parse_times([time])[0])
+    time = pd.Timestamp(time)
+    if pd.isna(time):
+        raise ValueError("Image time is missing or not readable.")
+    return time.value / 1e9
+
+
+def options_key(options):
+    "Canonical JSON of spiceinit parameters, to compare them in the cache."
+    return json.dumps(options or {}, sort_keys=True, default=str)
+
+
+def kernels_from_label(label):
+    """spiceinit parameters for the kernels recorded by spiceinit in a cube label.
+
+    Parameters
+    ----------
+    label : labels.Label
+        Label of a cube after spiceinit.
+
+    Returns
+    -------
+    dict
+        Kernel files by spiceinit parameter, e.g. {'ck': '(a.bc,b.bc)'}.
+    """
+    kernels = {}
+    for keyword, (parameter, extensions) in KERNEL_PARAMETERS.items():
+        value = label.get(keyword, group="Kernels")
+        if value is None:
+            continue
+        files = value if isinstance(value, tuple) else (value,)
+        files = [f for f in files if str(f).lower().endswith(extensions)]
+        if files:
+            kernels[parameter] = "({})".format(",".join(files))
+    return kernels
+
+
+def cube_time(cube):
+    "Image time of an ISIS cube, or its parsed label, from the Instrument group."
+    label = cube if isinstance(cube, Label) else read_label(cube)
+    time = label.get("ImageTime", group="Instrument")
+    if time is None:
+        time = label.get("StartTime", group="Instrument")
+    return str(time)
+
+
+def image_time(img_id):
+    "Image time from the PDS label of an image in the database."
+    label = read_label(PathManager(img_id).raw_label)
+    for keyword in ("IMAGE_MID_TIME", "IMAGE_TIME", "START_TIME"):
+        time = label.get(keyword)
+        if time is not None:
+            return pd.Timestamp(parse_times([str(time)])[0])
+    raise KeyError(f"No image time in the label of {img_id}.")
+
+
+class KernelCache(object):
+    """SQLite cache of the kernels spiceinit resolved for image times.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path, optional
+        SQLite file. By default `.spice_kernels.sqlite` in the database folder.
+    max_gap : float
+        Images up to this many seconds apart that resolved to the same
+        kernels extend each other's range.
+    """
+
+    def __init__(self, path=None, max_gap=MAX_GAP):
+        if path is None:
+            path = get_db_root() / ".spice_kernels.sqlite"
+        self.path = Path(path)
+        self.max_gap = max_gap
+        self.con = sqlite3.connect(str(self.path), timeout=60)
+        columns = [row[1] for row in self.con.execute("PRAGMA table_info(ranges)")]
+        if columns and "instrument" not in columns:
+            # cache of an older version without camera, start over
+            with self.con:
+                self.con.execute("DROP TABLE ranges")
+        self.con.executescript(SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # processes open their own connection
+        return dict(path=self.path, max_gap=self.max_gap)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def lookup(self, time, instrument="", options=None):
+        """Kernels of an image time, None if not in a cached range.
+
+        Parameters
+        ----------
+        time : str, datetime or pd.Timestamp
+        instrument : str
+            InstrumentId of the cube, e.g. 'ISSNA'.
+        options : dict, optional
+            Further spiceinit parameters the kernels were resolved with.
+
+        Returns
+        -------
+        dict or None
+            spiceinit parameters, see `kernels_from_label`.
+        """
+        t = _seconds(time)
+        row = self.con.execute(
+            "SELECT kernels FROM ranges WHERE instrument = ? AND options = ? "
+            "AND start <= ? AND stop >= ? ORDER BY stop - start DESC LIMIT 1",
+            (instrument, options_key(options), t, t),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def add(self, time, kernels, instrument="", options=None):
+        """Remember the kernels spiceinit resolved for an image time.
+
+        The range of the same kernels, instrument and options within
+        `max_gap` is extended to `time`. See `lookup` for the parameters.
+        """
+        if not kernels:
+            return
+        t = _seconds(time)
+        text = json.dumps(kernels, sort_keys=True)
+        key = (instrument, options_key(options))
+        with self.con:
+            row = self.con.execute(
+                "SELECT rowid, start, stop FROM ranges WHERE instrument = ? "
+                "AND options = ? AND kernels = ? "
+                "AND start - ? <= ? AND ? - stop <= ? ORDER BY start LIMIT 1",
+                key + (text, self.max_gap, t, t, self.max_gap),
+            ).fetchone()
+            if row is None:
+                self.con.execute(
+                    "INSERT INTO ranges VALUES (?, ?, ?, ?, ?)", key + (t, t, text)
+                )
+            else:
+                rowid, start, stop = row
+                self.con.execute(
+                    "UPDATE ranges SET start = ?, stop = ? WHERE rowid = ?",
+                    (min(start, t), max(stop, t), rowid),
+                )
+
+    def ranges(self):
+        """Cached time ranges.
+
+        Returns
+        -------
+        pd.DataFrame
+            instrument, options, start, stop (pd.Timestamp) and the kernels
+            of every range.
+        """
+        df = pd.read_sql_query("SELECT * FROM ranges ORDER BY start", self.con)
+        for col in ["start", "stop"]:
+            df[col] = pd.to_datetime(df[col], unit="s")
+        df["kernels"] = df.kernels.map(json.loads)
+        return df
+
+
+def spiceinit_cached(cube, cache, spiceinit, **kwargs):
+    """Run spiceinit on a cube with the cached kernels of its image time.
+
+    Kernels are only reused between cubes of the same camera and the same
+    further spiceinit parameters.
+
+    Parameters
+    ----------
+    cube : str or pathlib.Path
+        ISIS cube with Instrument group.
+    cache : KernelCache or None
+        Without cache, spiceinit just runs.
+    spiceinit : callable
+        The spiceinit of `pysis.isis`, or a stub for tests.
+    kwargs
+        Further spiceinit parameters, e.g. shape='ringplane'.
+
+    Returns
+    -------
+    bool
+        If the kernels came from the cache.
+    """
+    if cache is None:
+        spiceinit(from_=cube, **kwargs)
+        return False
+    label = read_label(cube)
+    time = cube_time(label)
+    instrument = str(label.get("InstrumentId", group="Instrument", default=""))
+    kernels = cache.lookup(time, instrument, kwargs)
+    if kernels is not None:
+        logger.debug("Using cached kernels for %s: %s", cube, kernels)
+        spiceinit(from_=cube, **dict(kwargs, **kernels))
+        return True
+    spiceinit(from_=cube, **kwargs)
+    cache.add(time, kernels_from_label(read_label(cube)), instrument, kwargs)
+    return False
+
+
+def group_by_time(img_ids, window=86400.0, times=None):
+    """Group images into time windows.
+
+    Parameters
+    ----------
+    img_ids : list of str
+        Image ids.
+    window : float
+        Maximum time span of a group in seconds.
+    times : list, optional
+        Image times, by default read from the PDS labels in the database.
+
+    Returns
+    -------
+    list of list of str
+        Groups of image ids, each sorted by time.
+    """
+    if times is None:
+        times = [image_time(img_id) for img_id in img_ids]
+    order = sorted(zip((_seconds(t) for t in times), img_ids))
+    groups = []
+    start = None
+    for t, img_id in order:
+        if start is None or t - start > window:
+            groups.append([])
+            start = t
+        groups[-1].append(img_id)
+    return groups
+
+
+def calibrate(img_id, kernel_cache=None, **kwargs):
+    "Calibrate one image with `pipeline.Calibrator` using the kernel cache."
+    from .pipeline import Calibrator
+
+    Calibrator(img_id, kernel_cache=kernel_cache, **kwargs).standard_calib()
+
+
+def _run_group(args):
+    group, cache, func, kwargs = args
+    results = []
+    for img_id in group:
+        try:
+            func(img_id, kernel_cache=cache, **kwargs)
+        except Exception as e:
+            logger.exception("Calibrating %s failed.", img_id)
+            results.append((img_id, "failed", repr(e)))
+        else:
+            results.append((img_id, "calibrated", None))
+    return results
+
+
+def calibrate_grouped(
+    img_ids,
+    window=86400.0,
+    processes=None,
+    cache=None,
+    func=calibrate,
+    times=None,
+    budget=None,
+    **kwargs,
+):
+    """Calibrate many images, grouped by time, with a shared kernel cache.
+
+    Parameters
+    ----------
+    img_ids : iterable of str
+        Image ids of raw images in the database.
+    window : float
+        Maximum time span of a group in seconds, see `group_by_time`.
+    processes : int, optional
+        Number of worker processes, by default the number of CPUs. With 1,
+        the groups are calibrated in this process.
+    cache : KernelCache, optional
+        By default the one of the database.
+    func : callable
+        Calibrates one image id, called with `kernel_cache` and `kwargs`.
+    times : list, optional
+        Image times, by default read from the PDS labels in the database.
+    budget : int or str, optional
+        Memory budget for the groups calibrated at once, see
+        `scheduler.MemoryScheduler`.
+    kwargs
+        Passed on to `pipeline.Calibrator`.
+
+    Returns
+    -------
+    pd.DataFrame
+        img_id, status ('calibrated' or 'failed') and error per image.
+    """
+    cache = KernelCache() if cache is None else cache
+    groups = group_by_time(list(img_ids), window, times)
+    logger.info("Calibrating %i groups.", len(groups))
+    # largest groups first, so that they do not end up last on one worker
+    tasks = [(g, cache, func, kwargs) for g in sorted(groups, key=len, reverse=True)]
+    if processes == 1:
+        results = [r for task in tasks for r in _run_group(task)]
+    else:
+        img_ids = [img_id for group, *_ in tasks for img_id in group]
+        sizes = map_projection_memory(img_ids, kwargs.get("final_resolution", 500))
+        sizes = dict(zip(img_ids, sizes))
+        memory = [max(sizes[img_id] for img_id in group) for group, *_ in tasks]
+        # one task per group, the workers live for the whole run
+        scheduler = MemoryScheduler(budget, processes)
+        with multiprocessing.Pool(scheduler.processes) as pool:
+            groups = scheduler.map(_run_group, tasks, memory, pool=pool)
+        results = [r for rs in groups for r in rs]
+    return pd.DataFrame(results, columns=["img_id", "status", "error"])
@@ -0,0 +1,260 @@
+"""Content-addressed store of calibrated products.
+
+A calibrated and map-projected cube is determined by the raw image, the
+ISIS version and the parameters of the `pipeline.Calibrator`. The store
+keeps the products of a calibration under a hash of exactly these inputs,
+so moving or renaming the database, or another user calibrating the same
+image with the same settings, does not run ISIS again: the stored files
+are hard-linked (or copied, across file systems) into the `io.PathManager`
+layout.
+
+The store is the folder `[pyciss_store] path` of the config file, by
+default `.store` in the database folder. Point several users to the same
+folder to share their products::
+
+    [pyciss_store]
+    path = /data/shared/pyciss_store
+
+Entries are written to a temporary folder first and renamed into place, so
+concurrent calibrations of the same image never see half-written entries.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+from functools import lru_cache
+from pathlib import Path
+
+from .io import get_config, get_db_root
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path, blocksize=1 << 20):
+    "SHA-256 hex digest of the content of a file."
+    sha = hashlib.sha256()
+    with open(str(path), "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+@lru_cache()
+def isis_version():
+    """Version of the ISIS installation in $ISISROOT.
+
+    Returns
+    -------
+    str
+        E.g. '4.1.0', 'unknown' without readable version file.
+    """
+    try:
+        path = Path(os.environ["ISISROOT"]) / "version"
+        return path.read_text().split()[0]
+    except (KeyError, OSError, IndexError):
+        logger.warning("Could not read the ISIS version, using 'unknown'.")
+        return "unknown"
+
+
+def _map_digest(map_template):
+    if map_template is None:
+        return None
+    try:
+        return file_digest(map_template)
+    except OSError:
+        return str(map_template)
+
+
+def calibration_inputs(
+    pm, is_ring_data=True, do_map_project=True, final_resolution=500, map_template=None
+):
+    """Everything the products of `Calibrator.standard_calib` depend on.
+
+    Parameters
+    ----------
+    pm : io.PathManager
+        Image with raw .IMG and .LBL in the database.
+    is_ring_data, do_map_project, final_resolution
+        Parameters of the `pipeline.Calibrator`.
+    map_template : str or pathlib.Path, optional
+        ISIS map template of the map projection.
+
+    Returns
+    -------
+    dict
+    """
+    return dict(
+        product="calibration",
+        raw_image=file_digest(pm.raw_image),
+        raw_label=file_digest(pm.raw_label),
+        isis=isis_version(),
+        is_ring_data=bool(is_ring_data),
+        do_map_project=bool(do_map_project),
+        final_resolution=final_resolution if do_map_project else None,
+        map_template=_map_digest(map_template) if do_map_project else None,
+    )
+
+
+def remapping_inputs(calibration, source, resolution, map_template=None):
+    """Everything the products of `Calibrator.remapping` depend on.
+
+    Parameters
+    ----------
+    calibration : dict
+        `calibration_inputs` of the image, whose cubes are remapped.
+    source : str
+        Name of the remapped cube, e.g. 'cal.dst.cub'.
+    resolution : float
+        Map resolution in meters/pixel.
+    map_template : str or pathlib.Path, optional
+        ISIS map template.
+    """
+    # the remapped cubes do not depend on the map projection of the calibration
+    calibration = dict(
+        calibration, do_map_project=False, final_resolution=None, map_template=None
+    )
+    return dict(
+        product="remapping",
+        calibration=key_of(calibration),
+        source=source,
+        resolution=resolution,
+        map_template=_map_digest(map_template),
+    )
+
+
+def key_of(inputs):
+    "Hex key of the inputs of a product."
+    text = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def product_name(path):
+    "Name of a product file without image id and version, e.g. 'cal.dst.map.cub'."
+    return Path(path).name.partition(".")[2]
+
+
+def _link_or_copy(source, target):
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists() or target.is_symlink():
+        target.unlink()
+    try:
+        os.link(str(source), str(target))
+    except OSError:
+        shutil.copy2(str(source), str(target))
+
+
+def detach(paths):
+    """Remove products that are hard links, before they are computed again.
+
+    ISIS overwrites existing output files in place, which would change the
+    stored products linked to them.
+    """
+    for path in paths:
+        try:
+            if os.stat(str(path)).st_nlink > 1:
+                os.unlink(str(path))
+        except FileNotFoundError:
+            pass
+
+
+class ProductStore(object):
+    """Calibrated products by the key of their inputs.
+
+    Parameters
+    ----------
+    root : str or pathlib.Path, optional
+        Folder of the store, by default `[pyciss_store] path` of the config
+        or `.store` in the database folder.
+    """
+
+    def __init__(self, root=None):
+        if root is None:
+            try:
+                root = get_config()["pyciss_store"]["path"]
+            except (KeyError, IOError):
+                root = get_db_root() / ".store"
+        self.root = Path(root)
+
+    def __repr__(self):
+        return "ProductStore({!r})".format(str(self.root))
+
+    def entry(self, key):
+        "pathlib.Path: Folder of the entry of `key`."
+        return self.root / key[:2] / key
+
+    def __contains__(self, key):
+        return (self.entry(key) / "inputs.json").exists()
+
+    def inputs(self, key):
+        "dict: Inputs the entry of `key` was stored with."
+        return json.loads((self.entry(key) / "inputs.json").read_text())
+
+    def fetch(self, key, targets):
+        """Link the stored products of `key` to their places in the database.
+
+        Parameters
+        ----------
+        key : str
+            Key of the inputs, see `key_of`.
+        targets : dict
+            Target path by product name, see `product_name`.
+
+        Returns
+        -------
+        bool
+            If all products were in the store. Nothing is linked otherwise.
+        """
+        entry = self.entry(key)
+        sources = {name: entry / name for name in targets}
+        if key not in self or not all(p.exists() for p in sources.values()):
+            return False
+        for name, target in targets.items():
+            _link_or_copy(sources[name], target)
+        logger.info("Took %s from the product store %s.", sorted(targets), entry)
+        return True
+
+    def put(self, key, files, inputs=None):
+        """Store products under `key`.
+
+        An existing entry of `key` is kept.
+
+        Parameters
+        ----------
+        key : str
+            Key of the inputs, see `key_of`.
+        files : dict
+            Path by product name.
+        inputs : dict, optional
+            The inputs of `key`, stored for reference.
+
+        Returns
+        -------
+        bool
+            If a new entry was written.
+        """
+        if key in self:
+            return False
+        entry = self.entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.with_name(".{}.{}.tmp".format(key, os.getpid()))
+        shutil.rmtree(str(tmp), ignore_errors=True)
+        tmp.mkdir()
+        try:
+            for name, path in files.items():
+                _link_or_copy(path, tmp / name)
+            (tmp / "inputs.json").write_text(json.dumps(inputs or {}, indent=1))
+            os.rename(str(tmp), str(entry))
+        except OSError:
+            # another process stored the same products first
+            shutil.rmtree(str(tmp), ignore_errors=True)
+            if key not in self:
+                raise
+            return False
+        logger.info("Stored %s in %s.", sorted(files), entry)
+        return True
+
+    def remove(self, key):
+        "Remove the entry of `key`, e.g. of a broken calibration."
+        shutil.rmtree(str(self.entry(key)), ignore_errors=True)
@@ -0,0 +1,316 @@
+"""Synthetic ISIS ring cubes and databases for tests and benchmarks.
+
+The cubes look like the calibrated, map-projected ring cubes created by
+`pyciss.pipeline` (`*.cal.dst.map.cub`): a RingCylindrical Mapping group,
+an Instrument group with the image time, 32-bit float pixels and ISIS Null
+pixels outside of the image footprint. The pixel data has a radial ring
+profile with a spiral density wave, so the statistics and plots have
+something to work on. No ISIS installation or archive data is required.
+
+`make_database` writes a complete pyciss setup with such cubes, a ring
+summary index, a cumulative index and a config file. Point the environment variable
+PYCISS_CONFIG to its config file before importing pyciss to use it.
+"""
+import configparser
+import datetime as dt
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# ISIS special pixel value Null for Real pixels, 0xFF7FFFFB
+ISIS_NULL = np.frombuffer(bytes.fromhex("fbff7fff"), dtype="<f4")[0]
+
+# Cassini spacecraft clock counts seconds since this epoch, approximately
+SCLK_EPOCH = dt.datetime(1958, 1, 1)
+
+# offset of the pixel data, label and history fit before it
+START_BYTE = 65537
+
+CUBE_LABEL = """Object = IsisCube
+  Object = Core
+    StartByte   = {start_byte}
+    Format      = BandSequential
+
+    Group = Dimensions
+      Samples = {samples}
+      Lines   = {lines}
+      Bands   = 1
+    End_Group
+
+    Group = Pixels
+      Type       = Real
+      ByteOrder  = Lsb
+      Base       = 0.0
+      Multiplier = 1.0
+    End_Group
+  End_Object
+
+  Group = Instrument
+    SpacecraftName          = Cassini-Huygens
+    InstrumentId            = {instrument_id}
+    TargetName              = Saturn
+    ImageTime               = {imagetime}
+    ExposureDuration        = 1200.0 <Milliseconds>
+    InstrumentModeId        = Full
+    SummingMode             = 1
+  End_Group
+
+  Group = BandBin
+    FilterName   = CL1/CL2
+    OriginalBand = 1
+    Center       = 651.065
+    Width        = 340.923
+  End_Group
+
+  Group = Mapping
+    ProjectionName         = RingCylindrical
+    TargetName             = Saturn
+    EquatorialRadius       = 60268000.0 <meters>
+    PolarRadius            = 54364000.0 <meters>
+    RingLongitudeDirection = CounterClockwise
+    RingLongitudeDomain    = 360
+    PixelResolution        = {pixres} <meters/pixel>
+    CenterRingRadius       = {midrad}
+    CenterRingLongitude    = {midlon}
+    MinimumRingRadius      = {minrad}
+    MaximumRingRadius      = {maxrad}
+    MinimumRingLongitude   = {minlon}
+    MaximumRingLongitude   = {maxlon}
+  End_Group
+End_Object
+
+Object = Label
+  Bytes = {start_byte_minus_one}
+End_Object
+End
+"""
+
+
+def img_id_from_sclk(sclk, camera="N"):
+    "Image id of a `camera` ('N' or 'W') image taken at spacecraft clock `sclk`."
+    return f"{camera}{int(sclk):010d}"
+
+
+def sclk_to_time(sclk):
+    "Approximate UTC time of a spacecraft clock count."
+    return SCLK_EPOCH + dt.timedelta(seconds=int(sclk))
+
+
+def ring_image(shape=(1000, 2000), minrad=130e6, maxrad=131e6, seed=None):
+    """Create the pixel data of a synthetic map-projected ring image.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        (lines, samples), i.e. (radius, longitude).
+    minrad, maxrad : float
+        Radius range in meters.
+    seed : int, optional
+        Seed for the noise.
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 I/F values, radius along axis 0, with `ISIS_NULL` outside of
+        a skewed image footprint as left by the map projection.
+    """
+    rng = np.random.RandomState(seed)
+    lines, samples = shape
+    radius = np.linspace(minrad, maxrad, lines)[:, np.newaxis]
+    x = (radius - minrad) / (maxrad - minrad)
+    # smooth background with a few ringlets
+    profile = 0.05 + 0.02 * np.sin(2 * np.pi * 3 * x)
+    for center in rng.uniform(0.1, 0.9, 3):
+        profile = profile + 0.03 * np.exp(-(((x - center) / 0.01) ** 2))
+    # spiral density wave: wavelength decreasing with distance from resonance
+    wave_x = np.clip(x - 0.3, 0, None)
+    wave = np.exp(-wave_x / 0.4) * np.sin(400 * wave_x ** 2) * (x > 0.3)
+    profile = profile + 0.02 * wave
+    longitude = np.linspace(0, 1, samples)[np.newaxis, :]
+    data = profile * (1 + 0.1 * longitude) + rng.normal(0, 0.002, shape)
+    data = data.astype("float32")
+    # footprint of a square frame projected onto the ring plane
+    edge = 0.15 * samples * (1 - x)
+    sample = np.arange(samples)
+    outside = (sample < edge) | (sample > samples - 1 - edge[::-1])
+    data[outside] = ISIS_NULL
+    return data
+
+
+def write_cube(
+    path,
+    data,
+    minrad=130e6,
+    maxrad=131e6,
+    minlon=0.0,
+    maxlon=10.0,
+    imagetime=None,
+    instrument_id="ISSNA",
+    pixres=500.0,
+):
+    """Write image data as an ISIS map-projected ring cube.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Output file.
+    data : numpy.ndarray
+        Image data, radius along axis 0, as created by `ring_image`.
+    minrad, maxrad : float
+        Radius range in meters.
+    minlon, maxlon : float
+        Longitude range in degrees.
+    imagetime : datetime.datetime, optional
+        Image time for the Instrument group, by default 2008-01-01.
+    instrument_id : {'ISSNA', 'ISSWA'}
+        Camera.
+    pixres : float
+        PixelResolution in meters/pixel.
+
+    Returns
+    -------
+    pathlib.Path
+    """
+    path = Path(path)
+    if imagetime is None:
+        imagetime = dt.datetime(2008, 1, 1)
+    lines, samples = data.shape
+    label = CUBE_LABEL.format(
+        start_byte=START_BYTE,
+        start_byte_minus_one=START_BYTE - 1,
+        samples=samples,
+        lines=lines,
+        instrument_id=instrument_id,
+        imagetime=imagetime.isoformat(timespec="milliseconds"),
+        pixres=pixres,
+        midrad=(minrad + maxrad) / 2,
+        midlon=(minlon + maxlon) / 2,
+        minrad=minrad,
+        maxrad=maxrad,
+        minlon=minlon,
+        maxlon=maxlon,
+    )
+    with path.open("wb") as f:
+        f.write(label.encode("ascii").ljust(START_BYTE - 1, b" "))
+        f.write(np.asarray(data, dtype="<f4").tobytes())
+    return path
+
+
+def ring_summary_rows(img_ids, minrads, maxrads, pixres):
+    """Ring summary index rows as read by `index.ring_summary_index`.
+
+    Radii in meters, `pixres` in meters/pixel, like the cube labels.
+    """
+    volume = "data/1467345444_1467419574"
+    return pd.DataFrame(
+        {
+            "FILE_SPECIFICATION_NAME": [f"{volume}/{i}_1.LBL" for i in img_ids],
+            "MINIMUM_RING_RADIUS": np.asarray(minrads) / 1000,
+            "MAXIMUM_RING_RADIUS": np.asarray(maxrads) / 1000,
+            "FINEST_RADIAL_RESOLUTION": np.asarray(pixres) / 1000 * 0.9,
+            "COARSEST_RADIAL_RESOLUTION": np.asarray(pixres) / 1000 * 1.1,
+            "MINIMUM_RING_EMISSION_ANGLE": 60.0,
+            "MAXIMUM_RING_EMISSION_ANGLE": 70.0,
+        }
+    )
+
+
+def cumulative_index_rows(img_ids, times, minrads, maxrads, minlons, maxlons):
+    """Cumulative index rows as read by `index.read_cumulative_iss_index`.
+
+    Radii in meters, like the cube labels, longitudes in degrees.
+    """
+    volume = "data/1467345444_1467419574"
+    instruments = np.where([i.startswith("N") for i in img_ids], "ISSNA", "ISSWA")
+    return pd.DataFrame(
+        {
+            "VOLUME_ID": "COISS_2001",
+            "FILE_SPECIFICATION_NAME": [f"{volume}/{i}_1.LBL" for i in img_ids],
+            "INSTRUMENT_ID": instruments,
+            "FILTER_NAME_1": "CL1",
+            "FILTER_NAME_2": "CL2",
+            "TARGET_NAME": "S RINGS",
+            "TARGET_DESC": "Ring",
+            "RINGS_FLAG": "YES",
+            "IMAGE_MID_TIME": [t.strftime("%Y-%jT%H:%M:%S.%f")[:-3] for t in times],
+            "MINIMUM_RING_RADIUS": np.asarray(minrads) / 1000,
+            "MAXIMUM_RING_RADIUS": np.asarray(maxrads) / 1000,
+            "MINIMUM_RING_LONGITUDE": np.asarray(minlons),
+            "MAXIMUM_RING_LONGITUDE": np.asarray(maxlons),
+        }
+    )
+
+
+def make_database(root, n_images=4, shape=(1000, 2000), n_index_rows=5000, seed=0):
+    """Create a synthetic pyciss database, index and config.
+
+    Parameters
+    ----------
+    root : str or pathlib.Path
+        Folder that will contain `db`, `index` and `pyciss.ini`.
+    n_images : int
+        Number of cubes to write into the database.
+    shape : tuple of int
+        (lines, samples) of the cubes.
+    n_index_rows : int
+        Total number of rows of the ring summary index, the database images
+        plus random others, as the real index covers many more images than
+        are downloaded.
+    seed : int
+        Seed for the random numbers.
+
+    Returns
+    -------
+    dict
+        Paths of the 'config', 'db', 'index' and the list of 'cubes'.
+    """
+    rng = np.random.RandomState(seed)
+    root = Path(root)
+    dbroot = root / "db"
+    indexdir = root / "index"
+    indexdir.mkdir(parents=True, exist_ok=True)
+
+    n_index_rows = max(n_index_rows, n_images)
+    sclks = 1467345444 + np.sort(rng.choice(10 ** 8, n_index_rows, replace=False))
+    img_ids = [img_id_from_sclk(sclk) for sclk in sclks]
+    minrads = rng.uniform(74e6, 136e6, n_index_rows)
+    maxrads = minrads + rng.uniform(0.5e6, 5e6, n_index_rows)
+    pixres = rng.uniform(200, 2000, n_index_rows)
+    minlons = rng.uniform(0, 360, n_index_rows)
+    maxlons = (minlons + rng.uniform(5, 40, n_index_rows)) % 360
+
+    cubes = []
+    for i in range(n_images):
+        img_id = img_ids[i]
+        folder = dbroot / img_id
+        folder.mkdir(parents=True, exist_ok=True)
+        # empty raw file, so that PathManager finds the version
+        (folder / f"{img_id}_1.IMG").touch()
+        data = ring_image(shape, minrads[i], maxrads[i], seed=seed + i)
+        cubes.append(
+            write_cube(
+                folder / f"{img_id}_1.cal.dst.map.cub",
+                data,
+                minrads[i],
+                maxrads[i],
+                minlons[i],
+                minlons[i] + (maxlons[i] - minlons[i]) % 360,
+                imagetime=sclk_to_time(sclks[i]),
+                pixres=pixres[i],
+            )
+        )
+
+    df = ring_summary_rows(img_ids, minrads, maxrads, pixres)
+    df.to_hdf(str(indexdir / "COISS_2999_ring_summary.hdf"), key="df")
+    times = [sclk_to_time(sclk) for sclk in sclks]
+    df = cumulative_index_rows(img_ids, times, minrads, maxrads, minlons, maxlons)
+    df.to_hdf(str(indexdir / "COISS_2999_index.hdf"), key="df")
+
+    config = configparser.ConfigParser()
+    config["pyciss_db"] = {"path": str(dbroot)}
+    config["pyciss_index"] = {"path": str(indexdir)}
+    configpath = root / "pyciss.ini"
+    with configpath.open("w") as f:
+        config.write(f)
+    return dict(config=configpath, db=dbroot, index=indexdir, cubes=cubes)
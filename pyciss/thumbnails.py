@@ -0,0 +1,207 @@
+"""Fast browse thumbnails of ring cubes, written without matplotlib.
+
+The image data is mapped to uint8 with the same percentile clipping as
+`RingCube.calc_clim`, downsampled by NaN-aware block averaging and written
+directly with Pillow. `write_thumbnails` processes many cubes on a thread
+pool; the heavy work happens in NumPy and Pillow, which release the GIL.
+"""
+import logging
+import math
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .io import read_cube_img
+
+try:
+    from PIL import Image
+except ImportError:
+    _PILLOW_INSTALLED = False
+else:
+    _PILLOW_INSTALLED = True
+
+logger = logging.getLogger(__name__)
+
+
+def calc_clim(data, pmin=0.1, pmax=99):
+    """Percentile limits as in `RingCube.calc_clim`, ignoring NaN and inf.
+
+    Returns
+    -------
+    tuple
+        (vmin, vmax)
+    """
+    finite = data[np.isfinite(data)]
+    if finite.size == 0:
+        return 0.0, 1.0
+    return tuple(np.percentile(finite, (pmin, pmax)))
+
+
+def equalize(data):
+    """Histogram equalization as done by `RingCube.imshow(equalized=True)`."""
+    from skimage import exposure
+
+    data = np.nan_to_num(data)
+    data[data < 0] = 0
+    return exposure.equalize_hist(data)
+
+
+def block_mean(data, factors):
+    """Downsample by averaging blocks, ignoring NaNs.
+
+    The data is padded with NaNs to a multiple of the block size, so no
+    border pixels are lost.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        2D array.
+    factors : tuple of int
+        Block size along axis 0 and 1.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape ceil(data.shape / factors).
+    """
+    fy, fx = factors
+    if fy == fx == 1:
+        return data
+    ny, nx = math.ceil(data.shape[0] / fy), math.ceil(data.shape[1] / fx)
+    padded = np.full((ny * fy, nx * fx), np.nan)
+    padded[: data.shape[0], : data.shape[1]] = data
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmean(padded.reshape(ny, fy, nx, fx), axis=(1, 3))
+
+
+def scale_to_uint8(data, vmin, vmax):
+    """Linearly map [vmin, vmax] to [0, 255], clipping outside. NaN becomes 0."""
+    span = vmax - vmin if vmax > vmin else 1.0
+    with np.errstate(invalid="ignore"):
+        scaled = np.clip((data - vmin) / span, 0, 1) * 255
+    return np.nan_to_num(scaled).round().astype("uint8")
+
+
+def thumbnail_array(data, size=(256, 256), pmin=0.1, pmax=99, equalized=False):
+    """Create the uint8 thumbnail of image data.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Image data as `RingCube.img`, radius along axis 0.
+    size : tuple of int
+        (width, height) of the thumbnail.
+    pmin, pmax : float
+        Percentiles for the display limits, as `RingCube.plot_limits`.
+    equalized : bool
+        Apply histogram equalization first.
+
+    Returns
+    -------
+    numpy.ndarray
+        uint8 array of shape (height, width), flipped to the orientation of
+        `RingCube.imshow`, which plots with origin='lower'.
+    """
+    data = np.array(data, dtype="float64")
+    if equalized:
+        data = equalize(data)
+    vmin, vmax = calc_clim(data, pmin, pmax)
+    width, height = size
+    factors = (math.ceil(data.shape[0] / height), math.ceil(data.shape[1] / width))
+    small = block_mean(data, factors)
+    return np.flipud(scale_to_uint8(small, vmin, vmax))
+
+
+def thumbnail_path(cubepath, outdir=None, fmt="png"):
+    "Default thumbnail path, {stem}_thumb.{fmt} next to the cube or in `outdir`."
+    cubepath = Path(cubepath)
+    outdir = cubepath.parent if outdir is None else Path(outdir)
+    return outdir / "{}_thumb.{}".format(cubepath.name.split(".")[0], fmt)
+
+
+def write_thumbnail(
+    cube, outpath=None, size=(256, 256), pmin=0.1, pmax=99, equalized=False, quality=85
+):
+    """Write the thumbnail of a ring cube.
+
+    Parameters
+    ----------
+    cube : str, pathlib.Path or pyciss.ringcube.RingCube
+        Path to a cube, or an opened RingCube, whose `pmin` and `pmax` are
+        used then.
+    outpath : str or pathlib.Path, optional
+        Output file, the format is taken from its suffix. By default a PNG
+        next to the cube, see `thumbnail_path`.
+    size : tuple of int
+        (width, height) of the thumbnail.
+    pmin, pmax : float
+        Percentiles for the display limits.
+    equalized : bool
+        Apply histogram equalization first.
+    quality : int
+        JPEG quality.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the written thumbnail.
+    """
+    if not _PILLOW_INSTALLED:
+        raise ImportError("Writing thumbnails requires Pillow.")
+    if hasattr(cube, "img"):
+        data, fname = cube.img, cube.filename
+        pmin, pmax = cube.pmin, cube.pmax
+    else:
+        data, fname = read_cube_img(cube), cube
+    outpath = thumbnail_path(fname) if outpath is None else Path(outpath)
+    arr = thumbnail_array(data, size, pmin=pmin, pmax=pmax, equalized=equalized)
+    img = Image.fromarray(arr)
+    if img.size != tuple(size):
+        img = img.resize(tuple(size), Image.BILINEAR)
+    if outpath.suffix.lower() in [".jpg", ".jpeg"]:
+        img.save(str(outpath), quality=quality)
+    else:
+        img.save(str(outpath))
+    logger.debug("Created %s", outpath)
+    return outpath
+
+
+def write_thumbnails(cubes, outdir=None, fmt="png", max_workers=None, **kwargs):
+    """Write thumbnails of many cubes on a thread pool.
+
+    Parameters
+    ----------
+    cubes : iterable of str or pathlib.Path
+        Paths to cubes.
+    outdir : str or pathlib.Path, optional
+        Folder for the thumbnails, by default the folder of each cube.
+    fmt : {'png', 'jpg'}
+        Image format.
+    max_workers : int, optional
+        Number of threads, by default the number of CPUs.
+    kwargs
+        Passed on to `write_thumbnail`.
+
+    Returns
+    -------
+    dict
+        Thumbnail path or raised exception per cube path.
+    """
+    if outdir is not None:
+        Path(outdir).mkdir(parents=True, exist_ok=True)
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+
+    def work(cube):
+        try:
+            return write_thumbnail(cube, thumbnail_path(cube, outdir, fmt), **kwargs)
+        except Exception as e:
+            logger.error("Thumbnail of %s failed: %s", cube, e)
+            return e
+
+    cubes = list(cubes)
+    with ThreadPoolExecutor(max_workers) as executor:
+        return dict(zip(cubes, executor.map(work, cubes)))
@@ -0,0 +1,350 @@
+"""Parallel, polite file downloads with per-transfer telemetry.
+
+`Downloader` runs the transfers of `OPUS.download_results` and
+`OPUS.download_previews` on a thread pool. Two controls keep it polite to
+the PDS Rings node while still filling the link:
+
+* a `TokenBucket` limits the rate at which requests are started,
+* `AdaptiveConcurrency` limits the number of running transfers. It adds a
+  transfer slot whenever the throughput of the last window of transfers
+  rose, and halves the slots on errors, 429 (Too Many Requests) and 5xx
+  responses, waiting for a Retry-After header if the server sends one.
+
+Every transfer is recorded with its size, duration, throughput, number of
+retries and HTTP status; `Downloader.summary` aggregates them for a run.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket rate limit.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second, i.e. the sustained request rate.
+    capacity : float, optional
+        Maximum number of tokens, i.e. the allowed burst. Default: `rate`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, tokens=1):
+        "Block until `tokens` are available and take them."
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency(object):
+    """Additive increase, multiplicative decrease limit of parallel transfers.
+
+    Parameters
+    ----------
+    initial : int
+        Number of parallel transfers to start with.
+    min_limit, max_limit : int
+        Range of the limit.
+    gain : float
+        Relative throughput increase of a window that counts as rising.
+    """
+
+    def __init__(self, initial=2, min_limit=1, max_limit=8, gain=0.05):
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.gain = gain
+        self.active = 0
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+        self._reset_window()
+        self.last_throughput = None
+
+    def _reset_window(self):
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.window_count = 0
+
+    def acquire(self):
+        "Block until a transfer slot is free and no back-off pause is active."
+        with self.cond:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.cond.wait(pause)
+                elif self.active >= self.limit:
+                    self.cond.wait()
+                else:
+                    self.active += 1
+                    return
+
+    def release(self, nbytes=0):
+        "Free the slot of a successful transfer of `nbytes`."
+        with self.cond:
+            self.active -= 1
+            self.window_bytes += nbytes
+            self.window_count += 1
+            if self.window_count >= self.limit:
+                elapsed = max(time.monotonic() - self.window_start, 1e-6)
+                throughput = self.window_bytes / elapsed
+                last = self.last_throughput
+                if last is None or throughput > last * (1 + self.gain):
+                    self.limit = min(self.limit + 1, self.max_limit)
+                self.last_throughput = throughput
+                self._reset_window()
+            self.cond.notify_all()
+
+    def backoff(self, delay=0.0):
+        """Halve the limit after a failed transfer, its slot stays taken.
+
+        Parameters
+        ----------
+        delay : float
+            Seconds no new transfers may start, e.g. from Retry-After.
+        """
+        with self.cond:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            # throughput before the back-off is no reference for the new limit
+            self.last_throughput = None
+            self._reset_window()
+
+    def fail(self):
+        "Free the slot of a transfer that gave up."
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+
+def _retry_after(response, default):
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:
+        # HTTP dates are allowed as well, not worth parsing
+        return default
+
+
+class Downloader(object):
+    """Download many files in parallel with rate limit and adaptive concurrency.
+
+    Parameters
+    ----------
+    rate : float
+        Maximum number of requests started per second.
+    burst : float, optional
+        Number of requests that may be started at once. Default: `rate`.
+    initial, min_workers, max_workers : int
+        Initial, minimum and maximum number of parallel transfers.
+    retries : int
+        Number of retries per file after errors, 429 and 5xx responses.
+    backoff : float
+        Seconds to wait before the first retry, doubled for every further one,
+        unless the server sends a Retry-After header.
+    timeout : float
+        Connect and read timeout of the requests in seconds.
+    session : requests.Session, optional
+        Session to use, e.g. with custom headers.
+
+    Attributes
+    ----------
+    records : list of dict
+        One record per transfer: url, path, status, bytes, duration,
+        throughput, retries and error.
+    """
+
+    def __init__(
+        self,
+        rate=5.0,
+        burst=None,
+        initial=2,
+        min_workers=1,
+        max_workers=8,
+        retries=3,
+        backoff=1.0,
+        timeout=60,
+        session=None,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(initial, min_workers, max_workers)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session() if session is None else session
+        self.records = []
+        self.lock = threading.Lock()
+        self.wall = 0.0
+
+    def _get(self, url, path):
+        tmp = Path(str(path) + ".part")
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as r:
+                if r.status_code != 200:
+                    return r, 0
+                nbytes = 0
+                with tmp.open("wb") as f:
+                    for chunk in r.iter_content(chunk_size=1 << 16):
+                        f.write(chunk)
+                        nbytes += len(chunk)
+            os.replace(str(tmp), str(path))
+        except BaseException:
+            # no partial files of failed transfers
+            try:
+                tmp.unlink()
+            except FileNotFoundError:
+                pass
+            raise
+        return r, nbytes
+
+    def fetch(self, url, path):
+        """Download one file, with retries.
+
+        Parameters
+        ----------
+        url : str
+            URL of the file.
+        path : str or pathlib.Path
+            Where to store the file. It is written to a '.part' file first and
+            only renamed when complete.
+
+        Returns
+        -------
+        dict
+            Record of the transfer, also appended to `records`.
+        """
+        record = dict(
+            url=url,
+            path=str(path),
+            status=None,
+            bytes=0,
+            duration=0.0,
+            retries=0,
+            error=None,
+        )
+        t0 = time.perf_counter()
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.concurrency.acquire()
+            delay = self.backoff * 2 ** attempt
+            try:
+                response, nbytes = self._get(url, path)
+            except requests.exceptions.SSLError:
+                # some PDS servers have had certificate problems
+                url = url.replace("https://", "http://")
+                error = "SSL error, retrying with http"
+                status = None
+            except requests.exceptions.RequestException as e:
+                error = repr(e)
+                status = None
+            except OSError as e:
+                # writing the file failed, e.g. a full disk, retrying does not help
+                self.concurrency.fail()
+                record.update(status=None, error=repr(e))
+                break
+            else:
+                status = response.status_code
+                if status == 200:
+                    self.concurrency.release(nbytes)
+                    record.update(status=status, bytes=nbytes)
+                    break
+                error = f"HTTP {status}"
+                if status not in RETRY_STATUS:
+                    self.concurrency.fail()
+                    record.update(status=status, error=error)
+                    break
+                delay = _retry_after(response, delay)
+            record.update(status=status, error=error)
+            if attempt == self.retries:
+                self.concurrency.fail()
+                break
+            logger.info("%s: %s, retrying in %.1f s.", url, error, delay)
+            self.concurrency.backoff(delay)
+            self.concurrency.fail()
+            attempt += 1
+            record["retries"] = attempt
+        if record["status"] == 200:
+            record["error"] = None
+        record["duration"] = time.perf_counter() - t0
+        record["throughput"] = record["bytes"] / max(record["duration"], 1e-9)
+        with self.lock:
+            self.records.append(record)
+        logger.debug("Downloaded %s: %s", path, record)
+        return record
+
+    def download(self, jobs):
+        """Download many files.
+
+        Parameters
+        ----------
+        jobs : iterable of (url, path) tuples
+            Files to download.
+
+        Returns
+        -------
+        pd.DataFrame
+            Records of the transfers of this call.
+        """
+        jobs = list(jobs)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            records = list(executor.map(lambda job: self.fetch(*job), jobs))
+        self.wall += time.perf_counter() - t0
+        return pd.DataFrame(records)
+
+    def to_dataframe(self):
+        "pd.DataFrame: All transfer records."
+        return pd.DataFrame(self.records)
+
+    def summary(self):
+        """Aggregated telemetry of all transfers.
+
+        Returns
+        -------
+        dict
+            Number of files and failures, total bytes and retries, the wall
+            time spent in `download`, the resulting throughput in bytes/s,
+            the counts of final HTTP statuses and the final concurrency limit.
+        """
+        df = self.to_dataframe()
+        if df.empty:
+            return dict(files=0)
+        ok = df.status == 200
+        return dict(
+            files=len(df),
+            failed=int((~ok).sum()),
+            bytes=int(df.bytes.sum()),
+            retries=int(df.retries.sum()),
+            wall=self.wall,
+            throughput=df.bytes.sum() / self.wall if self.wall else float("nan"),
+            mean_transfer_throughput=float(df.throughput[ok].mean()),
+            status=df.status.value_counts(dropna=False).to_dict(),
+            concurrency=self.concurrency.limit,
+        )
@@ -0,0 +1,233 @@
+"""Integrity check of the files in the image database.
+
+Interrupted downloads and killed ISIS runs leave truncated .IMG and .cub
+files behind, which otherwise only show up when `RingCube` fails on them.
+`verify_database` checks every product in the database against its label:
+
+* raw and calibrated PDS images against RECORD_BYTES * FILE_RECORDS of
+  their detached .LBL,
+* PDS labels for their END statement,
+* ISIS cubes against the StartByte, dimensions, pixel type and tiling of
+  the Core and the StartByte and Bytes of the other objects (History,
+  OriginalLabel, tables) in their label.
+
+Only the labels and the file sizes are read, on a bounded thread pool, as
+the checks wait for I/O. `repair_list` turns the results into the images to
+download again (see `planner.plan_downloads`, which refetches incomplete
+images) or to calibrate again (`downloader.download_and_calibrate` with
+`recalibrate=True`).
+"""
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from .inventory import DBInventory
+from .io import PathManager, expected_file_bytes
+from .labels import PIXEL_BYTES, Label, cube_layout, has_end, read_label_bytes
+
+logger = logging.getLogger(__name__)
+
+# PDS images and the product with their label
+IMAGE_LABELS = {"raw_image": "raw_label", "calib_img": "calib_label"}
+LABELS = ["raw_label", "calib_label"]
+CUBES = ["raw_cub", "cal_cub", "dst_cub", "cubepath", "undestriped"]
+# what brings a broken product back
+ACTIONS = dict(
+    {key: "download" for key in list(IMAGE_LABELS) + LABELS},
+    **{key: "calibrate" for key in CUBES},
+)
+RESULT_COLUMNS = ["path", "img_id", "product", "status", "size", "expected", "detail"]
+
+
+def expected_cube_bytes(layout):
+    "Minimum size of a cube with the layout of `cube_layout`."
+    samples, lines, bands = (int(layout[k]) for k in ("Samples", "Lines", "Bands"))
+    pixel = PIXEL_BYTES[layout["Type"]]
+    if layout.get("Format", "Tile") == "Tile":
+        ts, tl = int(layout["TileSamples"]), int(layout["TileLines"])
+        samples = math.ceil(samples / ts) * ts
+        lines = math.ceil(lines / tl) * tl
+    end = int(layout["StartByte"]) - 1 + samples * lines * bands * pixel
+    for start, nbytes in layout["blobs"]:
+        end = max(end, start - 1 + nbytes)
+    return end
+
+
+def check_cube(path):
+    """Check the size of an ISIS cube against its label.
+
+    Returns
+    -------
+    status : {'ok', 'truncated', 'bad_label'}
+    expected : int or None
+    detail : str or None
+    """
+    text = read_label_bytes(path)
+    if not has_end(text):
+        return "bad_label", None, "no End of the label found"
+    try:
+        expected = expected_cube_bytes(cube_layout(Label(text.decode("latin-1"))))
+    except (KeyError, ValueError) as e:
+        return "bad_label", None, f"missing or invalid {e}"
+    if Path(path).stat().st_size < expected:
+        return "truncated", expected, None
+    return "ok", expected, None
+
+
+def check_image(path, label):
+    """Check the size of a PDS image against its detached label.
+
+    Returns
+    -------
+    status : {'ok', 'truncated', 'oversized', 'missing_label', 'bad_label'}
+    expected : int or None
+    detail : str or None
+    """
+    if not Path(label).exists():
+        return "missing_label", None, str(label)
+    expected = expected_file_bytes(label)
+    if expected is None:
+        return "bad_label", None, "no RECORD_BYTES or FILE_RECORDS"
+    size = Path(path).stat().st_size
+    if size < expected:
+        return "truncated", expected, None
+    if size > expected:
+        return "oversized", expected, None
+    return "ok", expected, None
+
+
+def check_label(path, tail=256):
+    """Check that a PDS label ends with its END statement.
+
+    Returns
+    -------
+    status : {'ok', 'truncated'}
+    expected : None
+    detail : None
+    """
+    with open(str(path), "rb") as f:
+        f.seek(0, 2)
+        f.seek(max(0, f.tell() - tail))
+        lines = f.read().split()
+    return ("ok" if lines and lines[-1] == b"END" else "truncated"), None, None
+
+
+def check_product(path, product, version=None):
+    """Check one database file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        File to check.
+    product : str
+        Key of `PathManager.extensions`, e.g. 'raw_image' or 'cubepath'.
+    version : str, optional
+        Image version, to find the label of PDS images.
+
+    Returns
+    -------
+    status : str
+        'ok', 'unchecked' for products without check, or a problem like
+        'truncated', see `check_cube`, `check_image` and `check_label`.
+    expected : int or None
+        Expected minimum size.
+    detail : str or None
+    """
+    path = Path(path)
+    try:
+        if product in CUBES:
+            return check_cube(path)
+        if product in LABELS:
+            return check_label(path)
+        if product in IMAGE_LABELS:
+            img_id = path.name[:11]
+            ext = PathManager.extensions[IMAGE_LABELS[product]]
+            label = path.parent / f"{img_id}_{version}{ext}"
+            return check_image(path, label)
+    except OSError as e:
+        return "unreadable", None, repr(e)
+    return "unchecked", None, None
+
+
+def _check_rows(rows):
+    results = []
+    for path, img_id, version, product, size in rows:
+        status, expected, detail = check_product(path, product, version)
+        results.append((path, img_id, product, status, size, expected, detail))
+    return results
+
+
+def verify_database(dbroot=None, max_workers=16, chunksize=64, refresh=True):
+    """Check all products in the image database in parallel.
+
+    Parameters
+    ----------
+    dbroot : str or pathlib.Path, optional
+        Path to the pyciss image database. By default the one in the config.
+    max_workers : int
+        Number of I/O threads.
+    chunksize : int
+        Number of files checked per task.
+    refresh : bool
+        Update the `inventory.DBInventory` of the database first.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per file, with the columns in `RESULT_COLUMNS`.
+    """
+    with DBInventory(dbroot) as inventory:
+        if refresh:
+            inventory.refresh()
+        products = inventory.products()
+    products = products[products["product"].isin(ACTIONS)]
+    rows = list(
+        zip(
+            products.filename,
+            products.img_id,
+            products.version,
+            products["product"],
+            products["size"],
+        )
+    )
+    chunks = [rows[i : i + chunksize] for i in range(0, len(rows), chunksize)]
+    with ThreadPoolExecutor(max_workers) as executor:
+        results = [row for chunk in executor.map(_check_rows, chunks) for row in chunk]
+    df = pd.DataFrame(results, columns=RESULT_COLUMNS)
+    logger.info("Verified %i files: %s", len(df), df.status.value_counts().to_dict())
+    return df
+
+
+def repair_list(results):
+    """Broken products and how to repair them.
+
+    Parameters
+    ----------
+    results : pd.DataFrame
+        Output of `verify_database`.
+
+    Returns
+    -------
+    pd.DataFrame
+        The rows of the broken files, with an `action` column: 'download'
+        for PDS images and labels, 'calibrate' for cubes.
+    """
+    broken = results[~results.status.isin(["ok", "unchecked"])].copy()
+    broken["action"] = broken["product"].map(ACTIONS)
+    return broken.sort_values(["action", "img_id"]).reset_index(drop=True)
+
+
+def write_repair_list(results, path):
+    """Write the repair list of `results` as CSV.
+
+    Returns
+    -------
+    pd.DataFrame
+        The repair list.
+    """
+    repairs = repair_list(results)
+    repairs.to_csv(str(path), index=False)
+    return repairs
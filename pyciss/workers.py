@@ -0,0 +1,312 @@
+"""Process pools that share the catalog tables and large results efficiently.
+
+A new worker process would read the ring summary index and the resonance
+tables again on its first `RingCube`. `pool` loads them once in the parent
+and puts their numeric columns into `multiprocessing.shared_memory`; the
+pool initializer `init_worker` installs zero-copy, read-only views of them
+as the worker's `catalogs`. Only the few string columns are pickled, once
+per worker.
+
+In the other direction, `share_array` moves a large result array into a
+shared memory block and returns a small `SharedArray` handle, so only the
+handle is pickled back to the parent, where `fetch` copies the data out and
+frees the block. `map_arrays` combines both for functions that return
+arrays, e.g. `median_profiles`, and admits the jobs within a memory budget
+if given their memory estimates, see `scheduler.MemoryScheduler`.
+"""
+import logging
+import multiprocessing
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from . import catalogs
+
+logger = logging.getLogger(__name__)
+
+TABLES = ("ring_summary", "resonances")
+# results smaller than this are cheaper to pickle than to share
+MIN_SHARED_BYTES = 1 << 16
+
+# shared memory attached by `init_worker`, kept open for the worker's lifetime
+_attached = []
+
+
+def _to_shared_memory(arr):
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[...] = arr
+    return shm
+
+
+def share_frame(df):
+    """Put the numeric columns of a DataFrame into shared memory.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+
+    Returns
+    -------
+    list of shared_memory.SharedMemory
+        The created blocks, to be closed and unlinked by the caller.
+    dict
+        Picklable description for `attach_frame`.
+    """
+    blocks = []
+    columns = []
+    for name, series in df.items():
+        values = series.to_numpy()
+        if values.dtype.kind in "biufcmM":
+            shm = _to_shared_memory(values)
+            blocks.append(shm)
+            columns.append((name, "shared", (shm.name, values.dtype.str, values.shape)))
+        else:
+            columns.append((name, "pickled", values))
+    return blocks, dict(index=df.index, columns=columns)
+
+
+def attach_frame(spec):
+    """Create a DataFrame from the description made by `share_frame`.
+
+    The numeric columns are read-only views on the shared memory.
+
+    Returns
+    -------
+    pd.DataFrame
+    list of shared_memory.SharedMemory
+        The attached blocks, which have to stay open while the DataFrame is used.
+    """
+    blocks = []
+    data = {}
+    for name, kind, payload in spec["columns"]:
+        if kind == "shared":
+            shm_name, dtype, shape = payload
+            shm = shared_memory.SharedMemory(name=shm_name)
+            blocks.append(shm)
+            values = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+            values.flags.writeable = False
+            data[name] = values
+        else:
+            data[name] = payload
+    return pd.DataFrame(data, index=spec["index"], copy=False), blocks
+
+
+class SharedCatalogs(object):
+    """Catalog tables of this process, shared for worker processes.
+
+    Parameters
+    ----------
+    names : iterable of str
+        Tables of `catalogs` to share. They are loaded here if necessary.
+
+    Attributes
+    ----------
+    spec : dict
+        Picklable description of the tables for `init_worker`.
+    """
+
+    def __init__(self, names=TABLES):
+        self.blocks = []
+        self.spec = {}
+        for name in names:
+            table = catalogs.get(name)
+            if table is None:
+                self.spec[name] = None
+                continue
+            blocks, self.spec[name] = share_frame(table)
+            self.blocks.extend(blocks)
+
+    def close(self):
+        "Free the shared memory, after the workers finished."
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def init_worker(spec, initializer=None, initargs=()):
+    """Pool initializer installing the shared catalog tables.
+
+    Parameters
+    ----------
+    spec : dict
+        `SharedCatalogs.spec` of the parent.
+    initializer : callable, optional
+        Further initializer to call afterwards with `initargs`.
+    """
+    for name, table_spec in spec.items():
+        if table_spec is None:
+            catalogs.install(name, None)
+            continue
+        table, blocks = attach_frame(table_spec)
+        _attached.extend(blocks)
+        catalogs.install(name, table)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+@contextmanager
+def pool(processes=None, initializer=None, initargs=(), tables=TABLES):
+    """multiprocessing.Pool whose workers share the catalog tables of this process.
+
+    Parameters
+    ----------
+    processes : int, optional
+        Number of worker processes, by default the number of CPUs.
+    initializer : callable, optional
+        Further worker initializer, called after the tables are installed.
+    initargs : tuple
+        Arguments for `initializer`.
+    tables : iterable of str
+        Tables of `catalogs` to share.
+
+    Yields
+    ------
+    multiprocessing.pool.Pool
+    """
+    with SharedCatalogs(tables) as shared:
+        with multiprocessing.Pool(
+            processes, init_worker, (shared.spec, initializer, initargs)
+        ) as p:
+            yield p
+
+
+class SharedArray(object):
+    """Handle of an array in a shared memory block, see `share_array`."""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def get(self):
+        "Copy the array out of the shared memory and free the block."
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            return np.ndarray(self.shape, np.dtype(self.dtype), buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def __repr__(self):
+        return f"SharedArray({self.name!r}, {self.shape}, {self.dtype!r})"
+
+
+def share_array(arr, min_bytes=MIN_SHARED_BYTES):
+    """Prepare an array to be returned from a worker process.
+
+    Parameters
+    ----------
+    arr : numpy.ndarray
+        Result array.
+    min_bytes : int
+        Smaller arrays are returned as they are, to be pickled.
+
+    Returns
+    -------
+    numpy.ndarray or SharedArray
+        Pass it to `fetch` in the parent.
+    """
+    arr = np.asarray(arr)
+    if arr.nbytes < min_bytes or arr.dtype.hasobject:
+        return arr
+    shm = _to_shared_memory(arr)
+    handle = SharedArray(shm.name, arr.shape, arr.dtype.str)
+    # the parent unlinks the block when fetching it
+    shm.close()
+    return handle
+
+
+def fetch(result):
+    "Get the array of a `share_array` result."
+    return result.get() if isinstance(result, SharedArray) else result
+
+
+def _call_shared(args):
+    func, item = args
+    return share_array(func(item))
+
+
+def map_arrays(func, items, processes=None, chunksize=1, memory=None, budget=None):
+    """Apply a function returning an array to many items in worker processes.
+
+    Parameters
+    ----------
+    func : callable
+        Picklable function of one item, returning a numpy.ndarray.
+    items : iterable
+        Items to process.
+    processes : int, optional
+        Number of worker processes, by default the number of CPUs.
+    chunksize : int
+        Number of items handed to a worker at once, without `memory`.
+    memory : list of int or callable, optional
+        Estimated bytes per item, or a function of an item returning them.
+        With estimates, only as many items run at once as fit into `budget`.
+    budget : int or str, optional
+        Memory budget, see `scheduler.MemoryScheduler`.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        Results in the order of `items`.
+    """
+    items = list(items)
+    jobs = [(func, item) for item in items]
+    with pool(processes) as p:
+        if memory is None:
+            results = p.imap(_call_shared, jobs, chunksize)
+        else:
+            from .scheduler import MemoryScheduler
+
+            if callable(memory):
+                memory = [memory(item) for item in items]
+            scheduler = MemoryScheduler(budget, processes)
+            results = scheduler.map(_call_shared, jobs, memory, pool=p)
+        return [fetch(result) for result in results]
+
+
+def _median_profile(fname):
+    from .ringcube import RingCube
+
+    return RingCube(str(fname)).median_profile
+
+
+def _cube_memory(fname):
+    from .quicklooks import resolve_cubepath
+    from .scheduler import estimate_memory
+
+    return estimate_memory(resolve_cubepath(fname))
+
+
+def median_profiles(fnames, processes=None, budget=None):
+    """Azimuthal median profiles of many cubes, computed in worker processes.
+
+    Parameters
+    ----------
+    fnames : iterable of str or pathlib.Path
+        Image ids or paths of ring cubes.
+    processes : int, optional
+        Maximum number of worker processes, by default the number of CPUs.
+    budget : int or str, optional
+        Memory budget for the cubes processed at once, see
+        `scheduler.MemoryScheduler`.
+
+    Returns
+    -------
+    dict
+        Median profile per item of `fnames`.
+    """
+    fnames = list(fnames)
+    profiles = map_arrays(
+        _median_profile, fnames, processes, memory=_cube_memory, budget=budget
+    )
+    return dict(zip(fnames, profiles))
@@ -0,0 +1,386 @@
+"""Work queue on a shared file system, to calibrate on many nodes at once.
+
+The queue is a folder that all nodes mount, with one file per image id in
+one of the subfolders
+
+* `pending`: waiting to be processed,
+* `claimed`: leased by a worker, which touches the file as heartbeat,
+* `done` and `failed`: the result record of a processed image.
+
+Workers claim an image by renaming its file from `pending` to `claimed`.
+The rename is atomic, so only one worker gets it, without locks and
+without a server. A claim whose file was not touched for `lease` seconds
+belongs to a dead or stuck worker and is put back into `pending` by the
+next worker that looks; times are compared against the clock of the file
+system, not the clocks of the nodes. Images that failed or lost their
+worker `max_attempts` times end up in `failed`.
+
+Fill the queue once, then start one worker per node::
+
+    python -m pyciss.workqueue /shared/queue add N1454725799 N1454725800
+    python -m pyciss.workqueue /shared/queue work
+
+The default job is `downloader.download_and_calibrate`. With the product
+store of the `store` module on the shared file system, images calibrated
+twice after a lost lease cost no second ISIS run.
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+STATES = ("pending", "claimed", "done", "failed")
+
+
+def calibrate(img_id):
+    "Default job: download and calibrate an image, see `downloader`."
+    from .downloader import download_and_calibrate
+
+    download_and_calibrate(img_id)
+
+
+def _read(path):
+    try:
+        text = path.read_text()
+    except FileNotFoundError:
+        return None
+    try:
+        return json.loads(text) if text.strip() else {}
+    except ValueError:
+        # caught while being written
+        return {}
+
+
+def _write(path, record):
+    tmp = path.with_name(".{}.{}.tmp".format(path.name, os.getpid()))
+    tmp.write_text(json.dumps(record))
+    os.replace(str(tmp), str(path))
+
+
+class _Heartbeat(threading.Thread):
+    "Touches the lease files of a worker until stopped."
+
+    def __init__(self, queue, interval):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.interval = interval
+        self.items = set()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for item in list(self.items):
+                self.queue.heartbeat(item)
+
+
+class WorkQueue(object):
+    """Queue of image ids in a folder shared by several nodes.
+
+    Parameters
+    ----------
+    root : str or pathlib.Path
+        Folder of the queue, created if needed.
+    lease : float
+        Seconds after the last heartbeat until a claim counts as abandoned.
+    max_attempts : int
+        Number of claims of an image before it counts as failed.
+    heartbeat : float, optional
+        Seconds between heartbeats of a working worker, default lease / 4.
+    """
+
+    def __init__(self, root, lease=600.0, max_attempts=3, heartbeat=None):
+        self.root = Path(root)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.heartbeat_interval = lease / 4 if heartbeat is None else heartbeat
+        self.host = socket.gethostname()
+        self.worker = "{}:{}".format(self.host, os.getpid())
+        for state in STATES:
+            (self.root / state).mkdir(parents=True, exist_ok=True)
+
+    def __repr__(self):
+        return "WorkQueue({!r})".format(str(self.root))
+
+    def _path(self, state, item):
+        return self.root / state / item
+
+    def items(self, state):
+        "list of str: Image ids in `state`, one of `STATES`."
+        return sorted(n for n in os.listdir(str(self.root / state)) if n[0] != ".")
+
+    def counts(self):
+        "dict: Number of image ids by state."
+        return {state: len(self.items(state)) for state in STATES}
+
+    def now(self):
+        "float: Current time of the shared file system, as used for its mtimes."
+        clock = self.root / ".clock"
+        clock.touch()
+        return clock.stat().st_mtime
+
+    def add(self, items, force=False):
+        """Add image ids to the queue.
+
+        Parameters
+        ----------
+        items : iterable of str
+            Image ids.
+        force : bool
+            Queue also images that are done or failed, dropping their result.
+
+        Returns
+        -------
+        int
+            Number of newly queued images.
+        """
+        added = 0
+        for item in items:
+            item = str(item)
+            finished = [self._path(s, item) for s in ("done", "failed")]
+            if any(p.exists() for p in finished):
+                if not force:
+                    continue
+                for path in finished:
+                    if path.exists():
+                        path.unlink()
+            if self._path("claimed", item).exists():
+                continue
+            try:
+                flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY
+                fd = os.open(str(self._path("pending", item)), flags)
+            except FileExistsError:
+                continue
+            os.close(fd)
+            added += 1
+        logger.info("Queued %i images in %s.", added, self.root)
+        return added
+
+    def claim(self):
+        """Lease the next pending image to this worker.
+
+        Returns
+        -------
+        str or None
+            The image id, None if nothing is pending.
+        """
+        for item in self.items("pending"):
+            pending = self._path("pending", item)
+            claimed = self._path("claimed", item)
+            try:
+                # a fresh mtime, so the claim does not look abandoned
+                os.utime(str(pending))
+                os.rename(str(pending), str(claimed))
+            except FileNotFoundError:
+                # another worker was faster
+                continue
+            record = _read(claimed) or {}
+            attempts = record.get("attempts", 0) + 1
+            if attempts > self.max_attempts:
+                error = record.get("error") or "claim abandoned too often"
+                record = dict(record, attempts=attempts - 1, error=error)
+                self._finish(item, "failed", record)
+                continue
+            _write(
+                claimed,
+                dict(
+                    record,
+                    worker=self.worker,
+                    attempts=attempts,
+                    claimed=dt.datetime.now().isoformat(),
+                ),
+            )
+            logger.debug("%s claimed %s.", self.worker, item)
+            return item
+        return None
+
+    def owns(self, item):
+        "bool: If the claim of `item` belongs to this worker."
+        record = _read(self._path("claimed", item))
+        return record is not None and record.get("worker") == self.worker
+
+    def heartbeat(self, item):
+        "Renew the lease of `item`."
+        try:
+            os.utime(str(self._path("claimed", item)))
+        except FileNotFoundError:
+            logger.warning("%s lost the claim of %s.", self.worker, item)
+
+    def requeue_stale(self):
+        """Put abandoned claims back into `pending`.
+
+        Returns
+        -------
+        list of str
+            The requeued image ids.
+        """
+        now = self.now()
+        requeued = []
+        for item in self.items("claimed"):
+            claimed = self._path("claimed", item)
+            try:
+                if now - claimed.stat().st_mtime <= self.lease:
+                    continue
+                os.rename(str(claimed), str(self._path("pending", item)))
+            except FileNotFoundError:
+                continue
+            requeued.append(item)
+        if requeued:
+            logger.warning("Requeued abandoned claims: %s", requeued)
+        return requeued
+
+    def _finish(self, item, state, record):
+        _write(self._path(state, item), dict(record, img_id=item, status=state))
+        try:
+            os.unlink(str(self._path("claimed", item)))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, item, record=None):
+        """Record the result of `item` and release it.
+
+        Returns
+        -------
+        bool
+            False if the claim had been lost to another worker, whose claim is
+            kept; the result is recorded anyway.
+        """
+        if not self.owns(item):
+            logger.warning("%s finished %s after losing the claim.", self.worker, item)
+            record = dict(record or {}, img_id=item, status="done")
+            _write(self._path("done", item), record)
+            return False
+        lease = _read(self._path("claimed", item)) or {}
+        self._finish(item, "done", dict(lease, **(record or {})))
+        return True
+
+    def fail(self, item, error, record=None):
+        """Record a failure of `item`, to try again or give up.
+
+        Images with fewer than `max_attempts` attempts go back to `pending`.
+        """
+        if not self.owns(item):
+            return
+        claimed = self._path("claimed", item)
+        lease = dict(_read(claimed) or {}, **(record or {}))
+        lease["error"] = error
+        if lease.get("attempts", 1) >= self.max_attempts:
+            self._finish(item, "failed", lease)
+            return
+        _write(claimed, lease)
+        try:
+            os.rename(str(claimed), str(self._path("pending", item)))
+        except FileNotFoundError:
+            pass
+
+    def retry_failed(self):
+        "Queue the failed images again, with fresh attempts."
+        return self.add(self.items("failed"), force=True)
+
+    def results(self):
+        """Records of the processed images.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per image in `done` or `failed`, with the worker, the
+            number of attempts, the start and wall time and the error.
+        """
+        records = [
+            _read(self._path(state, item))
+            for state in ("done", "failed")
+            for item in self.items(state)
+        ]
+        return pd.DataFrame([r for r in records if r is not None])
+
+    def work(self, func=calibrate, max_items=None, poll=30.0):
+        """Process images until the queue is empty.
+
+        Parameters
+        ----------
+        func : callable
+            Processes one image id. Exceptions mark the image as failed.
+        max_items : int, optional
+            Stop after this many images.
+        poll : float
+            Seconds to wait for claims of other workers to finish or expire,
+            when nothing is pending.
+
+        Returns
+        -------
+        int
+            Number of images processed by this worker.
+        """
+        heartbeat = _Heartbeat(self, self.heartbeat_interval)
+        heartbeat.start()
+        processed = 0
+        try:
+            while max_items is None or processed < max_items:
+                self.requeue_stale()
+                item = self.claim()
+                if item is None:
+                    if not self.items("claimed"):
+                        break
+                    time.sleep(poll)
+                    continue
+                heartbeat.items.add(item)
+                record = dict(worker=self.worker, start=dt.datetime.now().isoformat())
+                t0 = time.perf_counter()
+                try:
+                    func(item)
+                except Exception as e:
+                    logger.exception("%s failed on %s.", self.worker, item)
+                    record["wall"] = time.perf_counter() - t0
+                    self.fail(item, repr(e), record)
+                else:
+                    record["wall"] = time.perf_counter() - t0
+                    self.complete(item, dict(record, error=None))
+                finally:
+                    heartbeat.items.discard(item)
+                processed += 1
+        finally:
+            heartbeat.stopped.set()
+        logger.info("%s processed %i images.", self.worker, processed)
+        return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pyciss.workqueue",
+        description="Shared work queue to calibrate ISS images on many nodes.",
+    )
+    parser.add_argument("root", help="queue folder on the shared file system")
+    parser.add_argument("--lease", type=float, default=600.0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="queue image ids")
+    add.add_argument("img_ids", nargs="*", help="image ids, else read from stdin")
+    add.add_argument("--force", action="store_true", help="also finished ones")
+    work = commands.add_parser("work", help="calibrate until the queue is empty")
+    work.add_argument("--max-items", type=int)
+    commands.add_parser("status", help="print the number of images by state")
+    commands.add_parser("retry", help="queue the failed images again")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    queue = WorkQueue(args.root, lease=args.lease)
+    if args.command == "add":
+        img_ids = args.img_ids or sys.stdin.read().split()
+        print("Queued {} images.".format(queue.add(img_ids, force=args.force)))
+    elif args.command == "work":
+        queue.work(max_items=args.max_items)
+    elif args.command == "retry":
+        print("Queued {} images.".format(queue.retry_failed()))
+    print(queue.counts())
+
+
+if __name__ == "__main__":
+    main()
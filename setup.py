@@ -20,9 +20,14 @@ with open(path.join(here, 'README.rst'), encoding='utf-8') as f:
 setup(
     name=DISTNAME,
     version="0.12.6",
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
 
-    install_requires=['pandas', 'numpy', 'matplotlib', 'pysis', 'astropy', 'xarray', 'holoviews', 'hvplot', 'seaborn', 'tables', 'planetpy', 'scikit-image'],
+    install_requires=['pandas', 'numpy', 'matplotlib', 'pysis', 'astropy', 'xarray', 'holoviews', 'hvplot', 'seaborn', 'tables', 'planetpy', 'scikit-image', 'scipy'],
+    extras_require={
+        'dask': ['dask'],
+        'zarr': ['dask', 'zarr'],
+        'thumbnails': ['pillow'],
+    },
     setup_requires=['pytest-runner'],
     tests_require=['pytest'],
 
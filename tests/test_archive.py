@@ -0,0 +1,64 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyciss import archive, synthetic
+from pyciss.ringcube import RingCube
+
+pytest.importorskip("zarr")
+
+
+@pytest.fixture
+def cubes(tmp_path):
+    paths = []
+    for i, img_id in enumerate(['N1467345444', 'N1467345500', 'W1467345600']):
+        paths.append(
+            synthetic.write_cube(
+                tmp_path / f'{img_id}_1.cal.dst.map.cub',
+                synthetic.ring_image((40, 30), 130e6, 131e6, seed=i),
+                minlon=10.0 * i,
+                maxlon=10.0 * i + 5,
+                imagetime=dt.datetime(2008, 1, 1 + i),
+            )
+        )
+    return paths
+
+
+def test_export_and_read(tmp_path, cubes):
+    store = tmp_path / 'rings.zarr'
+    catalog = archive.export_cubes([str(p) for p in cubes[:2]], store, chunks=16)
+    assert list(catalog.index) == ['N1467345444_1', 'N1467345500_1']
+    # new cubes are added, exported ones skipped
+    catalog = archive.export_cubes([str(p) for p in cubes[1:]], store, chunks=16)
+    assert len(catalog) == 3
+
+    arch = archive.RingArchive(store)
+    assert len(arch) == 3
+    assert 'W1467345600_1' in arch
+    row = arch.catalog.loc['N1467345500_1']
+    assert row.minlon == 10.0 and row.maxlon == 15.0
+    assert row.minrad == 130.0 and row.maxrad == 131.0
+    assert row.litstatus == 'UNKNOWN'
+    assert row.imagetime == pd.Timestamp('2008-01-02', tz='UTC')
+    assert arch.query('minlon >= 10') == ['N1467345500_1', 'W1467345600_1']
+
+    ds = arch['N1467345444_1']
+    assert ds.img.chunks[ds.img.dims.index('radius')][0] == 16
+    expected = RingCube(str(cubes[0])).xdataset.compute()
+    np.testing.assert_array_equal(ds.img.values, expected.img.values)
+    np.testing.assert_allclose(ds.median_az.values, expected.median_az.values)
+    profiles = arch.profiles(['W1467345600_1'])
+    assert profiles['W1467345600_1'].dims == ('radius',)
+    with pytest.raises(KeyError):
+        arch['N1000000000_1']
+
+
+def test_catalog_roundtrip(tmp_path, cubes):
+    store = tmp_path / 'rings.zarr'
+    catalog = archive.export_cubes([str(cubes[0])], store)
+    archive.write_catalog(catalog.assign(resolution=1000.0), store)
+    read = archive.read_catalog(store)
+    assert read.resolution.tolist() == [1000.0]
+    assert read.imagetime.tolist() == pd.to_datetime(catalog.imagetime).tolist()
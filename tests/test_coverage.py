@@ -0,0 +1,67 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyciss import synthetic
+from pyciss.coverage import CoverageIndex, parse_times
+
+
+@pytest.fixture
+def coverage():
+    img_ids = ['N1000000003', 'W1000000001', 'N1000000002', 'N1000000004']
+    times = [
+        dt.datetime(2008, 5, 1),
+        dt.datetime(2007, 1, 1),
+        dt.datetime(2008, 1, 2, 3, 4, 5),
+        dt.datetime(2009, 1, 1),
+    ]
+    df = synthetic.cumulative_index_rows(
+        img_ids,
+        times,
+        minrads=[149000e3, 100000e3, 149990e3, 149000e3],
+        maxrads=[151000e3, 160000e3, 151000e3, 151000e3],
+        minlons=[350.0, 0.0, 10.0, 100.0],
+        maxlons=[20.0, 360.0, 30.0, 120.0],
+    )
+    resolution = pd.Series([0.5, 5.0, 0.8, 0.5], index=img_ids)
+    return CoverageIndex.from_dataframe(df, resolution)
+
+
+def test_parse_times():
+    times = parse_times(['2008-002T03:04:05.000Z', '2008-01-02T03:04:05'])
+    assert times[0] == times[1] == pd.Timestamp('2008-01-02 03:04:05').value
+
+
+def test_sorted_by_time(coverage):
+    assert list(coverage.file_id) == [
+        'W1000000001', 'N1000000002', 'N1000000003', 'N1000000004'
+    ]
+    np.testing.assert_array_equal(coverage.resolution, [5.0, 0.8, 0.5, 0.5])
+
+
+def test_covering(coverage):
+    found = coverage.covering(150000, 50, start='2008', end='2009')
+    assert list(found.file_id) == ['N1000000003']
+    found = coverage.covering(150000, 5, max_resolution=1, instrument='ISSNA')
+    assert list(found.file_id) == ['N1000000002', 'N1000000003', 'N1000000004']
+    assert coverage.covering(150000, 5, instrument='ISSXX').empty
+
+
+def test_longitude_wraps(coverage):
+    found = coverage.covering(150000, 50, longitude=(355, 5))
+    assert list(found.file_id) == ['W1000000001', 'N1000000003']
+    found = coverage.covering(150000, 50, longitude=15)
+    assert list(found.file_id) == ['W1000000001', 'N1000000003']
+
+
+def test_save_load(coverage, tmp_path, monkeypatch):
+    monkeypatch.setattr('pyciss.coverage.get_index_dir', lambda: tmp_path)
+    path = tmp_path / 'coverage_index.npz'
+    coverage.save(path)
+    loaded = CoverageIndex.load(path)
+    np.testing.assert_array_equal(loaded.time, coverage.time)
+    assert list(loaded.covering(150000, 5).file_id) == list(
+        coverage.covering(150000, 5).file_id
+    )
@@ -0,0 +1,45 @@
+import json
+import subprocess
+import sys
+
+# seconds for importing the modules batch workers use, in a fresh interpreter;
+# about three times what it takes on a laptop without the plotting libraries
+IMPORT_TIME_BUDGET = 3.0
+
+HEAVY_MODULES = [
+    'holoviews',
+    'hvplot',
+    'bokeh',
+    'matplotlib.pyplot',
+    'seaborn',
+    'skimage',
+    'astropy.visualization',
+    'IPython',
+    'ipywidgets',
+    'dask',
+]
+
+CODE = """
+import json, sys, time
+t0 = time.perf_counter()
+import pyciss
+import pyciss.ringcube, pyciss.index, pyciss.opusapi, pyciss.io
+print(json.dumps([time.perf_counter() - t0, sorted(sys.modules)]))
+"""
+
+
+def measure_import():
+    out = subprocess.run(
+        [sys.executable, '-c', CODE], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def test_no_plotting_libraries_imported():
+    _, modules = measure_import()
+    assert [m for m in HEAVY_MODULES if m in modules] == []
+
+
+def test_import_time_budget():
+    duration = min(measure_import()[0] for _ in range(2))
+    assert duration < IMPORT_TIME_BUDGET
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from pyciss import interactive
+
+
+def make_xarr(n_az=200):
+    return xr.DataArray(
+        np.arange(n_az * 100, dtype='float64').reshape(n_az, 100),
+        coords={'azimuth': np.linspace(0, 0.1 * (n_az - 1), n_az),
+                'radius': np.linspace(130, 130.99, 100)},
+        dims=('azimuth', 'radius'))
+
+
+def test_decimate_full_range():
+    data, bounds, clim = interactive.decimate(make_xarr(), width=50, height=40)
+    assert data.shape == (40, 50)
+    # pixel edges of 0.1 deg and 0.01 Mm pixels
+    assert bounds == pytest.approx((129.995, -0.05, 130.995, 19.95))
+    assert clim[0] < clim[1]
+
+
+def test_decimate_trims_partial_blocks():
+    data, bounds, clim = interactive.decimate(make_xarr(203), width=50, height=40)
+    # blocks of 6 azimuths, the last 5 of 203 do not fill a block
+    assert data.shape == (33, 50)
+    assert bounds[1::2] == pytest.approx((-0.05, 19.75))
+    assert data[-1, 0] == np.mean(np.arange(192, 198)[:, None] * 100 + [0, 1])
+
+
+def test_decimate_zoomed_keeps_full_resolution():
+    xarr = make_xarr()
+    data, bounds, clim = interactive.decimate(
+        xarr, x_range=(130.2, 130.3), y_range=(5, 6), width=50, height=40)
+    sub = xarr.sel(radius=slice(130.2, 130.3), azimuth=slice(5, 6))
+    assert np.array_equal(data, sub.values)
+    assert clim == tuple(np.percentile(sub.values, (0.1, 99)))
+
+
+def test_rasterized_image():
+    dmap = interactive.rasterized_image(make_xarr(), width=50, height=40)
+    img = dmap[()]
+    assert img.kdims == ['radius', 'azimuth']
+    assert img.data.shape == (40, 50)
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from pyciss import inventory
+
+
+@pytest.fixture
+def dbroot(tmp_path):
+    for img_id in ['N1467345444', 'W1467345444']:
+        (tmp_path / img_id).mkdir()
+        (tmp_path / img_id / (img_id + '_1.IMG')).write_bytes(b'1234')
+        (tmp_path / img_id / (img_id + '_1.LBL')).write_bytes(b'12')
+    (tmp_path / 'N1467345444' / 'N1467345444_1.cal.dst.map.cub').write_bytes(b'1')
+    (tmp_path / 'notes.txt').write_text('not an image folder')
+    return tmp_path
+
+
+def test_parse_product_name():
+    assert inventory.parse_product_name('N1467345444_1.cal.dst.map.cub') == \
+        ('N1467345444', '1', 'cubepath')
+    assert inventory.parse_product_name('N1467345444_2_CALIB.IMG') == \
+        ('N1467345444', '2', 'calib_img')
+    assert inventory.parse_product_name('N1467345444_1.xyz') == \
+        ('N1467345444', '1', None)
+    assert inventory.parse_product_name('notes.txt') is None
+
+
+def test_refresh_and_queries(dbroot):
+    with inventory.DBInventory(dbroot) as inv:
+        assert inv.refresh() == 2
+        assert sorted(inv.img_ids) == ['N1467345444', 'W1467345444']
+        assert inv.missing('cubepath') == ['W1467345444']
+        stats = inv.stats()
+        assert stats.raw_image[0] == 2
+        assert stats.cubepath[0] == 1
+        assert stats.tif[0] == 0
+        assert inv.products('N1467345444')['size'].sum() == 7
+
+
+def test_refresh_is_incremental(dbroot):
+    with inventory.DBInventory(dbroot) as inv:
+        inv.refresh()
+        assert inv.refresh() == 0
+        folder = dbroot / 'W1467345444'
+        (folder / 'W1467345444_1.cal.dst.map.cub').write_bytes(b'1')
+        # make sure the folder mtime differs from the stored one
+        os.utime(folder, (0, 0))
+        assert inv.refresh() == 1
+        assert inv.missing('cubepath') == []
+        assert inv.refresh(full=True) == 2
+
+
+def test_removed_folders(dbroot):
+    with inventory.DBInventory(dbroot) as inv:
+        inv.refresh()
+        folder = dbroot / 'W1467345444'
+        for p in folder.iterdir():
+            p.unlink()
+        folder.rmdir()
+        inv.refresh()
+        assert inv.img_ids == ['N1467345444']
+        assert set(inv.products().img_id) == {'N1467345444'}
@@ -1,9 +1,10 @@
 import configparser
 from pathlib import Path
 
+import numpy as np
 import pytest
 
-from pyciss import io
+from pyciss import io, synthetic
 
 
 @pytest.fixture(scope='module')
@@ -107,3 +108,113 @@ class TestPathManager:
     # continue here with other keys of the `d` dictionary
     # in PathManager
     ###
+
+    def test_savedir(self, dbroot):
+        pm = io.PathManager('N1234', savedir='/other/db')
+        assert pm.basepath == Path('/other/db/N1234')
+
+    def test_init_does_no_io(self, monkeypatch):
+        def fail():
+            raise AssertionError("get_db_root called")
+        monkeypatch.setattr(io, 'get_db_root', fail)
+        pm = io.PathManager('N1628676218_16')
+        assert pm.img_id == 'N1628676218'
+        assert pm.version == '16'
+
+    def test_slots(self, pm):
+        with pytest.raises(AttributeError):
+            pm.some_attribute = 1
+
+    def test_version_from_database(self, tmpdir):
+        folder = Path(str(tmpdir)) / 'N1628676218'
+        folder.mkdir()
+        (folder / 'N1628676218_2.IMG').touch()
+        (folder / 'N1628676218_2_CALIB.IMG').touch()
+        pm = io.PathManager('N1628676218', savedir=str(tmpdir))
+        assert pm.version == '2'
+        assert pm.raw_image == folder / 'N1628676218_2.IMG'
+        assert 'raw_image: {}'.format(pm.raw_image) in str(pm)
+        assert 'cubepath: not found.' in str(pm)
+
+
+def test_get_db_root_is_cached(monkeypatch, tmpdir, configpath):
+    monkeypatch.setattr(io, 'get_configpath', lambda: Path(str(configpath)))
+    io.set_database_path(str(tmpdir / 'db'))
+    assert io.get_db_root() == Path(str(tmpdir / 'db'))
+    calls = []
+    monkeypatch.setattr(io, 'get_config', lambda: calls.append(1))
+    io.get_db_root()
+    assert calls == []
+    io.clear_db_root_cache()
+
+
+def write_tiled_cube(path, data, tile=(16, 32)):
+    "Write Real pixels as a Tile cube, padding the last tiles."
+    tl, ts = tile
+    lines, samples = data.shape
+    rows, cols = -(-lines // tl), -(-samples // ts)
+    padded = np.zeros((rows * tl, cols * ts), dtype='<f4')
+    padded[:lines, :samples] = data
+    tiles = padded.reshape(rows, tl, cols, ts).transpose(0, 2, 1, 3)
+    label = synthetic.CUBE_LABEL.replace(
+        'Format      = BandSequential',
+        f'Format      = Tile\n    TileSamples = {ts}\n    TileLines   = {tl}',
+    ).format(
+        start_byte=synthetic.START_BYTE,
+        start_byte_minus_one=synthetic.START_BYTE - 1,
+        samples=samples,
+        lines=lines,
+        instrument_id='ISSNA',
+        imagetime='2008-01-01T00:00:00.000',
+        pixres=500.0,
+        midrad=130.5e6,
+        midlon=5.0,
+        minrad=130e6,
+        maxrad=131e6,
+        minlon=0.0,
+        maxlon=10.0,
+    )
+    with open(str(path), 'wb') as f:
+        f.write(label.encode('ascii').ljust(synthetic.START_BYTE - 1, b' '))
+        f.write(tiles.tobytes())
+    return path
+
+
+def test_read_cube_img_double(tmp_path):
+    data = synthetic.ring_image((20, 30), seed=3).astype('<f8')
+    path = synthetic.write_cube(tmp_path / 'double.cub', data)
+    data[1, :4] = np.frombuffer(bytes.fromhex('fbffffffffffefff'), dtype='<f8')[0]
+    label = path.read_bytes()[: synthetic.START_BYTE - 1].rstrip()
+    label = label.replace(b'Type       = Real', b'Type       = Double')
+    with path.open('wb') as f:
+        f.write(label.ljust(synthetic.START_BYTE - 1, b' '))
+        f.write(data.tobytes())
+    img = io.read_cube_img(path)
+    assert np.isnan(img[1, :4]).all()
+    np.testing.assert_allclose(img[2:], data[2:])
+
+
+def test_mask_special_pixels_copies():
+    raw = np.array([1.0, -np.finfo('f8').max, 3.0])
+    img = io.mask_special_pixels(raw, 'Double')
+    assert np.isnan(img[1])
+    assert raw[1] == -np.finfo('f8').max
+
+
+@pytest.mark.parametrize('tiled', [False, True])
+def test_read_cube_img_specials(tmp_path, tiled):
+    data = synthetic.ring_image((40, 70), seed=2)
+    his = np.frombuffer(bytes.fromhex('feff7fff'), dtype='<f4')[0]
+    data[0, :5] = his
+    if tiled:
+        path = write_tiled_cube(tmp_path / 'tiled.cub', data)
+    else:
+        path = synthetic.write_cube(tmp_path / 'bsq.cub', data)
+    img = io.read_cube_img(path)
+    special = (data == synthetic.ISIS_NULL) | (data == his)
+    assert img.shape == data.shape
+    assert np.isnan(img[special]).all()
+    np.testing.assert_allclose(img[~special], data[~special])
+    lazy = io.read_cube_img(path, chunks=16)
+    assert lazy.chunks[0][0] == 16
+    np.testing.assert_array_equal(lazy.compute(), img)
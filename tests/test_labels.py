@@ -0,0 +1,79 @@
+import pytest
+
+from pyciss import io, labels, synthetic
+
+PDS_LABEL = """PDS_VERSION_ID = PDS3
+
+/* FILE FORMAT AND LENGTH */
+RECORD_TYPE = FIXED_LENGTH
+RECORD_BYTES = 1048
+FILE_RECORDS = 1028
+^IMAGE_HEADER = ("N1454725799_1.IMG",1)
+INSTRUMENT_NAME = "IMAGING SCIENCE SUBSYSTEM - NARROW ANGLE"
+INST_CMPRS_TYPE = LOSSLESS
+TARGET_NAME = "SATURN"
+BAND_BIN_CENTER = (651.065, 750.0)
+EXPOSURE_DURATION = 1200.000000 <ms>
+DESCRIPTION = "A long description
+   spanning two lines"
+OBJECT = IMAGE
+  LINES = 1024
+  LINE_SAMPLES = 1024
+  SAMPLE_BITS = 16
+END_OBJECT = IMAGE
+END
+"""
+
+
+def test_parse_pds_label():
+    label = labels.Label(PDS_LABEL)
+    assert label['INST_CMPRS_TYPE'] == 'LOSSLESS'
+    assert label['target_name'] == 'SATURN'
+    assert label['BAND_BIN_CENTER'] == (651.065, 750.0)
+    assert label['EXPOSURE_DURATION'] == 1200.0
+    assert label['DESCRIPTION'] == 'A long description spanning two lines'
+    assert label['^IMAGE_HEADER'] == ('N1454725799_1.IMG', 1)
+    assert label.get('LINES', group='IMAGE') == 1024
+    assert label.get('LINES', group='OTHER') is None
+    assert label.to_dict()['IMAGE/SAMPLE_BITS'] == 16
+
+
+def test_is_lossy(tmp_path):
+    paths = []
+    for i, kind in enumerate(['LOSSLESS', 'LOSSY']):
+        path = tmp_path / f'N100000000{i}_1.LBL'
+        path.write_text(PDS_LABEL.replace('LOSSLESS', kind))
+        paths.append(path)
+    assert not io.is_lossy(paths[0])
+    assert io.is_lossy(paths[1])
+    assert list(io.compression_types(paths, max_workers=2)) == ['LOSSLESS', 'LOSSY']
+
+
+def test_patch_detached_label(tmp_path):
+    path = tmp_path / 'N1454725799_1.LBL'
+    path.write_text(PDS_LABEL)
+    labels.patch_label(path, {'TARGET_NAME': '"S RINGS"', 'LINES': 512})
+    label = labels.read_label(path)
+    assert label['TARGET_NAME'] == 'S RINGS'
+    assert label['LINES'] == 512
+    assert path.read_text() == PDS_LABEL.replace('"SATURN"', '"S RINGS"').replace(
+        'LINES = 1024', 'LINES = 512'
+    )
+
+
+def test_patch_cube_in_place(tmp_path):
+    data = synthetic.ring_image((20, 30), seed=0)
+    cube = synthetic.write_cube(tmp_path / 'a.cub', data, 130e6, 131e6, 0.0, 10.0)
+    before = cube.read_bytes()
+    assert labels.read_label(cube).get('InstrumentId', group='Instrument') == 'ISSNA'
+    labels.patch_label(cube, {'TargetName': 'Titan'}, group='Instrument')
+    assert labels.read_label(cube).get('TargetName', group='Instrument') == 'Titan'
+    after = cube.read_bytes()
+    assert len(after) == len(before)
+    assert after[synthetic.START_BYTE - 1:] == before[synthetic.START_BYTE - 1:]
+    assert io.read_cube_label(cube)['IsisCube']['Instrument']['TargetName'] == 'Titan'
+
+    errors = labels.patch_labels([cube], {'TargetName': 'x' * 70000}, group='Instrument')
+    assert 'does not fit' in errors[str(cube)]
+    with pytest.raises(KeyError):
+        labels.patch_label(cube, {'NoSuchKey': 1})
@@ -0,0 +1,113 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyciss import opusapi, synthetic
+from pyciss.localopus import LocalIndex, LocalOPUS, normalize_target, product_urls
+
+
+@pytest.fixture
+def index_rows():
+    img_ids = ['N1000000002', 'W1000000001', 'N1000000003', 'N1000000004']
+    times = [
+        dt.datetime(2008, 1, 2),
+        dt.datetime(2007, 1, 1),
+        dt.datetime(2008, 3, 1),
+        dt.datetime(2008, 4, 1),
+    ]
+    df = synthetic.cumulative_index_rows(
+        img_ids, times, [1e8] * 4, [1.1e8] * 4, [0.0] * 4, [10.0] * 4
+    )
+    df.loc[2, 'TARGET_NAME'] = 'TITAN'
+    # a moon image with ring resolutions in the ring summary
+    df.loc[3, 'TARGET_NAME'] = 'PAN'
+    resolution = pd.Series([0.4, 3.0, 0.2], index=img_ids[:2] + img_ids[3:])
+    return df, resolution
+
+
+@pytest.fixture
+def opus(index_rows):
+    index = LocalIndex.from_dataframe(*index_rows)
+    return LocalOPUS(silent=True, index=index)
+
+
+def test_normalize_target():
+    assert normalize_target('S+RINGS') == normalize_target('s_rings') == 'S RINGS'
+
+
+def test_product_urls():
+    urls = product_urls('COISS_2001', 'data/1454725799_1455008789/N1454725799_1.LBL')
+    assert urls['coiss-raw'][0] == (
+        'https://pds-rings.seti.org/volumes/COISS_2xxx/COISS_2001/'
+        'data/1454725799_1455008789/N1454725799_1.IMG'
+    )
+    assert urls['coiss-calib'][1].endswith('N1454725799_1_CALIB.LBL')
+
+
+def test_get_between_times(opus):
+    opus.get_between_times('2008-01-01', dt.datetime(2008, 12, 31))
+    assert [o.img_id for o in opus.obsids] == [
+        'N1000000002',
+        'N1000000003',
+        'N1000000004',
+    ]
+    opus.get_between_times('2007-01-01', '2008-12-31', target='S+RINGS')
+    assert [o.img_id for o in opus.obsids] == ['W1000000001', 'N1000000002']
+    obsid = opus.obsids[1]
+    assert obsid.number == '1'
+    assert obsid.raw_urls[0].endswith('/N1000000002_1.IMG')
+    assert obsid.medium_img_url.startswith('https://pds-rings.seti.org/browse/')
+
+
+def test_get_between_resolutions(opus):
+    opus.get_between_resolutions('', '0.5')
+    assert [o.img_id for o in opus.obsids] == ['N1000000002']
+    np.testing.assert_array_equal(opus.results.resolution, [0.4])
+
+
+def test_get_between_resolutions_matches_api(opus, index_rows, monkeypatch):
+    df, resolution = index_rows
+
+    class Response(object):
+        "Files response of the OPUS API for the index rows matching the query."
+        status_code = 200
+
+        def __init__(self, params):
+            query = dict(item.split('=', 1) for item in params.split('&'))
+            img_ids = df.FILE_SPECIFICATION_NAME.str.split('/').str[-1].str[:11]
+            res = resolution.reindex(img_ids).to_numpy()
+            rows = df.TARGET_NAME.map(normalize_target).to_numpy() == normalize_target(
+                query['target']
+            )
+            if query['projectedradialresolution1']:
+                rows &= res >= float(query['projectedradialresolution1'])
+            if query['projectedradialresolution2']:
+                rows &= res <= float(query['projectedradialresolution2'])
+            self.data = {
+                f'co-iss-{img_id.lower()}': product_urls(
+                    row.VOLUME_ID, row.FILE_SPECIFICATION_NAME
+                )
+                for img_id, row in zip(img_ids[rows], df[rows].itertuples())
+            }
+
+        def json(self):
+            return dict(data=self.data)
+
+    monkeypatch.setattr(opusapi.requests, 'get', lambda url, params: Response(params))
+    api = opusapi.OPUS(silent=True)
+    for res1, res2 in [('', '0.5'), ('0.3', ''), ('', '')]:
+        api.get_between_resolutions(res1, res2)
+        opus.get_between_resolutions(res1, res2)
+        assert sorted(o.img_id for o in opus.obsids) == sorted(
+            o.img_id.upper() for o in api.obsids
+        )
+    assert 'N1000000004' not in [o.img_id for o in opus.obsids]
+    opus.get_between_resolutions('', '0.5', target=None)
+    assert [o.img_id for o in opus.obsids] == ['N1000000002', 'N1000000004']
+
+
+def test_query_image_id(opus):
+    assert opus.query_image_id('N1000000003_1')[0].img_id == 'N1000000003'
+    assert opus.query_image_id('N1999999999') == []
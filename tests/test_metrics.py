@@ -0,0 +1,83 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from pyciss.metrics import StageRecorder
+
+
+def run_stage(recorder, tmp_path, name='cisscal', fail=False, megabytes=0):
+    out = tmp_path / f'N1234567890_1.{name}.cub'
+    with recorder.stage('N1234567890', name, out) as stage:
+        code = (
+            'import sys; open(sys.argv[1], "wb").write(bytes(1000)); '
+            f'sum(range(10**6)); b = bytearray({megabytes} << 20)'
+        )
+        stage.run(subprocess.run, [sys.executable, '-c', code, str(out)], check=True)
+        if fail:
+            raise RuntimeError('ISIS failed')
+
+
+def test_stage_records(tmp_path):
+    recorder = StageRecorder()
+    # above the RSS of this process, which a forked child starts with
+    megabytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024 + 150
+    run_stage(recorder, tmp_path, megabytes=megabytes)
+    with pytest.raises(RuntimeError):
+        run_stage(recorder, tmp_path, 'dstripe', fail=True)
+    df = recorder.to_dataframe()
+    assert df.stage.tolist() == ['cisscal', 'dstripe']
+    assert df.status.tolist() == ['ok', 'failed']
+    assert (df.output_size == 1000).all()
+    assert (df.wall > 0).all()
+    assert (df.cpu > 0).all()
+    # the peak of each stage, not of all processes so far
+    assert df.max_rss[0] > df.max_rss[1] + (100 << 20)
+    assert df.max_rss[0] >= megabytes << 20
+    assert df.max_rss[1] > 0
+    assert df['product'][0] == 'N1234567890_1.cisscal.cub'
+    summary = recorder.summary()
+    assert summary.loc['dstripe', 'failed'] == 1
+    assert summary.loc['cisscal', 'runs'] == 1
+    assert summary.loc['cisscal', 'max_rss'] == df.max_rss[0]
+
+
+def test_stage_run_errors(tmp_path):
+    recorder = StageRecorder()
+    with pytest.raises(subprocess.CalledProcessError):
+        with recorder.stage('N1234567890', 'cisscal') as stage:
+            stage.run(subprocess.run, [sys.executable, '-c', 'exit(3)'], check=True)
+    with pytest.raises(RuntimeError, match='died'):
+        with recorder.stage('N1234567890', 'dstripe') as stage:
+            stage.run(os._exit, 1)
+    # nothing run through the stage
+    with recorder.stage('N1234567890', 'isis2std'):
+        pass
+    df = recorder.to_dataframe()
+    assert df.status.tolist() == ['failed', 'failed', 'ok']
+    assert df.cpu[0] > 0
+    assert df[['cpu', 'max_rss']].iloc[1:].isna().all().all()
+
+
+def test_reports(tmp_path):
+    recorder = StageRecorder()
+    run_stage(recorder, tmp_path)
+    run_stage(recorder, tmp_path)
+    recorder.write_json(tmp_path / 'run.json')
+    report = json.loads((tmp_path / 'run.json').read_text())
+    assert report['n_images'] == 1
+    assert len(report['stages']) == 2
+    recorder.write_csv(tmp_path / 'run.csv')
+    assert len(pd.read_csv(tmp_path / 'run.csv')) == 2
+    recorder.write_prometheus(tmp_path / 'run.prom')
+    text = (tmp_path / 'run.prom').read_text()
+    assert '# TYPE pyciss_stage_runs_total counter' in text
+    assert 'pyciss_stage_runs_total{stage="cisscal"} 2' in text
+    assert 'pyciss_stage_output_bytes_total{stage="cisscal"} 2000' in text
+    assert 'max_rss' in pd.read_csv(tmp_path / 'run.csv').columns
+    assert '# TYPE pyciss_stage_max_rss_bytes gauge' in text
+    assert 'pyciss_stage_max_rss_bytes{stage="cisscal"} ' in text
@@ -0,0 +1,75 @@
+import pytest
+
+from pyciss.io import expected_file_bytes
+from pyciss.opusapi import OPUSObsID
+from pyciss.planner import check_file, plan_downloads
+
+LABEL = 'PDS_VERSION_ID = PDS3\nRECORD_TYPE = FIXED_LENGTH\nRECORD_BYTES = 10\n' \
+    'FILE_RECORDS = 3\n^IMAGE = ("{}_1.IMG", 2)\nOBJECT = IMAGE\nEND_OBJECT = IMAGE\nEND\n'
+
+
+def obsid(img_id):
+    base = f'https://pds-rings.seti.org/volumes/COISS_2xxx/COISS_2001/data/x/{img_id}_1'
+    calib = base.replace('volumes', 'calibrated') + '_CALIB'
+    return OPUSObsID((
+        f'co-iss-{img_id}',
+        {
+            'coiss-raw': [base + '.IMG', base + '.LBL'],
+            'coiss-calib': [calib + '.IMG', calib + '.LBL'],
+        },
+    ))
+
+
+@pytest.fixture
+def db(tmp_path):
+    for img_id, nbytes in [('N1000000001', 30), ('N1000000002', 20)]:
+        folder = tmp_path / img_id
+        folder.mkdir()
+        (folder / f'{img_id}_1.LBL').write_text(LABEL.format(img_id))
+        (folder / f'{img_id}_1.IMG').write_bytes(b'x' * nbytes)
+    return tmp_path
+
+
+def test_expected_file_bytes(db):
+    assert expected_file_bytes(db / 'N1000000001' / 'N1000000001_1.LBL') == 30
+    assert expected_file_bytes(db / 'missing.LBL') is None
+
+
+def test_plan_downloads(db):
+    obsids = [obsid('N1000000003'), obsid('N1000000001'), obsid('N1000000002')]
+    # duplicates are planned once
+    plan = plan_downloads(obsids + obsids[:1], savedir=db)
+    df = plan.manifest
+    assert len(df) == 6
+    assert list(df.status) == [
+        'missing', 'missing', 'complete', 'complete', 'complete', 'incomplete'
+    ]
+    # priority of the input order, labels first
+    assert [p.name for _, p in plan.jobs] == [
+        'N1000000003_1.LBL', 'N1000000003_1.IMG', 'N1000000002_1.IMG'
+    ]
+    assert plan.estimated_bytes == 14_000 + 2_125_000 + 30
+    assert plan.summary(throughput=1e6)['seconds'] == pytest.approx(2.13903)
+
+
+def test_plan_calibrated(db):
+    plan = plan_downloads([obsid('N1000000001')], raw=False, calib=True, savedir=db)
+    assert [p.name for _, p in plan.jobs] == [
+        'N1000000001_1_CALIB.LBL', 'N1000000001_1_CALIB.IMG'
+    ]
+
+
+def test_manifest_roundtrip(db, tmp_path):
+    plan = plan_downloads([obsid('N1000000002')], savedir=db)
+    plan.write(tmp_path / 'manifest.csv')
+    read = type(plan).read(tmp_path / 'manifest.csv')
+    assert read.jobs == plan.jobs
+
+
+def test_image_without_label_is_fetched(db):
+    folder = db / 'N1000000001'
+    (folder / 'N1000000001_1.LBL').unlink()
+    image = folder / 'N1000000001_1.IMG'
+    assert check_file(image, 'image', folder / 'N1000000001_1.LBL')[0] == 'unverified'
+    plan = plan_downloads([obsid('N1000000001')], savedir=db)
+    assert [p.name for _, p in plan.jobs] == ['N1000000001_1.LBL', 'N1000000001_1.IMG']
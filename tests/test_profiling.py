@@ -0,0 +1,41 @@
+import numpy as np
+
+from pyciss import profiling
+
+
+@profiling.profiled
+def allocate(n):
+    return np.ones(n)
+
+
+@profiling.profiled
+def outer(n):
+    allocate(n)
+    return allocate(n // 2)
+
+
+def test_disabled_by_default():
+    profiling.stats.reset()
+    outer(10)
+    assert profiling.stats.data == {}
+
+
+def test_profile_counts_calls_and_bytes():
+    with profiling.profile() as stats:
+        outer(1_000_000)
+    assert not profiling.is_enabled()
+    df = stats.report()
+    name = __name__ + '.allocate'
+    assert df.loc[name, 'calls'] == 2
+    assert df.loc[name, 'bytes'] >= 8_000_000 + 4_000_000
+    # the first array is freed, so the peak of outer is that of the first call
+    assert df.loc[__name__ + '.outer', 'bytes'] >= 8_000_000
+    assert df.loc[__name__ + '.outer', 'total'] >= df.loc[name, 'total']
+    assert list(df.columns) == ['calls', 'total', 'mean', 'bytes', 'mean_bytes']
+
+
+def test_profile_time_only():
+    with profiling.profile(trace_memory=False) as stats:
+        allocate(1000)
+    assert stats.data[__name__ + '.allocate'][0] == 1
+    assert stats.data[__name__ + '.allocate'][2] == 0
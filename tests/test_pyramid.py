@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from pyciss import pyramid, synthetic
+
+
+@pytest.fixture
+def cubepath(tmp_path, monkeypatch):
+    data = np.random.rand(512, 300)
+    monkeypatch.setattr(
+        pyramid, 'read_cube_img', lambda fname, rows=None: data[rows or slice(None)]
+    )
+    monkeypatch.setattr(pyramid, 'read_cube_label', lambda fname: None)
+    monkeypatch.setattr(
+        pyramid, 'label_grid_key', lambda label: (130.0, 131.0, 512, 10.0, 20.0, 300)
+    )
+    path = tmp_path / 'N1234567890_1.cal.dst.map.cub'
+    path.write_bytes(b'')
+    return path
+
+
+def test_build_pyramid(cubepath):
+    path = pyramid.build_pyramid(cubepath, min_size=64)
+    assert path.name == 'N1234567890_1.cal.dst.map.pyramid.npz'
+    pyr = pyramid.Pyramid(cubepath)
+    assert pyr.shape == (512, 300)
+    assert pyr.extent == [10.0, 20.0, 130.0, 131.0]
+    # 256, 128, 64 rows
+    assert pyr.n_levels == 4
+    assert pyr.read_level(3).shape == pyr.level_shape(3) == (64, 38)
+    assert not pyr.is_stale
+
+
+def test_choose_level(cubepath):
+    pyramid.build_pyramid(cubepath)
+    pyr = pyramid.Pyramid(cubepath)
+    assert pyr.choose_level() == 0
+    assert pyr.choose_level(npix=100) == 2
+    assert pyr.choose_level(npix=1000) == 0
+    # a quarter of the radius range needs 4 times the resolution
+    assert pyr.choose_level(130.0, 130.25, npix=100) == 0
+    assert pyr.choose_level(130.0, 130.25, npix=30) == 2
+
+
+def test_read_crops_radius(cubepath):
+    pyramid.build_pyramid(cubepath)
+    data, extent = pyramid.Pyramid(cubepath).read(130.5, 131.0, npix=60)
+    # level 2, blocks of 4 rows of 1/512 Mm
+    assert data.shape[0] == 64
+    assert extent[2:] == [130.5, 131.0]
+    with pytest.raises(ValueError):
+        pyramid.Pyramid(cubepath).read(140, 141)
+
+
+def test_read_level0_rows(tmp_path):
+    data = synthetic.ring_image((100, 40), 130e6, 131e6, seed=4)
+    cubepath = synthetic.write_cube(tmp_path / 'N1234567890_1.cal.dst.map.cub', data)
+    pyramid.build_pyramid(cubepath, min_size=16)
+    pyr = pyramid.Pyramid(cubepath)
+    expected, extent = pyramid.crop_radius(
+        pyr.read_level(0), pyr.extent, 130.2, 130.5
+    )
+    assert pyramid.radius_rows(pyr.extent, 100, 130.2, 130.5)[0] == slice(20, 50)
+    data0, extent0 = pyr.read(130.2, 130.5)
+    assert data0.shape == (30, 40)
+    np.testing.assert_array_equal(data0, expected)
+    assert extent0 == pytest.approx(extent)
+
+
+def test_crop_radius_block_centres():
+    data = np.arange(3.0)[:, None]
+    # 10 rows of 0.1 Mm in blocks of 4, the last block has 2 rows
+    rows, extent = pyramid.crop_radius(data, [0, 1, 130.0, 131.0], 130.15, 130.9, 4, 10)
+    # block centres 130.2, 130.6 and 130.9
+    assert rows[:, 0].tolist() == [0, 1, 2]
+    assert extent[2:] == pytest.approx([130.0, 131.0])
+    rows, extent = pyramid.crop_radius(data, [0, 1, 130.0, 131.0], 130.3, 130.85, 4, 10)
+    assert rows[:, 0].tolist() == [1]
+    assert extent[2:] == pytest.approx([130.4, 130.8])
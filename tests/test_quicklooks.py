@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from pyciss import quicklooks, synthetic
+
+
+@pytest.fixture
+def cube(tmp_path):
+    return synthetic.write_cube(
+        tmp_path / 'N1467345444_1.cal.dst.map.cub', synthetic.ring_image((40, 60), seed=0)
+    )
+
+
+def no_pool(*args, **kwargs):
+    raise AssertionError("processes=1 must not start a pool")
+
+
+def test_is_up_to_date(cube):
+    png = quicklooks.quicklook_path(cube)
+    assert png.name == 'N1467345444_1.png'
+    assert not quicklooks.is_up_to_date(cube)
+    png.write_bytes(b'')
+    mtime = cube.stat().st_mtime
+    os.utime(str(png), (mtime - 10, mtime - 10))
+    assert not quicklooks.is_up_to_date(cube)
+    os.utime(str(png), (mtime + 10, mtime + 10))
+    assert quicklooks.is_up_to_date(cube)
+    assert not quicklooks.is_up_to_date(cube.parent / 'missing.cub')
+
+
+def test_render_skips_and_forces(cube, monkeypatch):
+    monkeypatch.setattr(quicklooks.workers, 'pool', no_pool)
+    df = quicklooks.render_quicklooks([str(cube)], processes=1)
+    assert df.status.tolist() == ['rendered']
+    png = quicklooks.quicklook_path(cube)
+    assert df.result[0] == str(png)
+    assert png.read_bytes().startswith(b'\x89PNG')
+    # the renderer of this process did the work
+    assert quicklooks._renderer.kind == 'imshow'
+
+    df = quicklooks.render_quicklooks([str(cube)], processes=1)
+    assert df.status.tolist() == ['skipped']
+    df = quicklooks.render_quicklooks([str(cube)], processes=1, force=True)
+    assert df.status.tolist() == ['rendered']
+
+
+def test_failing_cube_is_reported(cube, tmp_path, monkeypatch):
+    monkeypatch.setattr(quicklooks.workers, 'pool', no_pool)
+    broken = tmp_path / 'N1467345500_1.cal.dst.map.cub'
+    broken.write_bytes(b'not a cube')
+    df = quicklooks.render_quicklooks(
+        [str(broken), str(cube)], processes=1, outdir=tmp_path / 'png'
+    )
+    assert df.status.tolist() == ['failed', 'rendered']
+    assert df.result[0]
+    assert (tmp_path / 'png' / 'N1467345444_1.png').exists()
+
+
+@pytest.mark.parametrize('budget', [None, False])
+def test_render_with_pool(cube, tmp_path, monkeypatch, budget):
+    other = synthetic.write_cube(
+        tmp_path / 'N1467345500_1.cal.dst.map.cub', synthetic.ring_image((30, 50), seed=1)
+    )
+    png = quicklooks.quicklook_path(cube)
+    png.write_bytes(b'')
+    mtime = cube.stat().st_mtime + 10
+    os.utime(str(png), (mtime, mtime))
+    sized = []
+
+    def estimate_memory(path):
+        sized.append(str(path))
+        return 2**20
+
+    monkeypatch.setattr(quicklooks, 'estimate_memory', estimate_memory)
+    df = quicklooks.render_quicklooks(
+        [str(cube), str(other)], processes=2, budget=budget
+    )
+    assert df.img.tolist() == [str(cube), str(other)]
+    assert df.status.tolist() == ['skipped', 'rendered']
+    assert quicklooks.quicklook_path(other).read_bytes().startswith(b'\x89PNG')
+    # the up-to-date cube is not sized
+    assert sized == ([] if budget is False else [str(other)])
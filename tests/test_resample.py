@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from astropy import units as u
+
+from pyciss import resample
+
+
+class FakeCube:
+    def __init__(self, img, minrad, maxrad, minlon=0, maxlon=10):
+        self.img = img
+        self.minrad = minrad * u.Mm
+        self.maxrad = maxrad * u.Mm
+        self.minlon = minlon * u.degree
+        self.maxlon = maxlon * u.degree
+        self.image_id = 'N1234'
+        self.imagetime = np.datetime64('2008-01-01')
+
+
+def test_interpolation_weights():
+    weights, inside = resample.interpolation_weights([0, 1, 2], [-1, 0.5, 2, 3])
+    assert inside.tolist() == [False, True, True, False]
+    assert weights.shape == (4, 3)
+    assert np.allclose(weights @ np.array([0, 10, 20]), [0, 5, 20, 0])
+
+
+def test_interpolation_weights_on_samples_ignore_nan_neighbours():
+    weights, inside = resample.interpolation_weights([0, 1, 2], [0, 1, 2])
+    assert weights.nnz == 3
+    out = weights @ np.array([np.nan, 10, np.nan])
+    np.testing.assert_array_equal(out, [np.nan, 10, np.nan])
+
+
+def test_interpolation_weights_need_two_samples():
+    with pytest.raises(ValueError):
+        resample.interpolation_weights([1], [1])
+
+
+def test_resample_matches_np_interp():
+    radius = np.linspace(130, 131, 11)
+    img = np.repeat(radius[:, np.newaxis], 4, axis=1)
+    cube = FakeCube(img, 130, 131)
+    resampler = resample.GridResampler(np.linspace(129.9, 131.1, 25), [2.5, 7.5])
+    out = resampler.resample(cube)
+    assert out.shape == (25, 2)
+    expected = np.interp(resampler.radius, radius, radius)
+    covered = (resampler.radius >= 130) & (resampler.radius <= 131)
+    assert np.allclose(out[covered, 0], expected[covered])
+    assert np.isnan(out[~covered]).all()
+
+
+def test_weights_are_reused():
+    resampler = resample.GridResampler(np.linspace(130, 131, 5))
+    cubes = [FakeCube(np.ones((11, 4)), 130, 131) for _ in range(3)]
+    stacked = resampler.stack(cubes)
+    assert stacked.shape == (3, 4, 5)
+    assert len(resampler.weights_cache) == 1
+
+
+def test_profile_stack_with_different_widths():
+    resampler = resample.GridResampler(np.linspace(130, 131, 5))
+    cubes = [FakeCube(np.ones((11, 4)), 130, 131),
+             FakeCube(np.ones((21, 8)), 129, 132)]
+    profiles = resampler.profile_stack(cubes)
+    assert profiles.dims == ('image', 'radius')
+    assert np.allclose(profiles.values, 1)
+
+
+def test_label_grid_key():
+    label = {'IsisCube': {
+        'Core': {'Dimensions': {'Lines': 11, 'Samples': 4}},
+        'Mapping': {'MinimumRingRadius': 130e6, 'MaximumRingRadius': 131e6,
+                    'MinimumRingLongitude': 0.0, 'MaximumRingLongitude': 10.0}}}
+    cube = FakeCube(np.ones((11, 4)), 130, 131)
+    assert resample.label_grid_key(label) == resample.cube_grid_key(cube, cube.img.shape)
@@ -0,0 +1,31 @@
+import numpy as np
+
+from pyciss import meta
+from pyciss.resonance_catalog import ResonanceCatalog, radius_range
+
+
+def test_radius_range():
+    radius = np.array([1.0, 2.0, 2.0, 3.0, 5.0])
+    assert radius_range(radius, 2.0, 5.0) == slice(3, 4)
+    assert radius_range(radius, 0.0, 10.0) == slice(0, 5)
+    assert radius_range(radius, 4.0, 3.0) == slice(4, 4)
+
+
+def test_catalog_matches_tables(tmp_path):
+    path = tmp_path / 'resonances.npz'
+    built = ResonanceCatalog.load(path)
+    assert path.exists()
+    catalog = ResonanceCatalog.load(path)
+    np.testing.assert_array_equal(catalog.radius, built.radius)
+    assert (np.diff(catalog.radius) >= 0).all()
+
+    resonances = meta.get_all_resonances()
+    assert len(catalog) == len(resonances)
+    janus = resonances.query("moon == 'janus1' and reson == '2:1'").radius.item()
+    assert catalog.get_radius('janus1', '2:1') == janus
+    mimas = resonances.loc[resonances.name == 'Mimas 2:1', 'radius'].item()
+    assert catalog.get_radius('Mimas', '2:1') == mimas
+
+    inside = catalog.to_dataframe().iloc[catalog.between(96000, 97000)]
+    expected = resonances[(resonances.radius > 96000) & (resonances.radius < 97000)]
+    assert sorted(inside.name) == sorted(expected.name)
@@ -0,0 +1,111 @@
+import os
+import signal
+import time
+
+import numpy as np
+import pytest
+
+from pyciss import scheduler, synthetic
+from pyciss.scheduler import MemoryScheduler
+
+MB = 2**20
+
+
+def timed(item):
+    "Job returning its run time, to check what ran concurrently."
+    start = time.monotonic()
+    if item == "bad":
+        raise ValueError(item)
+    time.sleep(0.05)
+    return item, start, time.monotonic()
+
+
+def max_concurrent_memory(results, memory):
+    events = sorted(
+        [(start, m) for (_, start, _), m in zip(results, memory)]
+        + [(end, -m) for (_, _, end), m in zip(results, memory)]
+    )
+    used = peak = 0
+    for _, m in events:
+        used += m
+        peak = max(peak, used)
+    return peak
+
+
+def test_parse_bytes():
+    assert scheduler.parse_bytes(1000) == 1000
+    assert scheduler.parse_bytes("512M") == 512 * MB
+    assert scheduler.parse_bytes("1.5 GiB") == 1536 * MB
+    with pytest.raises(ValueError):
+        scheduler.parse_bytes("lots")
+
+
+def test_cube_memory(tmp_path):
+    cube = synthetic.write_cube(tmp_path / "a.cub", np.zeros((100, 300)))
+    assert scheduler.cube_bytes(cube) == 100 * 300 * 4
+    assert scheduler.estimate_memory(cube, factor=2, overhead=10) == 240010
+    label = tmp_path / "N1454725799_1.LBL"
+    label.write_text(
+        "OBJECT = IMAGE\n LINES = 1024\n LINE_SAMPLES = 1024\n"
+        " SAMPLE_BITS = 16\nEND_OBJECT = IMAGE\nEND\n"
+    )
+    assert scheduler.cube_bytes(label) == 2 * MB
+    assert scheduler.estimate_memory(tmp_path / "missing.cub", overhead=0) == (
+        scheduler.CUBE_FACTOR * scheduler.DEFAULT_CUBE_BYTES
+    )
+
+
+def test_projected_cube_bytes():
+    # 1000 km at 500 m/pixel, 10 degrees around the ring at 130000 km
+    nbytes = scheduler.projected_cube_bytes(129000, 130000, 355, 5, 500)
+    samples = np.ceil(np.deg2rad(10) * 130e6 / 500)
+    assert nbytes == 2000 * samples * 4
+    assert scheduler.projected_cube_bytes(129000, 130000, 0, 360, 500) > 30 * nbytes
+
+
+def test_scheduler_keeps_budget():
+    items = list(range(12))
+    memory = [300 * MB if i % 3 == 0 else 100 * MB for i in items]
+    sched = MemoryScheduler(budget="500M", processes=4)
+    results = sched.map(timed, items, memory)
+    assert [r[0] for r in results] == items
+    assert sched.peak <= 500 * MB
+    assert max_concurrent_memory(results, memory) <= 500 * MB
+
+
+def test_scheduler_runs_oversized_jobs_alone():
+    memory = [2000 * MB, 100 * MB, 100 * MB]
+    results = MemoryScheduler(budget="500M", processes=3).map(timed, "abc", memory)
+    big, small = results[0], results[1:]
+    assert all(s[1] >= big[2] or s[2] <= big[1] for s in small)
+
+
+def test_scheduler_raises_job_errors():
+    with pytest.raises(ValueError):
+        MemoryScheduler(budget="1G", processes=2).map(
+            timed, ["a", "bad", "c"], lambda item: MB
+        )
+
+
+def killed(item):
+    "Job whose worker dies, like one killed by the OOM killer."
+    if item == "oom":
+        os.kill(os.getpid(), signal.SIGKILL)
+    return timed(item)
+
+
+def test_scheduler_reports_dead_workers(monkeypatch):
+    monkeypatch.setattr(scheduler, "POLL_INTERVAL", 0.1)
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="died"):
+        MemoryScheduler(budget="1G", processes=2).map(
+            killed, ["a", "oom", "c", "d"], lambda item: MB
+        )
+    assert time.monotonic() - start < 30
+
+
+def test_scheduler_admits_largest_fitting_job():
+    memory = [100 * MB, 300 * MB, 200 * MB, 300 * MB, 50 * MB]
+    results = MemoryScheduler(budget="500M", processes=1).map(timed, "abcde", memory)
+    starts = sorted(range(5), key=lambda i: results[i][1])
+    assert starts == [1, 3, 2, 0, 4]
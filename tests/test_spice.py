@@ -0,0 +1,153 @@
+import datetime as dt
+import sqlite3
+
+import numpy as np
+
+from pyciss import labels, spice, synthetic
+
+KERNELS = """  Group = Kernels
+    NaifFrameCode       = -82360
+    LeapSecond          = $base/kernels/lsk/naif0012.tls
+    TargetAttitudeShape = ($base/kernels/pck/pck00009.tpc,
+                           $cassini/kernels/pck/cpck15Dec2017.tpc)
+    TargetPosition      = (Table, $base/kernels/spk/de430.bsp)
+    InstrumentPointing  = (Table, $cassini/kernels/ck/{ck}.bc,
+                           $cassini/kernels/fk/cas_v40.tf)
+    InstrumentPosition  = (Table, $cassini/kernels/spk/{spk}.bsp)
+    InstrumentAddendum  = $cassini/kernels/iak/{iak}.ti
+    ShapeModel          = Null
+  End_Group
+"""
+
+
+def fake_spiceinit(calls, ck="08001_08006ra", spk="080117R_SCPSE_07365_08045"):
+    "spiceinit that writes a Kernels group into the cube label."
+    def spiceinit(from_, **kwargs):
+        calls.append(kwargs)
+        text = labels.read_label_bytes(from_).decode("ascii")
+        camera = "NA" if "ISSNA" in text else "WA"
+        group = KERNELS.format(ck=ck, spk=spk, iak=f"Iss{camera}Addendum004")
+        text = text.replace("  Group = BandBin", group + "\n  Group = BandBin", 1)
+        with open(str(from_), "r+b") as f:
+            f.write(text.encode("ascii").ljust(synthetic.START_BYTE - 1, b" "))
+    return spiceinit
+
+
+def make_cube(path, time, instrument_id="ISSNA"):
+    return synthetic.write_cube(
+        path, np.zeros((4, 4)), imagetime=time, instrument_id=instrument_id
+    )
+
+
+def test_kernels_from_label(tmp_path):
+    cube = make_cube(tmp_path / "a.cub", dt.datetime(2008, 1, 2))
+    fake_spiceinit([])(cube)
+    kernels = spice.kernels_from_label(labels.read_label(cube))
+    assert kernels["ck"] == "($cassini/kernels/ck/08001_08006ra.bc)"
+    assert kernels["spk"] == "($cassini/kernels/spk/080117R_SCPSE_07365_08045.bsp)"
+    assert kernels["lsk"] == "($base/kernels/lsk/naif0012.tls)"
+    assert kernels["pck"].count(".tpc") == 2
+    assert "fk" not in kernels
+
+
+def test_kernel_cache_ranges(tmp_path):
+    with spice.KernelCache(tmp_path / "k.sqlite", max_gap=3600) as cache:
+        assert cache.lookup("2008-01-02T00:00:00") is None
+        cache.add("2008-01-02T00:00:00", {"ck": "(a.bc)"})
+        cache.add("2008-01-02T00:30:00", {"ck": "(a.bc)"})
+        cache.add("2008-01-02T00:10:00", {"ck": "(b.bc)"})
+        # too far away to extend the range
+        cache.add("2008-01-02T03:00:00", {"ck": "(a.bc)"})
+        assert cache.lookup("2008-002T00:20:00.000") == {"ck": "(a.bc)"}
+        assert cache.lookup(dt.datetime(2008, 1, 2, 1)) is None
+        ranges = cache.ranges()
+    assert len(ranges) == 3
+    assert ranges.stop[0] == dt.datetime(2008, 1, 2, 0, 30)
+
+
+def test_spiceinit_cached(tmp_path):
+    calls = []
+    spiceinit = fake_spiceinit(calls)
+    cache = spice.KernelCache(tmp_path / "k.sqlite")
+    first = make_cube(tmp_path / "a.cub", dt.datetime(2008, 1, 2))
+    second = make_cube(tmp_path / "b.cub", dt.datetime(2008, 1, 2, 2))
+    assert not spice.spiceinit_cached(first, cache, spiceinit, shape="ringplane")
+    # outside of the cached range, so spiceinit searches again
+    assert not spice.spiceinit_cached(second, cache, spiceinit, shape="ringplane")
+    assert spice.spiceinit_cached(first, cache, spiceinit, shape="ringplane")
+    assert "ck" not in calls[0] and "ck" not in calls[1]
+    assert calls[2]["ck"] == "($cassini/kernels/ck/08001_08006ra.bc)"
+    assert calls[2]["shape"] == "ringplane"
+    assert len(cache.ranges()) == 1
+    assert not spice.spiceinit_cached(first, None, spiceinit)
+
+
+def test_spiceinit_cached_by_camera_and_options(tmp_path):
+    calls = []
+    spiceinit = fake_spiceinit(calls)
+    cache = spice.KernelCache(tmp_path / "k.sqlite")
+    time = dt.datetime(2008, 1, 2)
+    nac = make_cube(tmp_path / "N.cub", time)
+    wac = make_cube(tmp_path / "W.cub", time, instrument_id="ISSWA")
+    assert not spice.spiceinit_cached(nac, cache, spiceinit, shape="ringplane")
+    # same time, but the other camera has its own instrument kernels
+    assert not spice.spiceinit_cached(wac, cache, spiceinit, shape="ringplane")
+    # same camera and time with other parameters
+    assert not spice.spiceinit_cached(nac, cache, spiceinit, shape="ellipsoid")
+    assert spice.spiceinit_cached(wac, cache, spiceinit, shape="ringplane")
+    assert calls[-1]["iak"] == "($cassini/kernels/iak/IssWAAddendum004.ti)"
+    ranges = cache.ranges()
+    assert sorted(ranges.instrument) == ["ISSNA", "ISSNA", "ISSWA"]
+    assert cache.lookup(time, "ISSNA", {"shape": "ringplane"})["iak"].count("NA") == 1
+    assert cache.lookup(time, "ISSNA") is None
+
+
+def test_kernel_cache_old_schema(tmp_path):
+    path = tmp_path / "k.sqlite"
+    con = sqlite3.connect(str(path))
+    con.execute("CREATE TABLE ranges (start REAL, stop REAL, kernels TEXT)")
+    con.execute("INSERT INTO ranges VALUES (0, 1, '{}')")
+    con.commit()
+    con.close()
+    with spice.KernelCache(path) as cache:
+        assert cache.ranges().empty
+        cache.add("2008-01-02T00:00:00", {"ck": "(a.bc)"}, "ISSNA")
+        assert cache.lookup("2008-01-02T00:00:00", "ISSNA") == {"ck": "(a.bc)"}
+
+
+def test_group_by_time():
+    t0 = dt.datetime(2008, 1, 2)
+    times = [t0 + dt.timedelta(hours=h) for h in (26, 0, 1, 25, 60)]
+    groups = spice.group_by_time(list("abcde"), window=3 * 3600, times=times)
+    assert groups == [["b", "c"], ["d", "a"], ["e"]]
+
+
+def record_calibration(img_id, kernel_cache=None, fail=()):
+    if img_id in fail:
+        raise RuntimeError(img_id)
+    kernel_cache.add(dt.datetime(2008, 1, 2, int(img_id[1:])), {"ck": "(a.bc)"})
+
+
+def test_calibrate_grouped(tmp_path):
+    t0 = dt.datetime(2008, 1, 2)
+    img_ids = ["N0", "N1", "N2", "N20"]
+    times = [t0 + dt.timedelta(hours=int(i[1:])) for i in img_ids]
+    cache = spice.KernelCache(tmp_path / "k.sqlite", max_gap=3600)
+    results = spice.calibrate_grouped(
+        img_ids,
+        window=4 * 3600,
+        processes=2,
+        cache=cache,
+        func=record_calibration,
+        times=times,
+        fail=["N1"],
+    )
+    status = results.set_index("img_id").status
+    assert status.to_dict() == {
+        "N0": "calibrated",
+        "N1": "failed",
+        "N2": "calibrated",
+        "N20": "calibrated",
+    }
+    # the workers wrote to the same cache
+    assert len(cache.ranges()) == 3
@@ -0,0 +1,119 @@
+import os
+import sys
+import types
+
+import pytest
+
+from pyciss import downloader, io, store
+
+
+def make_raw(root, content=b"raw"):
+    pm = io.PathManager("N1454725799_1", savedir=root)
+    pm.basepath.mkdir(parents=True)
+    pm.raw_image.write_bytes(content)
+    pm.raw_label.write_text("END\n")
+    return pm
+
+
+def test_calibration_key(tmp_path):
+    pm = make_raw(tmp_path / "db")
+    moved = make_raw(tmp_path / "moved")
+    inputs = store.calibration_inputs(pm, final_resolution=500)
+    assert store.key_of(inputs) == store.key_of(
+        store.calibration_inputs(moved, final_resolution=500)
+    )
+    assert store.key_of(inputs) != store.key_of(
+        store.calibration_inputs(pm, final_resolution=1000)
+    )
+    # without map projection the resolution does not matter
+    assert store.key_of(
+        store.calibration_inputs(pm, do_map_project=False, final_resolution=500)
+    ) == store.key_of(
+        store.calibration_inputs(pm, do_map_project=False, final_resolution=1000)
+    )
+    pm.raw_image.write_bytes(b"other")
+    assert store.key_of(inputs) != store.key_of(store.calibration_inputs(pm))
+
+
+def test_product_name():
+    path = "/db/N1454725799/N1454725799_1.cal.dst.map.cub"
+    assert store.product_name(path) == "cal.dst.map.cub"
+
+
+def test_put_and_fetch(tmp_path):
+    products = store.ProductStore(tmp_path / "store")
+    pm = make_raw(tmp_path / "db")
+    pm.cal_cub.write_bytes(b"cal")
+    pm.dst_cub.write_bytes(b"dst")
+    files = {store.product_name(p): p for p in [pm.cal_cub, pm.dst_cub]}
+    key = store.key_of({"test": 1})
+    assert not products.fetch(key, files)
+    assert products.put(key, files, {"test": 1})
+    assert not products.put(key, files)
+    assert key in products
+    assert products.inputs(key) == {"test": 1}
+
+    other = make_raw(tmp_path / "other")
+    targets = {store.product_name(p): p for p in [other.cal_cub, other.dst_cub]}
+    assert products.fetch(key, targets)
+    assert other.dst_cub.read_bytes() == b"dst"
+    assert os.path.samefile(other.cal_cub, pm.cal_cub)
+    # products not in the entry
+    assert not products.fetch(key, dict(targets, tif=other.tif))
+
+    # computing a product again does not write into the store
+    store.detach([other.cal_cub])
+    assert not other.cal_cub.exists()
+    assert (products.entry(key) / "cal.cub").read_bytes() == b"cal"
+
+
+def test_fetch_copies_without_hard_links(tmp_path, monkeypatch):
+    products = store.ProductStore(tmp_path / "store")
+    source = tmp_path / "a.cal.cub"
+    source.write_bytes(b"cal")
+    key = store.key_of({})
+    products.put(key, {"cal.cub": source})
+
+    def link(*args):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(os, "link", link)
+    target = tmp_path / "b.cal.cub"
+    assert products.fetch(key, {"cal.cub": target})
+    assert target.read_bytes() == b"cal"
+    assert not os.path.samefile(source, target)
+
+
+@pytest.fixture
+def calibrations(monkeypatch):
+    "Arguments of the Calibrators of download_and_calibrate, without ISIS."
+    calls = []
+
+    class Calibrator(object):
+        def __init__(self, img_id, product_store=None, **kwargs):
+            self.product_store = product_store
+
+        def standard_calib(self, from_store=True):
+            calls.append((self.product_store, from_store))
+
+    pipeline = types.ModuleType("pyciss.pipeline")
+    pipeline.Calibrator = Calibrator
+    monkeypatch.setitem(sys.modules, "pyciss.pipeline", pipeline)
+    monkeypatch.setattr(downloader, "download_file_id", lambda img_id: None)
+    return calls
+
+
+def test_download_and_calibrate_uses_store(tmp_path, monkeypatch, calibrations):
+    monkeypatch.setenv("PYCISS_CONFIG", str(tmp_path / "pyciss.ini"))
+    io.set_database_path(str(tmp_path / "db"))
+    pm = make_raw(tmp_path / "db")
+    downloader.download_and_calibrate(pm)
+    (products, from_store), = calibrations
+    assert isinstance(products, store.ProductStore)
+    assert products.root == tmp_path / "db" / ".store"
+    assert from_store
+    shared = store.ProductStore(tmp_path / "shared")
+    downloader.download_and_calibrate(pm, recalibrate=True, product_store=shared)
+    assert calibrations[-1] == (shared, False)
+    downloader.download_and_calibrate(pm, product_store=False)
+    assert calibrations[-1] == (None, True)
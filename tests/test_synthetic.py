@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from pyciss import synthetic
+from pyciss.io import read_cube_img, read_cube_label
+from pyciss.resample import label_grid_key
+
+
+def test_write_cube_roundtrip(tmp_path):
+    data = synthetic.ring_image((60, 80), seed=1)
+    assert (data == synthetic.ISIS_NULL).any()
+    path = synthetic.write_cube(
+        tmp_path / 'N1467345444_1.cal.dst.map.cub', data, 130e6, 131e6, 5.0, 20.0
+    )
+    assert label_grid_key(read_cube_label(path)) == (130.0, 131.0, 60, 5.0, 20.0, 80)
+    img = read_cube_img(path)
+    null = data == synthetic.ISIS_NULL
+    assert np.isnan(img[null]).all()
+    np.testing.assert_allclose(img[~null], data[~null])
+
+
+def test_make_database(tmp_path):
+    paths = synthetic.make_database(tmp_path, n_images=2, shape=(20, 30), n_index_rows=10)
+    assert len(paths['cubes']) == 2
+    for cube in paths['cubes']:
+        assert (cube.parent / (cube.parent.name + '_1.IMG')).exists()
+    df = pd.read_hdf(paths['index'] / 'COISS_2999_ring_summary.hdf', 'df')
+    assert len(df) == 10
+    assert df.FILE_SPECIFICATION_NAME.str.contains(paths['cubes'][0].parent.name).any()
+    assert paths['config'].read_text().count('path = ') == 2
+
+
+def test_ringcube_chunks_read_lazily(tmp_path):
+    from pyciss.ringcube import RingCube, lazy_xarray
+
+    path = synthetic.write_cube(
+        tmp_path / 'N1467345444_1.cal.dst.map.cub', synthetic.ring_image((60, 80), seed=1)
+    )
+    cube = RingCube(str(path))
+    lazy = RingCube(str(path), chunks=16).xarray
+    assert lazy.chunks == ((80,), (16, 16, 16, 12))
+    np.testing.assert_array_equal(lazy.values, cube.xarray.values)
+    np.testing.assert_array_equal(lazy_xarray(path, chunks=16).values, cube.xarray.values)
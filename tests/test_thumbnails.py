@@ -0,0 +1,45 @@
+import numpy as np
+
+from pyciss import thumbnails
+
+
+def test_block_mean_ignores_nan_and_pads():
+    data = np.arange(12, dtype='float64').reshape(3, 4)
+    data[0, 0] = np.nan
+    out = thumbnails.block_mean(data, (2, 2))
+    assert out.shape == (2, 2)
+    assert out[0, 0] == np.mean([1, 4, 5])
+    assert out[1, 1] == np.mean([10, 11])
+
+
+def test_scale_to_uint8():
+    out = thumbnails.scale_to_uint8(np.array([-1, 0, 0.5, 1, 2, np.nan]), 0, 1)
+    assert out.dtype == np.uint8
+    assert out.tolist() == [0, 0, 128, 255, 255, 0]
+
+
+def test_calc_clim_ignores_inf():
+    data = np.linspace(0, 1, 101)
+    data[0] = -np.inf
+    data[1] = np.nan
+    vmin, vmax = thumbnails.calc_clim(data, 0, 100)
+    assert (vmin, vmax) == (data[2], 1)
+
+
+def test_thumbnail_array_orientation():
+    data = np.zeros((100, 40))
+    data[:50] = 1  # low radii, plotted at the bottom by RingCube.imshow
+    out = thumbnails.thumbnail_array(data, size=(20, 10), pmin=0, pmax=100)
+    assert out.shape == (10, 20)
+    assert (out[-1] == 255).all()
+    assert (out[0] == 0).all()
+
+
+def test_write_thumbnails(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'read_cube_img', lambda fname: np.random.rand(50, 30))
+    cubes = [str(tmp_path / 'N1234567890_1.cal.dst.map.cub')]
+    results = thumbnails.write_thumbnails(cubes, size=(16, 16), fmt='jpg')
+    path = results[cubes[0]]
+    assert path == tmp_path / 'N1234567890_1_thumb.jpg'
+    from PIL import Image
+    assert Image.open(str(path)).size == (16, 16)
@@ -0,0 +1,100 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pyciss.transfers import AdaptiveConcurrency, Downloader, TokenBucket
+
+
+class Handler(BaseHTTPRequestHandler):
+    # path -> number of 429 responses to send before the file
+    throttle = {}
+
+    def do_GET(self):
+        if self.throttle.get(self.path, 0) > 0:
+            self.throttle[self.path] -= 1
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        if self.path.startswith('/missing'):
+            self.send_error(404)
+            return
+        body = b'x' * 10000
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    t0 = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - t0 >= 0.19
+
+
+def test_adaptive_concurrency():
+    control = AdaptiveConcurrency(initial=2, max_limit=4)
+    for _ in range(2):
+        control.acquire()
+        control.release(100)
+    assert control.limit == 3
+    control.acquire()
+    control.backoff()
+    control.fail()
+    assert control.limit == 1
+    assert control.active == 0
+
+
+def test_downloader(server, tmp_path):
+    Handler.throttle = {'/b.IMG': 2}
+    downloader = Downloader(rate=100, backoff=0)
+    jobs = [(f'{server}/{name}', tmp_path / name) for name in ['a.IMG', 'b.IMG', 'missing.LBL']]
+    df = downloader.download(jobs).set_index('url')
+    assert (tmp_path / 'a.IMG').stat().st_size == 10000
+    assert (tmp_path / 'b.IMG').stat().st_size == 10000
+    assert not (tmp_path / 'missing.LBL').exists()
+    assert df.loc[f'{server}/b.IMG', 'retries'] == 2
+    assert df.loc[f'{server}/missing.LBL', 'status'] == 404
+    assert df.loc[f'{server}/a.IMG', 'throughput'] > 0
+    summary = downloader.summary()
+    assert summary['files'] == 3
+    assert summary['failed'] == 1
+    assert summary['bytes'] == 20000
+    assert summary['retries'] == 2
+    assert summary['status'] == {200: 2, 404: 1}
+
+
+def test_downloader_local_errors(server, tmp_path):
+    Handler.throttle = {}
+    downloader = Downloader(rate=100, backoff=0)
+    # the file cannot replace a directory
+    (tmp_path / 'a.IMG').mkdir()
+    jobs = [
+        (f'{server}/a.IMG', tmp_path / 'a.IMG'),
+        (f'{server}/b.IMG', tmp_path / 'missing' / 'b.IMG'),
+    ]
+    df = downloader.download(jobs)
+    assert df.status.isna().all()
+    assert df.error.str.contains('Error').all()
+    assert (df.retries == 0).all()
+    assert not (tmp_path / 'a.IMG.part').exists()
+    assert downloader.summary()['failed'] == 2
+    # the slots of the failed transfers are free again
+    record = downloader.fetch(f'{server}/c.IMG', tmp_path / 'c.IMG')
+    assert record['status'] == 200
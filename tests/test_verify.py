@@ -0,0 +1,79 @@
+import pytest
+
+from pyciss import labels, synthetic, verify
+
+LABEL = 'PDS_VERSION_ID = PDS3\nRECORD_BYTES = 10\nFILE_RECORDS = 3\nEND\n'
+
+TILED = """Object = IsisCube
+  Object = Core
+    StartByte   = 65537
+    Format      = Tile
+    TileSamples = 128
+    TileLines   = 128
+
+    Group = Dimensions
+      Samples = 200
+      Lines   = 100
+      Bands   = 1
+    End_Group
+
+    Group = Pixels
+      Type       = Real
+    End_Group
+  End_Object
+End_Object
+
+Object = History
+  Name      = IsisCube
+  StartByte = 200000
+  Bytes     = 500
+End_Object
+End
+"""
+
+
+def test_expected_cube_bytes():
+    layout = labels.cube_layout(labels.Label(TILED))
+    assert layout['blobs'] == [(200000, 500)]
+    # 2 x 1 tiles of 128 x 128 real pixels end at 196608, the history later
+    assert verify.expected_cube_bytes(layout) == 200499
+
+
+@pytest.fixture
+def db(tmp_path):
+    data = synthetic.ring_image((20, 30), seed=0)
+    for img_id, cut, img_bytes, label in [
+        ('N1000000001', 0, 30, LABEL),
+        ('N1000000002', 100, 20, LABEL),
+        ('N1000000003', 0, 30, LABEL[:-4]),
+    ]:
+        folder = tmp_path / img_id
+        folder.mkdir()
+        cube = synthetic.write_cube(
+            folder / f'{img_id}_1.cal.dst.map.cub', data, 130e6, 131e6, 0.0, 10.0
+        )
+        if cut:
+            with open(cube, 'r+b') as f:
+                f.truncate(cube.stat().st_size - cut)
+        (folder / f'{img_id}_1.LBL').write_text(label)
+        (folder / f'{img_id}_1.IMG').write_bytes(b'x' * img_bytes)
+    return tmp_path
+
+
+def test_verify_database(db):
+    results = verify.verify_database(db, max_workers=2, chunksize=2)
+    assert len(results) == 9
+    status = results.set_index(['img_id', 'product']).status
+    assert (status.loc['N1000000001'] == 'ok').all()
+    assert status.loc[('N1000000002', 'cubepath')] == 'truncated'
+    assert status.loc[('N1000000002', 'raw_image')] == 'truncated'
+    assert status.loc[('N1000000003', 'raw_label')] == 'truncated'
+    assert status.loc[('N1000000003', 'raw_image')] == 'ok'
+
+    repairs = verify.write_repair_list(results, db / 'repairs.csv')
+    assert (db / 'repairs.csv').exists()
+    assert list(zip(repairs.img_id, repairs.action)) == [
+        ('N1000000002', 'calibrate'),
+        ('N1000000002', 'download'),
+        ('N1000000003', 'download'),
+    ]
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyciss import catalogs, workers
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    monkeypatch.setattr(catalogs, '_tables', {})
+    resonances = pd.DataFrame(
+        dict(moon=['janus', 'mimas'], reson=['2:1', '3:2'], radius=[96.2, 122.0])
+    )
+    catalogs.install('resonances', resonances)
+    catalogs.install('ring_summary', None)
+    return resonances
+
+
+def test_share_frame_roundtrip():
+    df = pd.DataFrame(dict(a=np.arange(5.0), b=list('abcde')), index=np.arange(5) * 2)
+    blocks, spec = workers.share_frame(df)
+    try:
+        attached, handles = workers.attach_frame(spec)
+        pd.testing.assert_frame_equal(attached, df)
+        assert not attached.a.to_numpy().flags.writeable
+        for shm in handles:
+            shm.close()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def test_share_array():
+    small = np.arange(10)
+    assert workers.share_array(small) is small
+    big = np.random.rand(100, 100)
+    handle = workers.share_array(big)
+    assert isinstance(handle, workers.SharedArray)
+    np.testing.assert_array_equal(workers.fetch(handle), big)
+
+
+def _resonance_radii(n):
+    return np.repeat(catalogs.get('resonances').radius.to_numpy(), n)
+
+
+def test_map_arrays(tables):
+    results = workers.map_arrays(_resonance_radii, [1, 10000], processes=2)
+    np.testing.assert_array_equal(results[0], tables.radius)
+    assert results[1].shape == (20000,)
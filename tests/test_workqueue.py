@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import sys
+import types
+
+from pyciss import downloader, io
+from pyciss.workqueue import WorkQueue, main
+
+
+def record_item(item):
+    "Job that records which process processed an item."
+    queue_root = os.environ["PYCISS_TEST_QUEUE"]
+    with open(os.path.join(queue_root, "log"), "a") as f:
+        f.write(item + "\n")
+    if item == "bad":
+        raise RuntimeError("bad image")
+
+
+def run_worker(root):
+    os.environ["PYCISS_TEST_QUEUE"] = str(root)
+    WorkQueue(root, max_attempts=2).work(record_item, poll=0.01)
+
+
+def test_add_and_claim(tmp_path):
+    queue = WorkQueue(tmp_path)
+    assert queue.add(["a", "b", "a"]) == 2
+    assert queue.counts() == dict(pending=2, claimed=0, done=0, failed=0)
+    assert queue.claim() == "a"
+    assert queue.owns("a")
+    assert queue.add(["a"]) == 0
+    assert queue.complete("a", dict(wall=1.0))
+    assert queue.add(["a"]) == 0
+    assert queue.add(["a"], force=True) == 1
+    assert queue.counts() == dict(pending=2, claimed=0, done=0, failed=0)
+
+
+def test_stale_claims_are_requeued(tmp_path):
+    queue = WorkQueue(tmp_path, lease=60)
+    other = WorkQueue(tmp_path, lease=60)
+    other.worker = "othernode:1"
+    queue.add(["a"])
+    assert queue.claim() == "a"
+    assert other.requeue_stale() == []
+    # no heartbeat for two minutes
+    claimed = tmp_path / "claimed" / "a"
+    old = other.now() - 120
+    os.utime(str(claimed), (old, old))
+    assert other.requeue_stale() == ["a"]
+    assert other.claim() == "a"
+    assert not queue.owns("a")
+    # the late worker keeps its result but does not release the new claim
+    assert not queue.complete("a")
+    assert claimed.exists()
+    assert other.complete("a")
+    assert queue.results().loc[0, "attempts"] == 2
+
+
+def test_failures_are_retried(tmp_path):
+    queue = WorkQueue(tmp_path, max_attempts=2)
+    queue.add(["a"])
+    queue.claim()
+    queue.fail("a", "RuntimeError()")
+    assert queue.items("pending") == ["a"]
+    queue.claim()
+    queue.fail("a", "RuntimeError()")
+    assert queue.items("failed") == ["a"]
+    results = queue.results()
+    assert results.loc[0, "error"] == "RuntimeError()"
+    assert queue.retry_failed() == 1
+    assert queue.claim() == "a"
+
+
+def test_workers_share_the_queue(tmp_path, n_workers=3):
+    items = ["img{:02d}".format(i) for i in range(30)] + ["bad"]
+    WorkQueue(tmp_path).add(items)
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(tmp_path,))
+        for _ in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    log = (tmp_path / "log").read_text().split()
+    # every image exactly once, the failing one up to max_attempts
+    assert sorted(i for i in log if i != "bad") == items[:-1]
+    assert log.count("bad") == 2
+    queue = WorkQueue(tmp_path)
+    assert queue.counts() == dict(pending=0, claimed=0, done=30, failed=1)
+
+
+def test_main(tmp_path, capsys):
+    main([str(tmp_path), "add", "a", "b"])
+    assert "Queued 2 images." in capsys.readouterr().out
+    main([str(tmp_path), "status"])
+    assert "'pending': 2" in capsys.readouterr().out
+
+
+def test_default_job_calibrates(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYCISS_CONFIG", str(tmp_path / "pyciss.ini"))
+    io.set_database_path(str(tmp_path / "db"))
+    calibrated = []
+
+    def download(img_id):
+        pm = io.PathManager(img_id + "_1", savedir=tmp_path / "db")
+        pm.basepath.mkdir(parents=True)
+        pm.raw_image.write_bytes(b"raw")
+        pm.raw_label.write_text("END\n")
+
+    class Calibrator(object):
+        "Stands in for the ISIS pipeline."
+
+        def __init__(self, img_id, product_store=None, **kwargs):
+            self.img_id = img_id
+
+        def standard_calib(self, from_store=True):
+            calibrated.append(self.img_id)
+
+    pipeline = types.ModuleType("pyciss.pipeline")
+    pipeline.Calibrator = Calibrator
+    monkeypatch.setitem(sys.modules, "pyciss.pipeline", pipeline)
+    monkeypatch.setattr(downloader, "download_file_id", download)
+    queue = WorkQueue(tmp_path / "queue")
+    queue.add(["N1454725799"])
+    assert queue.work(poll=0.01) == 1
+    assert queue.counts()["done"] == 1
+    assert calibrated == ["N1454725799"]